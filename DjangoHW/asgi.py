@@ -9,9 +9,13 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 
 from websocket.routing import websocket_urlpatterns
+from utils.utils_cursor import start_flusher
 
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     'websocket': AuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
 })
+
+# write-behind cursors reach database within their interval even when no request comes
+start_flusher()
@@ -57,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.utils_admission.AdmissionMiddleware',
 ]
 
 ROOT_URLCONF = 'DjangoHW.urls'
@@ -85,11 +86,29 @@ WSGI_APPLICATION = 'DjangoHW.wsgi.application'
 
 ASGI_APPLICATION = 'DjangoHW.asgi.application'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# Set IM_BROKER (e.g. unix:/tmp/im-broker.sock) to share one channel layer between several workers,
+# the broker is started with `python -m websocket.broker $IM_BROKER`
+if os.getenv('IM_BROKER') is None:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
     }
-}
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "websocket.layers.BrokerChannelLayer",
+            "CONFIG": {
+                "address": os.getenv('IM_BROKER'),
+                "presence_prefix": "user.",  # groups of utils.utils_websocket.user_group
+            },
+        }
+    }
+
+# Message rings (utils/utils_ring.py) and the membership cache (utils/utils_group.py) live in each process
+# and only see the messages and memberships changed by it: they are off once several workers share the broker
+MESSAGE_RINGS = os.getenv('IM_BROKER') is None
+GROUP_CACHE = os.getenv('IM_BROKER') is None
 
 
 # Database
@@ -98,7 +117,7 @@ CHANNEL_LAYERS = {
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'database/db.sqlite3',
+        'NAME': os.getenv('IM_DATABASE', BASE_DIR / 'database/db.sqlite3'),
     }  # Change to MySQL or other databases for your FINAL project
 }
 
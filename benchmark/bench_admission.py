@@ -0,0 +1,110 @@
+"""
+Latency under overload, without and with the admission control of utils.utils_admission.
+
+Requests arrive at a fixed rate whatever the response time (open loop): msg/fetch through the ASGI
+handler, as bulk reads, and chat sends through websocket.views.aon_message. The serial cost of each
+is measured first, and each gets half of LOAD times the capacity of the database thread (3x: the
+server could serve a third of what is offered). Reported per variant and kind: latency of the
+requests served, and how many were shed.
+
+    python -m benchmark.bench_admission [LOAD] [SECONDS]
+"""
+import sys
+import time
+import asyncio
+
+from benchmark.common import setup_db, create_users, create_group, report
+
+from django.test import AsyncClient
+
+from im.models import Message
+from utils import utils_admission
+from utils.utils_admission import Overloaded
+from utils.utils_jwt import generate_jwt_token
+from websocket.views import aon_message
+
+
+async def serial_cost(call, rounds=50):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await call()
+    return (time.perf_counter() - start) / rounds
+
+
+async def run(fetch, send, load, seconds):
+    bulk_cost = await serial_cost(fetch)
+    chat_cost = await serial_cost(send)
+    print(f"serial cost: msg/fetch {bulk_cost * 1000:.2f}ms, chat send {chat_cost * 1000:.2f}ms")
+
+    for name, limited in [("no admission", False), ("admission", True)]:
+        if limited:
+            utils_admission.ADMISSION_LIMIT, utils_admission.ADMISSION_RESERVED = limit
+            utils_admission.ADMISSION_DEADLINE.update(deadline)
+            utils_admission.ADMISSION_QUEUE.update(queue)
+        else:
+            limit = (utils_admission.ADMISSION_LIMIT, utils_admission.ADMISSION_RESERVED)
+            deadline = dict(utils_admission.ADMISSION_DEADLINE)
+            queue = dict(utils_admission.ADMISSION_QUEUE)
+            utils_admission.ADMISSION_LIMIT, utils_admission.ADMISSION_RESERVED = 1 << 30, 0
+            utils_admission.ADMISSION_DEADLINE.update({"chat": 3600, "bulk": 3600})
+            utils_admission.ADMISSION_QUEUE.update({"chat": 1 << 30, "bulk": 1 << 30})
+
+        latencies = {"bulk": [], "chat": []}
+        shed = {"bulk": 0, "chat": 0}
+
+        async def request(kind, call):
+            start = time.perf_counter()
+            try:
+                if await call() is False:
+                    shed[kind] += 1
+                    return
+            except Overloaded:
+                shed[kind] += 1
+                return
+            latencies[kind].append(time.perf_counter() - start)
+
+        async def arrivals(kind, call, interval):
+            tasks = []
+            start = time.perf_counter()
+            i = 0
+            while time.perf_counter() - start < seconds:
+                tasks.append(asyncio.create_task(request(kind, call)))
+                i += 1
+                await asyncio.sleep(max(0, start + i * interval - time.perf_counter()))
+            await asyncio.gather(*tasks)
+
+        await asyncio.gather(arrivals("bulk", fetch, 2 * bulk_cost / load),
+                             arrivals("chat", send, 2 * chat_cost / load))
+        for kind in ["chat", "bulk"]:
+            report(f"{name}, {kind}, {load}x load", latencies[kind])
+            print(f"{name}, {kind}: {shed[kind]} shed of {shed[kind] + len(latencies[kind])}")
+
+
+def main():
+    args = sys.argv[1:]
+    load = float(args[0]) if len(args) > 0 else 3
+    seconds = float(args[1]) if len(args) > 1 else 5
+
+    setup_db()
+    users = create_users("user", 20)
+    group = create_group("bench", users)
+    Message.objects.bulk_create([Message(sender=users[0], group=group, msg_type="text", msg_body=f"bench {i}")
+                                 for i in range(200)])
+
+    client = AsyncClient()
+    token = generate_jwt_token(users[1].user_name)
+
+    async def fetch():
+        res = await client.get("/api/msg/fetch", {"group_id": group.group_id}, authorization=token)
+        return res.status_code == 200
+
+    content = {"group_id": group.group_id, "msg_type": "text", "msg_body": "hello"}
+
+    async def send():
+        await aon_message(users[0].user_name, content)
+
+    asyncio.run(run(fetch, send, load, seconds))
+
+
+if __name__ == "__main__":
+    main()
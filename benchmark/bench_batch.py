@@ -0,0 +1,64 @@
+"""
+Throughput of a bot sending messages through ChatConsumer, one message per frame against batches of
+BATCH messages per frame (websocket.views.on_messages).
+
+The bot is a member of a group of MEMBERS users, ONLINE of them with a connection on the channel
+layer, and sends MESSAGES messages, waiting for the echo of each frame before the next one.
+Reported: messages/sec and queries per message.
+
+    python -m benchmark.bench_batch [MESSAGES] [MEMBERS] [ONLINE] [BATCH ...]
+"""
+import sys
+import time
+
+from benchmark.common import setup_db, create_users, create_group
+from benchmark.bench_fanout import set_online
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import async_to_sync
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import Message
+from utils.utils_jwt import generate_jwt_token
+from websocket.consumers import ChatConsumer
+
+
+async def run(user_name, group, count, batch):
+    ws = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user_name}?{generate_jwt_token(user_name)}&sync")
+    connected, _ = await ws.connect()
+    assert connected
+    start = time.perf_counter()
+    for i in range(0, count, batch):
+        contents = [{"group_id": group.group_id, "msg_type": "text", "msg_body": f"bench {j}"}
+                    for j in range(i, min(i + batch, count))]
+        await ws.send_json_to({"type": "message", "content": contents if batch > 1 else contents[0]})
+        received = 0
+        while received < len(contents):
+            received += len(await ws.receive_json_from(timeout=10))
+    elapsed = time.perf_counter() - start
+    await ws.disconnect()
+    return elapsed
+
+
+def main():
+    args = sys.argv[1:]
+    count = int(args[0]) if len(args) > 0 else 1000
+    members = int(args[1]) if len(args) > 1 else 50
+    online = int(args[2]) if len(args) > 2 else 10
+    batches = [int(batch) for batch in args[3:]] or [1, 10, 100]
+
+    setup_db()
+    users = create_users("user", members)
+    group = create_group("bench", users)
+    set_online(users[1:online])
+    print(f"{count} messages to a group of {members} members, {online} online")
+    for batch in batches:
+        Message.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            elapsed = async_to_sync(run)(users[0].user_name, group, count, batch)
+        print(f"{batch:>4} per frame: {count / elapsed:>8.0f} messages/sec, {len(queries) / count:.2f} queries/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Frames written per connection with and without the outbound coalescing window.
+
+K members of a group are online. The group gets bursts of B messages, sent at the same time by
+different members, then stays quiet for GAP ms. Every websocket.send the consumer hands to the
+server is one frame and one write syscall on the socket; the script reports both per second of
+traffic, together with the events carried and the time until the last member got the last message.
+
+    python -m benchmark.bench_coalesce [K] [BURSTS] [B] [GAP] [WINDOW]
+"""
+import sys
+import json
+import time
+import asyncio
+
+from benchmark.common import setup_db, create_users, create_group, get_ws, run_isolated, report, Timer
+
+
+def counting(app, counter):
+    """Wrap an ASGI app to count the text frames it writes to the client."""
+    async def wrapped(scope, receive, send):
+        async def counted_send(message):
+            if message["type"] == "websocket.send":
+                counter["frames"] += 1
+                counter["events"] += len(json.loads(message["text"]))
+            await send(message)
+        return await app(scope, receive, counted_send)
+    return wrapped
+
+
+async def drain(ws, seen: set, total: int):
+    while len(seen) < total:
+        for item in await ws.receive_json_from(timeout=120):
+            if item["type"] == "message":
+                seen.add(item["content"]["msg_id"])
+
+
+async def bench(app, name, counter, users, group, bursts, burst, gap):
+    sockets = []
+    for user in users:
+        ws = get_ws(app, user.user_name)
+        connected, _ = await ws.connect(timeout=120)
+        assert connected
+        await ws.receive_json_from(timeout=120)
+        sockets.append(ws)
+    counter["frames"] = counter["events"] = 0
+
+    seen = [set() for _ in sockets]
+    latencies = []
+    with Timer() as t:
+        for i in range(bursts):
+            start = time.perf_counter()
+            await asyncio.gather(*[sockets[j % len(sockets)].send_json_to({
+                "type": "message",
+                "content": {"group_id": group.group_id, "msg_type": "text", "msg_body": f"burst {i} #{j}"},
+            }) for j in range(burst)])
+            await asyncio.gather(*[drain(ws, s, (i + 1) * burst) for ws, s in zip(sockets, seen)])
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(gap)
+
+    report(f"{name} burst to {len(users)} members", latencies)
+    print(f"{name}: {counter['frames']} frames for {counter['events']} events "
+          f"({counter['events'] / max(counter['frames'], 1):.1f} events/frame), "
+          f"{counter['frames'] / t.elapsed:.0f} frames/s = write syscalls/s")
+
+    for ws in sockets:
+        await ws.disconnect()
+
+
+def run(variant, k, bursts, burst, gap, window):
+    import websocket.outbound
+    from websocket.consumers import ChatConsumer
+    websocket.outbound.OUTBOUND_COALESCE_WINDOW = window / 1000 if variant == "coalesce" else 0
+    counter = {"frames": 0, "events": 0}
+    app = counting(ChatConsumer.as_asgi(), counter)
+
+    setup_db()
+    users = create_users("user", k)
+    group = create_group("bench", users)
+    name = f"window={window}ms" if variant == "coalesce" else "no window"
+    asyncio.run(bench(app, name, counter, users, group, bursts, burst, gap / 1000))
+
+
+def main():
+    args = sys.argv[1:]
+    variant = args.pop(0) if args and args[0] in {"plain", "coalesce"} else None
+    k = int(args[0]) if len(args) > 0 else 50
+    bursts = int(args[1]) if len(args) > 1 else 20
+    burst = int(args[2]) if len(args) > 2 else 10
+    gap = float(args[3]) if len(args) > 3 else 50
+    window = float(args[4]) if len(args) > 4 else 5
+
+    if variant is None:
+        run_isolated("benchmark.bench_coalesce", ["plain", "coalesce"], k, bursts, burst, gap, window)
+    else:
+        run(variant, k, bursts, burst, gap, window)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare the async ChatConsumer with the thread-based SyncChatConsumer.
+
+- connect: N clients connect at the same time, time until each got its login frame
+- message: one member of a group with K online members sends M messages,
+           time until the last member received each message
+
+Each frame written to a client is delayed by DELAY ms to model a socket that is not
+immediately writable; the sync consumer holds its thread while it waits.
+
+    python -m benchmark.bench_consumer [N] [K] [M] [DELAY]
+"""
+import sys
+import time
+import asyncio
+
+from benchmark.common import setup_db, create_users, create_group, get_ws, slow_send, run_isolated, report, Timer
+
+
+async def bench_connect(app, name, users):
+    latencies = []
+
+    async def one(user):
+        ws = get_ws(app, user.user_name)
+        start = time.perf_counter()
+        connected, _ = await ws.connect(timeout=120)
+        assert connected
+        await ws.receive_json_from(timeout=120)
+        latencies.append(time.perf_counter() - start)
+        return ws
+
+    with Timer() as t:
+        sockets = await asyncio.gather(*[one(user) for user in users])
+    report(f"{name} connect", latencies)
+    print(f"{name} connect rate: {len(users) / t.elapsed:.1f} conn/s")
+    for ws in sockets:
+        await ws.disconnect()
+
+
+async def bench_message(app, name, users, group, rounds):
+    sockets = []
+    for user in users:
+        ws = get_ws(app, user.user_name)
+        connected, _ = await ws.connect(timeout=120)
+        assert connected
+        await ws.receive_json_from(timeout=120)
+        sockets.append(ws)
+
+    latencies = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        await sockets[0].send_json_to({
+            "type": "message",
+            "content": {"group_id": group.group_id, "msg_type": "text", "msg_body": f"bench {i}"},
+        })
+        await asyncio.gather(*[ws.receive_json_from(timeout=120) for ws in sockets])
+        latencies.append(time.perf_counter() - start)
+    report(f"{name} message to {len(users)} members", latencies)
+
+    for ws in sockets:
+        await ws.disconnect()
+
+
+def run(variant, n, k, m, delay):
+    from websocket.consumers import ChatConsumer, SyncChatConsumer
+    consumer = ChatConsumer if variant == "async" else SyncChatConsumer
+    app = slow_send(consumer.as_asgi(), delay / 1000)
+
+    setup_db()
+    users = create_users("user", n)
+    group = create_group("bench", users[:k])
+    asyncio.run(bench_connect(app, consumer.__name__, users))
+    asyncio.run(bench_message(app, consumer.__name__, users[:k], group, m))
+
+
+def main():
+    args = sys.argv[1:]
+    variant = args.pop(0) if args and args[0] in {"sync", "async"} else None
+    n = int(args[0]) if len(args) > 0 else 500
+    k = int(args[1]) if len(args) > 1 else 100
+    m = int(args[2]) if len(args) > 2 else 20
+    delay = float(args[3]) if len(args) > 3 else 2
+
+    if variant is None:
+        run_isolated("benchmark.bench_consumer", ["sync", "async"], n, k, m, delay)
+    else:
+        run(variant, n, k, m, delay)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Two devices of one user: the phone stays online while the laptop connects and disconnects ROUNDS
+times, MESSAGES messages arriving in between (pushed to whichever devices are online, never acked).
+Every connect of the laptop sends the login catch-up to the user, the phone included.
+
+Reported: message events and bytes the phone received, and the duplicates utils.utils_device
+removed from what was sent to it.
+
+    python -m benchmark.bench_device [ROUNDS] [MESSAGES]
+"""
+import sys
+import asyncio
+
+from benchmark.common import setup_db, create_users, create_group, get_ws
+
+from channels.db import database_sync_to_async
+
+from im.models import Message
+from utils.utils_device import device_stats
+from websocket.consumers import ChatConsumer
+from websocket.views import push_group
+
+
+async def drain(ws, received):
+    while not await ws.receive_nothing(timeout=0.05):
+        text = (await ws.receive_output())["text"]
+        received["events"] += text.count('"type": "message"')
+        received["bytes"] += len(text)
+
+
+async def run(sender, user, group, rounds, count):
+    app = ChatConsumer.as_asgi()
+    phone = get_ws(app, user.user_name)
+    await phone.connect()
+    await phone.receive_from(timeout=60)
+    received = {"events": 0, "bytes": 0}
+    for i in range(rounds):
+        for j in range(count):
+            msg = await Message.objects.acreate(sender=sender, group=group, msg_type="text", msg_body=f"{i}.{j}")
+            await database_sync_to_async(push_group)(msg)
+        laptop = get_ws(app, user.user_name)
+        await laptop.connect()
+        await laptop.receive_from(timeout=60)
+        await drain(phone, received)
+        await laptop.disconnect()
+    await phone.disconnect()
+    return received
+
+
+def main():
+    args = sys.argv[1:]
+    rounds = int(args[0]) if len(args) > 0 else 50
+    count = int(args[1]) if len(args) > 1 else 10
+
+    setup_db()
+    alice, bob = create_users("user", 2)
+    group = create_group("bench", [alice, bob])
+    received = asyncio.run(run(alice, bob, group, rounds, count))
+    sent = received["events"] + device_stats["duplicates"]
+    print(f"phone: {rounds * count} new messages, sent {sent} message events, "
+          f"received {received['events']} ({received['bytes']:,} bytes), "
+          f"{device_stats['duplicates']} duplicates removed, {device_stats['skipped']} frames not sent")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+HTTP latency of the views that push to websockets, pushing before they return against handing
+the push to the dispatcher of websocket.dispatch once their rows are committed.
+
+A group holds SIZE users, all of them with a connection on the channel layer. Its owner calls
+msg/recall, file/upload and group/announce (each pushed to the whole group) and friend/apply
+(a system message to both users) ROUNDS times each. With the dispatcher, the script also reports
+how long after the last request the queue was delivered.
+
+    python -m benchmark.bench_dispatch [SIZE] [ROUNDS]
+"""
+import sys
+import time
+import tempfile
+
+from benchmark.common import setup_db, create_users, create_group, report
+
+from django.conf import settings
+from django.test import Client
+from django.core.files.uploadedfile import SimpleUploadedFile
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from im.models import Message
+from websocket import dispatch
+from websocket.dispatch import dispatch_stats
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import user_group
+
+
+def set_online(users):
+    layer = get_channel_layer()
+    # nobody reads these channels: keep them from filling up, and from leaving their groups when messages expire
+    layer.capacity = 1 << 20
+    layer.expiry = 86400
+    for user in users:
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(user_group(user.user_name), channel)
+
+
+def requests(owner, users, group, rounds, offset):
+    """(endpoint, callable issuing one request) for every request of the benchmark"""
+    client = Client(HTTP_AUTHORIZATION=generate_jwt_token(owner.user_name))
+    calls = []
+    for i in range(rounds):
+        msg = Message.objects.create(sender=owner, group=group, msg_type="text", msg_body=f"bench {i}")
+        calls.append(("msg/recall", lambda msg=msg: client.post(
+            "/api/msg/recall", data={"msg_id": msg.msg_id}, content_type="application/json")))
+        calls.append(("file/upload", lambda i=i: client.post(
+            f"/api/file/upload?group_id={group.group_id}", data={"file": SimpleUploadedFile(f"bench{i}.txt", b"x" * 1024)})))
+        calls.append(("group/announce", lambda i=i: client.post(
+            "/api/group/announce", data={"group_id": group.group_id, "announcement": f"bench {i}"}, content_type="application/json")))
+        target = users[1 + offset + i]
+        calls.append(("friend/apply", lambda target=target: client.post(
+            "/api/friend/apply", data={"friend_user_id": target.user_id, "message": "hi"}, content_type="application/json")))
+    return calls
+
+
+def main():
+    args = sys.argv[1:]
+    size = int(args[0]) if len(args) > 0 else 200
+    rounds = int(args[1]) if len(args) > 1 else 50
+
+    setup_db()
+    settings.MEDIA_ROOT = tempfile.mkdtemp()
+    users = create_users("user", max(size, 2 * rounds + 1))
+    group = create_group("bench", users[:size])
+    set_online(users)
+
+    for offset, (name, enabled) in enumerate([("push in request", False), ("dispatcher", True)]):
+        dispatch.DISPATCH_ENABLED = enabled
+        latencies = {}
+        queued = dispatch_stats["queued"]
+        for endpoint, call in requests(users[0], users, group, rounds, offset * rounds):
+            start = time.perf_counter()
+            res = call()
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+            assert res.status_code == 200, res.content
+        start = time.perf_counter()
+        while dispatch_stats["delivered"] + dispatch_stats["dropped"] < dispatch_stats["queued"]:
+            time.sleep(0.001)
+        for endpoint, samples in latencies.items():
+            report(f"{endpoint}, {name}, {size} online", samples)
+        if enabled:
+            print(f"dispatcher: {dispatch_stats['queued'] - queued} pushes in {dispatch_stats['batches']} batches, "
+                  f"queue delivered {(time.perf_counter() - start) * 1000:.2f}ms after the last request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Send latency against group size, pushing every message to the members (fan-out on write)
+against sending them a hint to pull it with msg/fetch (fan-out on read).
+
+Groups of each size hold the first SIZE users, of which the first ONLINE * max(SIZE) have a
+connection on the channel layer. One member sends M messages through websocket.views.on_message,
+the whole work done in the sender's request: membership, pushes, delivery cursors.
+
+    python -m benchmark.bench_fanout [M] [ONLINE] [SIZE ...]
+"""
+import sys
+import time
+
+from benchmark.common import setup_db, create_users, create_group, report
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+import utils.utils_group
+from utils.utils_websocket import user_group
+from utils.utils_cursor import flush_cursors
+from websocket.views import on_message
+
+
+def set_online(users):
+    layer = get_channel_layer()
+    # nobody reads these channels: keep them from filling up, and from leaving their groups when messages expire
+    layer.capacity = 1 << 20
+    layer.expiry = 86400
+    for user in users:
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(user_group(user.user_name), channel)
+
+
+def bench(name, users, group, rounds):
+    latencies = []
+    with CaptureQueriesContext(connection) as queries:
+        for i in range(rounds):
+            start = time.perf_counter()
+            on_message(users[0].user_name, {"group_id": group.group_id, "msg_type": "text", "msg_body": f"bench {i}"})
+            latencies.append(time.perf_counter() - start)
+        flush_cursors()
+    report(f"{name} send to {len(users)} members", latencies)
+    print(f"{name} send to {len(users)} members: {len(queries) / rounds:.1f} queries/message")
+
+
+def main():
+    args = sys.argv[1:]
+    rounds = int(args[0]) if len(args) > 0 else 20
+    fraction = float(args[1]) if len(args) > 1 else 0.05
+    sizes = [int(size) for size in args[2:]] or [10, 100, 1000, 10000]
+
+    setup_db()
+    users = create_users("user", max(sizes))
+    set_online(users[:max(1, int(len(users) * fraction))])
+    for size in sizes:
+        group = create_group(f"bench{size}", users[:size])
+        for name, threshold in [("push", float("inf")), ("hint", 0)]:
+            utils.utils_group.FANOUT_READ_THRESHOLD = threshold
+            bench(name, users[:size], group, rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Login catch-up time of a user in G groups of which A got messages while the user was offline,
+reading every group against reading only those of the user's inbox (utils.utils_inbox).
+
+Each active group gets M messages. Rings of recent messages are dropped before every login, as
+after a restart, so that both variants read messages from database.
+
+    python -m benchmark.bench_inbox [G] [A] [M] [ROUNDS]
+"""
+import sys
+import time
+
+from benchmark.common import setup_db, create_users, report
+
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from im.models import Group, Groupmember, Message
+from utils import utils_inbox
+from utils.utils_ring import rings
+from websocket.views import fetch_login_msgs, push_group
+
+
+def main():
+    args = sys.argv[1:]
+    groups = int(args[0]) if len(args) > 0 else 500
+    active = int(args[1]) if len(args) > 1 else 5
+    count = int(args[2]) if len(args) > 2 else 20
+    rounds = int(args[3]) if len(args) > 3 else 20
+
+    setup_db()
+    sender, user = create_users("user", 2)
+    Group.objects.bulk_create([Group(group_name=f"bench{i}", group_owner=sender) for i in range(groups)])
+    group_list = list(Group.objects.order_by("group_id"))
+    Groupmember.objects.bulk_create([Groupmember(group=group, member_user=member, member_role="member")
+                                     for group in group_list for member in [sender, user]])
+
+    # nobody is online: every message lands in the inbox of user
+    utils_inbox.INBOX_ENABLED = True
+    for group in group_list[:: groups // active][:active]:
+        for i in range(count):
+            push_group(Message.objects.create(sender=sender, group=group, msg_type="text", msg_body=f"bench {i}"))
+
+    for name, enabled in [("every group", False), ("inbox", True)]:
+        utils_inbox.INBOX_ENABLED = enabled
+        latencies = []
+        for _ in range(rounds):
+            rings.clear()
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                fetch_login_msgs(user)
+                latencies.append(time.perf_counter() - start)
+        report(f"login, {name}, {groups} groups, {active} active", latencies)
+        print(f"login, {name}: {len(queries)} queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Throughput of the channel layer: InMemoryChannelLayer (one process only) against
+BrokerChannelLayer (shared by workers through websocket.broker).
+
+- send:       one producer sends M messages to one channel, one consumer receives them
+- group_send: M group sends to a group of G channels, every channel receives them
+
+    python -m benchmark.bench_layer [M] [G]
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+
+from benchmark.common import Timer
+
+from django.conf import settings
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+from websocket.layers import BrokerChannelLayer
+
+WINDOW = 50
+
+
+async def bench_send(layer, name, count):
+    channel = await layer.new_channel()
+
+    async def consume():
+        for _ in range(count):
+            await layer.receive(channel)
+
+    with Timer() as t:
+        consumer = asyncio.create_task(consume())
+        for i in range(count):
+            while True:
+                try:
+                    await layer.send(channel, {"type": "bench", "i": i})
+                    break
+                except ChannelFull:
+                    await asyncio.sleep(0)
+        await consumer
+    print(f"{name:<22} send        {count / t.elapsed:10.0f} msg/s")
+
+
+async def bench_group_send(layer, name, count, size):
+    channels = [await layer.new_channel() for _ in range(size)]
+    for channel in channels:
+        await layer.group_add("bench", channel)
+
+    received = [0] * size
+
+    async def consume(index, channel):
+        for _ in range(count):
+            await layer.receive(channel)
+            received[index] += 1
+
+    with Timer() as t:
+        consumers = [asyncio.create_task(consume(index, channel)) for index, channel in enumerate(channels)]
+        for i in range(count):
+            # both layers drop group sends to a full channel, keep the slowest receiver within WINDOW messages
+            while i - min(received) >= WINDOW:
+                await asyncio.sleep(0)
+            await layer.group_send("bench", {"type": "bench", "i": i})
+        await asyncio.gather(*consumers)
+    print(f"{name:<22} group_send  {count / t.elapsed:10.0f} msg/s  {count * size / t.elapsed:10.0f} deliveries/s")
+    for channel in channels:
+        await layer.group_discard("bench", channel)
+
+
+async def run(layer, name, count, size):
+    await bench_send(layer, name, count)
+    await bench_group_send(layer, name, count, size)
+    if hasattr(layer, "close"):
+        await layer.close()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    asyncio.run(run(InMemoryChannelLayer(), "InMemoryChannelLayer", count, size))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        address = f"unix:{tmp}/broker.sock"
+        broker = subprocess.Popen([sys.executable, "-m", "websocket.broker", address, "--capacity", "1000"],
+                                  cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(f"{tmp}/broker.sock"):
+                time.sleep(0.05)
+            asyncio.run(run(BrokerChannelLayer(address=address), "BrokerChannelLayer", count, size))
+        finally:
+            broker.kill()
+            broker.wait()
+
+
+if __name__ == "__main__":
+    main()
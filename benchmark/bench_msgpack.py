@@ -0,0 +1,65 @@
+"""
+Wire size and codec CPU of a login catch-up in JSON against the msgpack subprotocol (websocket/codec.py).
+
+A member of a group with MESSAGES unread messages gets its catch-up frame (fetch_login_msgs, as sent
+by login_fetch). Reported, each timing the mean of ROUNDS runs:
+
+- bytes on the wire in each format
+- server encode: nothing more for JSON (the frame is JSON already), pack_frame for msgpack, and
+  for reference the encoding of the same events from Python objects by either codec
+- client decode: json.loads, against msgpack.unpackb with compact keys and unpack_frame with full names
+
+    python -m benchmark.bench_msgpack [MESSAGES] [ROUNDS]
+"""
+import sys
+import json
+import time
+
+import msgpack
+
+from benchmark.common import setup_db, create_users, create_group
+
+from im.models import Message
+from websocket.views import fetch_login_msgs
+from websocket.codec import pack_frame, unpack_frame, compact, pack_cache
+
+
+def cpu(fn, rounds):
+    start = time.process_time()
+    for _ in range(rounds):
+        fn()
+    return (time.process_time() - start) / rounds
+
+
+def main():
+    args = sys.argv[1:]
+    count = int(args[0]) if len(args) > 0 else 10000
+    rounds = int(args[1]) if len(args) > 1 else 20
+
+    setup_db()
+    alice, bob = create_users("user", 2)
+    group = create_group("bench", [alice, bob])
+    Message.objects.bulk_create([Message(sender=alice, group=group, msg_type="text", msg_body=f"bench message {i}",
+                                         reply_msg_id=None) for i in range(count)])
+    text = fetch_login_msgs(bob)
+    events = json.loads(text)
+    assert len(events) == count
+
+    def pack():
+        pack_cache.clear()
+        return pack_frame(text)
+
+    data = pack()
+    json_bytes = len(text.encode("utf-8"))
+    print(f"login catch-up of {count} messages")
+    print(f"bytes    json {json_bytes:>12,}  msgpack {len(data):>12,}  ({len(data) / json_bytes:.0%})")
+    print(f"encode   json {0:>10.2f}ms  msgpack {cpu(pack, rounds) * 1000:>10.2f}ms  (server, from the JSON frame)")
+    print(f"encode   json {cpu(lambda: json.dumps(events), rounds) * 1000:>10.2f}ms  "
+          f"msgpack {cpu(lambda: msgpack.packb(compact(events)), rounds) * 1000:>10.2f}ms  (from objects)")
+    print(f"decode   json {cpu(lambda: json.loads(text), rounds) * 1000:>10.2f}ms  "
+          f"msgpack {cpu(lambda: msgpack.unpackb(data), rounds) * 1000:>10.2f}ms  "
+          f"(full names {cpu(lambda: unpack_frame(data), rounds) * 1000:.2f}ms)")
+
+
+if __name__ == "__main__":
+    main()
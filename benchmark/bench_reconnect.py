@@ -0,0 +1,86 @@
+"""
+Reconnect storm: N clients, all members of groups with messages they have not acked, connect at
+the same time, as after a worker restart. The catch-up runs inside connect (LOGIN_SYNC_WORKERS = 0)
+against being queued to the login-sync workers of websocket.catchup.
+
+Reported: time until the handshake was accepted, time until the catch-up frame arrived, and the
+connections closed with 1013 by admission control (their clients would come back later).
+
+    python -m benchmark.bench_reconnect [N] [GROUP_SIZE] [MESSAGES]
+"""
+import sys
+import time
+import asyncio
+
+from benchmark.common import setup_db, create_users, get_ws, run_isolated, report
+
+from channels.layers import get_channel_layer
+
+from im.models import Group, Groupmember, Message
+from websocket import catchup
+from websocket.catchup import login_sync_stats
+from websocket.consumers import ChatConsumer
+
+
+async def storm(users):
+    app = ChatConsumer.as_asgi()
+    accepted, caught_up, closed = [], [], []
+
+    async def one(user):
+        ws = get_ws(app, user.user_name)
+        start = time.perf_counter()
+        connected, _ = await ws.connect(timeout=600)
+        accepted.append(time.perf_counter() - start)
+        output = await ws.receive_output(timeout=600)
+        if output["type"] == "websocket.send" and '"reconnect"' not in output["text"]:
+            caught_up.append(time.perf_counter() - start)
+        else:
+            closed.append(user)
+        return ws
+
+    start = time.perf_counter()
+    connections = await asyncio.gather(*[one(user) for user in users])
+    elapsed = time.perf_counter() - start
+    for ws in connections:
+        await ws.disconnect()
+    return accepted, caught_up, closed, elapsed
+
+
+def run(variant, n, group_size, count):
+    setup_db()
+    layer = get_channel_layer()
+    layer.capacity = 1 << 20
+    layer.expiry = 86400
+    users = create_users("user", n)
+    groups = n // group_size
+    Group.objects.bulk_create([Group(group_name=f"bench{i}", group_owner=users[i * group_size]) for i in range(groups)])
+    group_list = list(Group.objects.order_by("group_id"))
+    Groupmember.objects.bulk_create([Groupmember(group=group, member_user=user, member_role="member")
+                                     for i, group in enumerate(group_list)
+                                     for user in users[i * group_size:(i + 1) * group_size]])
+    Message.objects.bulk_create([Message(sender=users[i * group_size], group=group, msg_type="text", msg_body=f"bench {j}")
+                                 for i, group in enumerate(group_list) for j in range(count)])
+
+    catchup.LOGIN_SYNC_WORKERS = 0 if variant == "inline" else catchup.LOGIN_SYNC_WORKERS
+    accepted, caught_up, closed, elapsed = asyncio.run(storm(users[:groups * group_size]))
+    report(f"{variant}, {len(accepted)} clients, handshake", accepted)
+    report(f"{variant}, {len(accepted)} clients, catch-up", caught_up)
+    print(f"{variant}: {len(closed)} closed with 1013, all done in {elapsed:.2f}s, "
+          f"catch-up queue peak {login_sync_stats['max_depth']}")
+
+
+def main():
+    args = sys.argv[1:]
+    variant = args.pop(0) if args and args[0] in {"inline", "pool"} else None
+    n = int(args[0]) if len(args) > 0 else 5000
+    group_size = int(args[1]) if len(args) > 1 else 100
+    count = int(args[2]) if len(args) > 2 else 20
+
+    if variant is None:
+        run_isolated("benchmark.bench_reconnect", ["inline", "pool"], n, group_size, count)
+    else:
+        run(variant, n, group_size, count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Reconnect after a short drop, as a new connection (JWT, user query, login catch-up) against a resume
+with the token of websocket.resume.
+
+A client, member of GROUPS groups with MESSAGES messages it has not acked, drops and comes back
+ROUNDS times, one message being sent to it while it is away. Reported: time from the handshake
+to the frame bringing that message, and database queries per reconnect.
+
+    python -m benchmark.bench_resume [ROUNDS] [GROUPS] [MESSAGES]
+"""
+import sys
+import time
+import asyncio
+
+from benchmark.common import setup_db, create_users, get_ws, report
+
+from django.db import connection
+from channels.db import database_sync_to_async
+
+from im.models import Group, Groupmember, Message
+from utils.utils_websocket import asend_frame, online
+from websocket.views import message_event_text
+from websocket.consumers import ChatConsumer
+
+queries = [0]
+
+
+def count_queries(execute, sql, params, many, context):
+    queries[0] += 1
+    return execute(sql, params, many, context)
+
+
+async def run(sender, user, group, rounds, resumed):
+    app = ChatConsumer.as_asgi()
+    # the thread of database_sync_to_async runs every query of the consumer
+    await database_sync_to_async(lambda: connection.execute_wrappers.append(count_queries))()
+    latencies = []
+    per_reconnect = []
+    flags = b"&resume" if resumed else b""
+    ws = get_ws(app, user.user_name)
+    ws.scope["query_string"] += flags
+    await ws.connect()
+    if resumed:
+        token = (await ws.receive_json_from())[0]["content"]["resume_token"]
+    await ws.receive_from(timeout=60)
+    for i in range(rounds):
+        await ws.disconnect()
+        msg = await Message.objects.acreate(sender=sender, group=group, msg_type="text", msg_body=f"gap {i}")
+        if online(user.user_name):
+            await asend_frame(user.user_name, "[" + message_event_text(msg) + "]")
+        ws = get_ws(app, user.user_name)
+        ws.scope["query_string"] += f"&resume={token}".encode() if resumed else flags
+        queries[0] = 0
+        start = time.perf_counter()
+        await ws.connect()
+        if resumed:
+            session = (await ws.receive_json_from())[0]["content"]
+            assert session["resumed"]
+            token = session["resume_token"]
+        while f"gap {i}" not in await ws.receive_from(timeout=60):
+            pass
+        latencies.append(time.perf_counter() - start)
+        per_reconnect.append(queries[0])
+    await ws.disconnect()
+    return latencies, per_reconnect
+
+
+def main():
+    args = sys.argv[1:]
+    rounds = int(args[0]) if len(args) > 0 else 200
+    groups = int(args[1]) if len(args) > 1 else 20
+    count = int(args[2]) if len(args) > 2 else 20
+
+    setup_db()
+    alice, bob = create_users("user", 2)
+    Group.objects.bulk_create([Group(group_name=f"bench{i}", group_owner=alice) for i in range(groups)])
+    group_list = list(Group.objects.order_by("group_id"))
+    Groupmember.objects.bulk_create([Groupmember(group=group, member_user=user, member_role="member")
+                                     for group in group_list for user in [alice, bob]])
+    Message.objects.bulk_create([Message(sender=alice, group=group, msg_type="text", msg_body=f"bench {j}")
+                                 for group in group_list for j in range(count)])
+
+    for name, resumed in [("new connection", False), ("resume", True)]:
+        latencies, per_reconnect = asyncio.run(run(alice, bob, group_list[0], rounds, resumed))
+        report(f"{name}, reconnect", latencies)
+        print(f"{name}: {sum(per_reconnect) / len(per_reconnect):.1f} queries per reconnect")
+
+
+if __name__ == "__main__":
+    main()
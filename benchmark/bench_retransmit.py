@@ -0,0 +1,59 @@
+"""
+Bytes sent again when a client reconnects: a new connection, with its login catch-up from ack_msg_id
+as before, against a resumed one, sent the frames of its retransmit window (websocket.retransmit)
+trimmed to what its "delivered" frames did not report.
+
+A member of GROUPS groups gets MESSAGES messages per group and connection, reads none of them
+(ack_msg_id stays), and reconnects ROUNDS times. With delivered acks, it reports every message but
+the last LOST of each group, dropped by the network. Reported: bytes per reconnect.
+
+    python -m benchmark.bench_retransmit [ROUNDS] [GROUPS] [MESSAGES] [LOST]
+"""
+import sys
+
+from benchmark.common import setup_db, create_users
+
+from im.models import Group, Groupmember, Message
+from websocket.views import fetch_login_msgs, on_delivered
+from websocket.retransmit import UnackedWindow
+
+
+def main():
+    args = sys.argv[1:]
+    rounds = int(args[0]) if len(args) > 0 else 10
+    groups = int(args[1]) if len(args) > 1 else 20
+    count = int(args[2]) if len(args) > 2 else 20
+    lost = int(args[3]) if len(args) > 3 else 1
+
+    setup_db()
+    alice, bob = create_users("user", 2)
+    Group.objects.bulk_create([Group(group_name=f"bench{i}", group_owner=alice) for i in range(groups)])
+    group_list = list(Group.objects.order_by("group_id"))
+    Groupmember.objects.bulk_create([Groupmember(group=group, member_user=user, member_role="member")
+                                     for group in group_list for user in [alice, bob]])
+
+    before, after = [], []
+    for i in range(rounds):
+        Message.objects.bulk_create([Message(sender=alice, group=group, msg_type="text", msg_body=f"bench {i}.{j}")
+                                     for group in group_list for j in range(count)])
+        delivered = {}
+        for group in group_list:
+            ids = list(Message.objects.filter(group=group).order_by("-msg_id").values_list("msg_id", flat=True)[:lost + 1])
+            delivered[str(group.group_id)] = ids[-1]
+        # the connection is sent its catch-up, and reports what it got
+        window = UnackedWindow()
+        ids = []
+        text = fetch_login_msgs(bob, ids)
+        window.track(text, ids)
+        window.ack(on_delivered(bob.user_id, delivered))
+        before.append(len(fetch_login_msgs(bob).encode()))
+        after.append(sum(len(text.encode()) for text in window.drain()))
+
+    print(f"{groups} groups, {count} messages per group and connection, {lost} lost per group")
+    for name, sizes in [("from ack_msg_id", before), ("resumed", after)]:
+        print(f"{name:<16} first {sizes[0]:>10,} bytes, last {sizes[-1]:>10,} bytes, "
+              f"mean {sum(sizes) // len(sizes):>10,} bytes per reconnect")
+
+
+if __name__ == "__main__":
+    main()
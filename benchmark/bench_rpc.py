@@ -0,0 +1,124 @@
+"""
+REST operations over HTTP against the same operations as rpc frames on a websocket (websocket/rpc.py).
+
+A member of GROUPS groups runs each operation ROUNDS times, over the ASGI HTTP handler (JWT and user
+lookup on every request) and over one ChatConsumer connection. "ack xGROUPS" acks every group: one
+request per group over HTTP, one rpc frame with {"groups": ...} over the websocket. Reported per
+operation: latency, and server CPU time (process time of the benchmark, client included on both sides).
+The user stays connected over both, and gets the system messages of its acks either way.
+
+    python -m benchmark.bench_rpc [ROUNDS] [GROUPS]
+"""
+import sys
+import time
+import asyncio
+
+from benchmark.common import setup_db, create_users, create_group, report
+
+from django.test import AsyncClient
+from asgiref.sync import async_to_sync
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import Message
+from utils.utils_jwt import generate_jwt_token
+from websocket.consumers import ChatConsumer
+
+
+def operations(groups, pools):
+    """(name, method, HTTP verb, list of params lists for each round): one HTTP request or rpc frame per params list."""
+    first = groups[0].group_id
+    return [
+        ("msg/fetch", "msg/fetch", "get", lambda i, side: [{"group_id": first, "after_msg_id": -1}]),
+        ("group/info", "group/info", "get", lambda i, side: [{"group_id": first}]),
+        ("msg/ack", "msg/ack", "post", lambda i, side: [{"group_id": first, "msg_id": pools[first][side][i]}]),
+        (f"ack x{len(groups)}", "msg/ack", "post", lambda i, side: [
+            {"group_id": group.group_id, "msg_id": pools[group.group_id][side][i]} for group in groups]),
+        ("msg/delete", "msg/delete", "delete", lambda i, side: [{"msg_id": pools[first][side][i]}]),
+    ]
+
+
+async def over_http(user, groups, pools, rounds, ws):
+    # the user stays online, its pushes are read and dropped
+    async def drain():
+        while True:
+            await ws.receive_from(timeout=3600)
+
+    drainer = asyncio.get_running_loop().create_task(drain())
+    client = AsyncClient()
+    headers = {"authorization": generate_jwt_token(user.user_name)}
+    results = {}
+    for name, method, verb, params in operations(groups, pools):
+        latencies = []
+        cpu = time.process_time()
+        for i in range(rounds):
+            start = time.perf_counter()
+            for data in params(i, 0):
+                if verb == "get":
+                    res = await client.get(f"/api/{method}", data=data, **headers)
+                else:
+                    res = await getattr(client, verb)(f"/api/{method}", data=data, content_type="application/json", **headers)
+                assert res.status_code == 200, res.content
+            latencies.append(time.perf_counter() - start)
+        results[name] = (latencies, (time.process_time() - cpu) / rounds)
+    drainer.cancel()
+    return results
+
+
+async def over_websocket(user, groups, pools, rounds, ws):
+    results = {}
+    request_id = 0
+    for name, method, _, params in operations(groups, pools):
+        latencies = []
+        cpu = time.process_time()
+        for i in range(rounds):
+            request_id += 1
+            items = params(i, 1)
+            content = items[0] if len(items) == 1 else {"groups": {str(item["group_id"]): item["msg_id"] for item in items}}
+            start = time.perf_counter()
+            await ws.send_json_to({"type": "rpc", "content": {"id": request_id, "method": method, "params": content}})
+            while True:
+                answer = [item for item in await ws.receive_json_from() if item["type"] == "rpc"]
+                if answer:
+                    break
+            assert answer[0]["content"]["id"] == request_id and answer[0]["content"]["status"] == 200, answer
+            latencies.append(time.perf_counter() - start)
+        results[name] = (latencies, (time.process_time() - cpu) / rounds)
+    return results
+
+
+async def run(user, groups, pools, rounds):
+    ws = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user.user_name}?{generate_jwt_token(user.user_name)}&sync")
+    connected, _ = await ws.connect()
+    assert connected
+    http = await over_http(user, groups, pools, rounds, ws)
+    rpc = await over_websocket(user, groups, pools, rounds, ws)
+    await ws.disconnect()
+    return http, rpc
+
+
+def main():
+    args = sys.argv[1:]
+    rounds = int(args[0]) if len(args) > 0 else 200
+    count = int(args[1]) if len(args) > 1 else 10
+
+    setup_db()
+    users = create_users("user", 5)
+    groups = [create_group(f"bench{i}", users) for i in range(count)]
+    Message.objects.bulk_create([Message(sender=users[1], group=group, msg_type="text", msg_body=f"bench {i}")
+                                 for group in groups for i in range(2 * rounds)])
+    # increasing msg_ids to ack and messages to delete, half for each side
+    pools = {}
+    for group in groups:
+        ids = list(Message.objects.filter(group=group).order_by("msg_id").values_list("msg_id", flat=True))
+        pools[group.group_id] = (ids[:rounds], ids[rounds:])
+
+    http, rpc = async_to_sync(run)(users[0], groups, pools, rounds)
+    for name in http:
+        for side, results in [("http", http), ("rpc", rpc)]:
+            latencies, cpu = results[name]
+            report(f"{side} {name}", latencies)
+            print(f"{side} {name}: {cpu * 1000:.2f}ms CPU/operation")
+
+
+if __name__ == "__main__":
+    main()
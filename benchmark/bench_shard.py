@@ -0,0 +1,96 @@
+"""
+Time to last delivery of a group message, sent to every member one after another
+against the sharded fan-out of websocket.fanout.
+
+For each group size N, N online members each wait on their channel; the sender delivers M
+messages (one frame per member, the sender's echo first) and the script reports, per message,
+the time until the echo arrived and until the last member got its frame.
+
+    python -m benchmark.bench_shard [memory|broker] [M] [SIZE ...]
+
+The in-memory layer cleans every channel on each send, so its cost grows with N squared;
+the broker layer is the one meant for groups this large.
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+
+from benchmark.common import report
+
+from django.conf import settings
+from channels.layers import InMemoryChannelLayer
+
+import utils.utils_websocket
+from utils.utils_websocket import user_group
+from websocket.layers import BrokerChannelLayer
+from websocket.fanout import adeliver
+
+
+async def bench(layer, size, rounds):
+    names = [f"user{i}" for i in range(size)]
+    channels = [await layer.new_channel() for _ in names]
+    for name, channel in zip(names, channels):
+        await layer.group_add(user_group(name), channel)
+    frame = '[{"type": "message", "content": {"msg_id": 0, "msg_body": "' + "x" * 100 + '"}}]'
+
+    for variant, shard_size in [("sequential", size + 1), ("sharded", None)]:
+        echo = []
+        last = []
+        for _ in range(rounds):
+            arrived = [0.0] * size
+
+            async def receive(index, channel):
+                await layer.receive(channel)
+                arrived[index] = time.perf_counter()
+
+            receivers = [asyncio.create_task(receive(i, channel)) for i, channel in enumerate(channels)]
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            await adeliver([(name, frame) for name in names[1:]], first=(names[0], frame), shard_size=shard_size)
+            await asyncio.gather(*receivers)
+            echo.append(arrived[0] - start)
+            last.append(max(arrived) - start)
+        report(f"{variant} {size} members, sender echo", echo)
+        report(f"{variant} {size} members, last delivery", last)
+
+    for name, channel in zip(names, channels):
+        await layer.group_discard(user_group(name), channel)
+
+
+async def run(layer, rounds, sizes):
+    # deliver through the benchmark's layer rather than the configured one
+    utils.utils_websocket.get_channel_layer = lambda: layer
+    for size in sizes:
+        await bench(layer, size, rounds)
+    if hasattr(layer, "close"):
+        await layer.close()
+
+
+def main():
+    args = sys.argv[1:]
+    kind = args.pop(0) if args and args[0] in {"memory", "broker"} else "broker"
+    rounds = int(args[0]) if len(args) > 0 else 20
+    sizes = [int(size) for size in args[1:]] or [10, 1000, 10000]
+
+    if kind == "memory":
+        asyncio.run(run(InMemoryChannelLayer(), rounds, sizes))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        address = f"unix:{tmp}/broker.sock"
+        broker = subprocess.Popen([sys.executable, "-m", "websocket.broker", address],
+                                  cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(f"{tmp}/broker.sock"):
+                time.sleep(0.05)
+            asyncio.run(run(BrokerChannelLayer(address=address), rounds, sizes))
+        finally:
+            broker.kill()
+            broker.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Payload of a client coming back after a long absence: the login catch-up (every message after
+ack_msg_id, which a client that stopped acking long ago has mostly stored already) against a sync
+request carrying the last msg_id the client has of each group, with the default per-group limit.
+
+Reported: bytes and time of each answer.
+
+    python -m benchmark.bench_sync [GROUPS] [MESSAGES] [NEW]
+"""
+import sys
+import time
+
+from benchmark.common import setup_db, create_users
+
+from im.models import Group, Groupmember, Message
+from utils.utils_cursor import pending_cursors
+from websocket.views import fetch_login_msgs, fetch_sync
+
+
+def measure(name, call):
+    start = time.perf_counter()
+    frame = call()
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {len(frame.encode()):,} bytes in {elapsed * 1000:.1f}ms")
+    return len(frame.encode())
+
+
+def main():
+    args = sys.argv[1:]
+    groups = int(args[0]) if len(args) > 0 else 50
+    count = int(args[1]) if len(args) > 1 else 400
+    new = int(args[2]) if len(args) > 2 else 5
+
+    setup_db()
+    alice, bob = create_users("user", 2)
+    Group.objects.bulk_create([Group(group_name=f"bench{i}", group_owner=alice) for i in range(groups)])
+    group_list = list(Group.objects.order_by("group_id"))
+    Groupmember.objects.bulk_create([Groupmember(group=group, member_user=user, member_role="member")
+                                     for group in group_list for user in [alice, bob]])
+    Message.objects.bulk_create([Message(sender=alice, group=group, msg_type="text", msg_body=f"bench {j}")
+                                 for group in group_list for j in range(count)])
+    # the client stored everything but the last `new` messages of each group
+    cursors = {}
+    for group in group_list:
+        ids = list(Message.objects.filter(group=group).order_by("msg_id").values_list("msg_id", flat=True))
+        cursors[group.group_id] = ids[-new - 1]
+
+    print(f"{groups} groups x {count} messages, {new} new per group")
+    login = measure("login catch-up", lambda: fetch_login_msgs(bob))
+    Groupmember.objects.filter(member_user=bob).update(sent_msg_id=-1)
+    pending_cursors.clear()
+    sync = measure("sync request", lambda: fetch_sync(bob, cursors))
+    print(f"sync is {login / sync:.0f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Every script runs in-process against a throw-away in-memory test database, e.g.
+
+    python -m benchmark.bench_consumer
+"""
+import os
+import sys
+import time
+import asyncio
+import statistics
+import subprocess
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "DjangoHW.settings")
+
+import django
+django.setup()
+
+from django.db import connection
+from django.test.utils import setup_test_environment
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import User, Group, Groupmember
+from utils.utils_jwt import generate_jwt_token
+
+
+def setup_db():
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+
+def create_users(prefix: str, count: int):
+    User.objects.bulk_create([User(
+        user_name=f"{prefix}{i}",
+        password="123456",
+        user_email=f"{prefix}{i}@bench.com",
+    ) for i in range(count)])
+    return list(User.objects.filter(user_name__startswith=prefix).order_by("user_id"))
+
+
+def create_group(name: str, users):
+    group = Group.objects.create(group_name=name, group_owner=users[0])
+    Groupmember.objects.bulk_create([Groupmember(
+        group=group,
+        member_user=user,
+        member_role="admin" if i == 0 else "member",
+    ) for i, user in enumerate(users)])
+    return group
+
+
+def get_ws(app, user_name: str):
+    token = generate_jwt_token(user_name)
+    return WebsocketCommunicator(app, f"/ws/chat/{user_name}?{token}")
+
+
+def slow_send(app, delay: float):
+    """Wrap an ASGI app so that every frame written to the client takes `delay` seconds, like a busy socket."""
+    if delay <= 0:
+        return app
+
+    async def wrapped(scope, receive, send):
+        async def delayed_send(message):
+            await asyncio.sleep(delay)
+            await send(message)
+        return await app(scope, receive, delayed_send)
+    return wrapped
+
+
+def run_isolated(module: str, variants, *args):
+    """Run `python -m module variant *args` for each variant in a fresh interpreter."""
+    for variant in variants:
+        subprocess.run([sys.executable, "-m", module, variant, *map(str, args)], check=True)
+
+
+def percentile(data, p):
+    if not data:
+        return 0.0
+    data = sorted(data)
+    k = min(len(data) - 1, max(0, round(p / 100 * (len(data) - 1))))
+    return data[k]
+
+
+def report(title: str, samples):
+    """Print count / p50 / p99 / mean of samples given in seconds."""
+    print(f"{title:<48} n={len(samples):<6} "
+          f"p50={percentile(samples, 50) * 1000:8.2f}ms "
+          f"p99={percentile(samples, 99) * 1000:8.2f}ms "
+          f"mean={(statistics.mean(samples) if samples else 0) * 1000:8.2f}ms")
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.start
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ImConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'im'
+
+    def ready(self):
+        # membership cache invalidation
+        import im.signals
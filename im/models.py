@@ -214,3 +214,12 @@ class File(models.Model):
 class Userdelmsg(models.Model):
     user = models.ForeignKey(to=User, on_delete=models.CASCADE)
     msg = models.ForeignKey(to=Message, on_delete=models.CASCADE)
+
+# messages sent while the user was offline and not acked yet, see utils/utils_inbox.py
+class Inbox(models.Model):
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    group = models.ForeignKey(to=Group, on_delete=models.CASCADE)
+    msg = models.ForeignKey(to=Message, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "msg"], name="unique_inbox_msg")]
@@ -0,0 +1,51 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from im.models import User, Group, Groupmember, Message
+from utils.utils_group import invalidate_group, invalidate_user
+from utils.utils_cursor import discard_cursor
+from utils.utils_ring import ring_saved, ring_deleted, drop_ring
+from utils.utils_inbox import trim_inbox
+
+# delivery cursors change on every message and are not part of the cached membership
+CURSOR_FIELDS = {"sent_msg_id", "ack_msg_id", "top"}
+
+
+@receiver(post_save, sender=Groupmember)
+def groupmember_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is None or not set(update_fields) <= CURSOR_FIELDS:
+        invalidate_group(instance.group_id)
+    # a cursor written directly replaces the pending one
+    if created or (update_fields is not None and "sent_msg_id" in update_fields):
+        discard_cursor(instance.group_id, instance.member_user_id)
+    # acked messages leave the inbox
+    if update_fields is not None and "ack_msg_id" in update_fields:
+        trim_inbox(instance.member_user_id, instance.group_id, instance.ack_msg_id)
+
+
+@receiver(post_delete, sender=Groupmember)
+def groupmember_deleted(sender, instance, **kwargs):
+    invalidate_group(instance.group_id)
+    trim_inbox(instance.member_user_id, instance.group_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or "user_name" in update_fields:
+        invalidate_user(instance.user_id)
+
+
+# new and recalled messages go to the ring of their group
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created=False, **kwargs):
+    ring_saved(instance, created)
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    ring_deleted(instance)
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    drop_ring(instance)
@@ -0,0 +1,171 @@
+from django.test import TestCase, override_settings
+from im.models import User, Friend, Group, Groupmember, Systemmsg
+
+from utils.utils_jwt import generate_jwt_token
+from utils import utils_group
+from utils.utils_group import get_members, group_cache, user_groups, group_cache_stats, cache_hit_rate
+
+# Create your tests here.
+class GroupCacheTests(TestCase):
+    # Initializer
+    def setUp(self):
+        group_cache.clear()
+        user_groups.clear()
+        for key in group_cache_stats:
+            group_cache_stats[key] = 0
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.carol = User.objects.create(user_name="carol", password="123456", user_email="carol@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+        self.group_ac = Group.objects.create(group_name="")
+        Groupmember.objects.create(group=self.group_ac, member_user=self.alice, member_role="")
+        Groupmember.objects.create(group=self.group_ac, member_user=self.carol, member_role="")
+        Friend.objects.create(user=self.alice, friend=self.carol, group=self.group_ac)
+        Friend.objects.create(user=self.carol, friend=self.alice, group=self.group_ac)
+
+    # destructor
+    def tearDown(self):
+        Friend.objects.all().delete()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def post(self, path, data, user_name, method="post"):
+        headers = {"HTTP_AUTHORIZATION": generate_jwt_token(user_name)}
+        return getattr(self.client, method)(path, data=data, content_type="application/json", **headers)
+
+    def warm(self):
+        # read once so that every check below would see a stale entry if invalidation were missing
+        members = get_members(self.group.group_id)
+        self.assertEqual(get_members(self.group.group_id), members)
+        return members
+
+    # ! Test section
+    def test_hit_and_miss_counters(self):
+        with self.assertNumQueries(1):
+            for _ in range(5):
+                get_members(self.group.group_id)
+        self.assertEqual(group_cache_stats["miss"], 1)
+        self.assertEqual(group_cache_stats["hit"], 4)
+        self.assertAlmostEqual(cache_hit_rate(), 0.8)
+
+    def test_message_uses_cache(self):
+        self.warm()
+        with self.assertNumQueries(0):
+            members = get_members(self.group.group_id)
+        self.assertEqual(set(members), {self.alice.user_id, self.bob.user_id})
+        self.assertEqual(members[self.alice.user_id].member_role, "admin")
+        self.assertEqual(members[self.bob.user_id].user_name, "bob")
+
+    def test_create(self):
+        res = self.post("/api/group/create", {"group_name": "new", "member_ids": [self.carol.user_id]}, "alice")
+        self.assertEqual(res.json()["code"], 0)
+        members = get_members(res.json()["group_id"])
+        self.assertEqual(set(members), {self.alice.user_id, self.carol.user_id})
+
+    def test_join_accepted(self):
+        self.warm()
+        res = self.post("/api/group/join", {"group_id": self.group.group_id, "message": "hi"}, "carol")
+        self.assertEqual(res.json()["code"], 0)
+        self.assertNotIn(self.carol.user_id, get_members(self.group.group_id))
+        sysmsg = Systemmsg.objects.filter(target_user=self.alice, sysmsg_type="join_group").first()
+        res = self.post("/api/sysmsg/handle", {"sysmsg_id": sysmsg.sysmsg_id, "operation": "yes"}, "alice")
+        self.assertEqual(res.json()["code"], 0)
+        self.assertIn(self.carol.user_id, get_members(self.group.group_id))
+
+    def test_leave(self):
+        self.warm()
+        res = self.post("/api/group/leave", {"group_id": self.group.group_id}, "bob")
+        self.assertEqual(res.json()["code"], 0)
+        self.assertNotIn(self.bob.user_id, get_members(self.group.group_id))
+
+    def test_kick_user(self):
+        self.warm()
+        res = self.post("/api/group/kick_user", {"group_id": self.group.group_id, "member_id": self.bob.user_id}, "alice")
+        self.assertEqual(res.json()["code"], 0)
+        self.assertNotIn(self.bob.user_id, get_members(self.group.group_id))
+
+    def test_set_role(self):
+        self.warm()
+        res = self.post("/api/group/set_role", {"group_id": self.group.group_id, "member_id": self.bob.user_id, "member_role": "admin"}, "alice")
+        self.assertEqual(res.json()["code"], 0)
+        self.assertEqual(get_members(self.group.group_id)[self.bob.user_id].member_role, "admin")
+
+    def test_preference(self):
+        self.warm()
+        res = self.post("/api/group/preference", {"group_id": self.group.group_id, "do_not_disturb": True}, "bob", "put")
+        self.assertEqual(res.json()["code"], 0)
+        self.assertTrue(get_members(self.group.group_id)[self.bob.user_id].do_not_disturb)
+
+    def test_group_delete(self):
+        self.warm()
+        res = self.post("/api/group/delete", {"group_id": self.group.group_id}, "alice", "delete")
+        self.assertEqual(res.json()["code"], 0)
+        self.assertDictEqual(get_members(self.group.group_id), {})
+
+    def test_cancel(self):
+        self.warm()
+        get_members(self.group_ac.group_id)
+        res = self.post("/api/user/cancel", {}, "bob")
+        self.assertEqual(res.json()["code"], 0)
+        self.assertEqual(set(get_members(self.group.group_id)), {self.alice.user_id})
+        self.assertIn(self.carol.user_id, get_members(self.group_ac.group_id))
+
+    def test_rename_user(self):
+        self.warm()
+        res = self.post("/api/user/modify", {"user_name": "bobby"}, "bob", "put")
+        self.assertEqual(res.json()["code"], 0)
+        self.assertEqual(get_members(self.group.group_id)[self.bob.user_id].user_name, "bobby")
+
+    def test_cursor_updates_keep_entry(self):
+        self.warm()
+        gm = Groupmember.objects.get(group=self.group, member_user=self.bob)
+        gm.ack_msg_id = 10
+        gm.save(update_fields=["ack_msg_id"])
+        with self.assertNumQueries(0):
+            get_members(self.group.group_id)
+
+    def test_change_by_other_process_expires(self):
+        self.warm()
+        # a queryset update sends no signal, like a change made by another worker
+        Groupmember.objects.filter(group=self.group, member_user=self.bob).update(member_role="admin")
+        self.assertEqual(get_members(self.group.group_id)[self.bob.user_id].member_role, "member")
+        # until the entry expires
+        expire, members = group_cache[self.group.group_id]
+        group_cache[self.group.group_id] = (expire - utils_group.GROUP_CACHE_TTL, members)
+        self.assertEqual(get_members(self.group.group_id)[self.bob.user_id].member_role, "admin")
+
+    def test_rename_drops_only_groups_of_user(self):
+        self.warm()
+        get_members(self.group_ac.group_id)
+        self.assertEqual(user_groups[self.bob.user_id], {self.group.group_id})
+        self.assertEqual(user_groups[self.alice.user_id], {self.group.group_id, self.group_ac.group_id})
+        utils_group.invalidate_user(self.bob.user_id)
+        self.assertNotIn(self.group.group_id, group_cache)
+        self.assertIn(self.group_ac.group_id, group_cache)
+        self.assertNotIn(self.bob.user_id, user_groups)
+        self.assertEqual(user_groups[self.alice.user_id], {self.group_ac.group_id})
+
+    def test_eviction_keeps_index(self):
+        size = utils_group.GROUP_CACHE_SIZE
+        utils_group.GROUP_CACHE_SIZE = 1
+        try:
+            get_members(self.group.group_id)
+            get_members(self.group_ac.group_id)
+        finally:
+            utils_group.GROUP_CACHE_SIZE = size
+        self.assertEqual(list(group_cache), [self.group_ac.group_id])
+        self.assertNotIn(self.bob.user_id, user_groups)
+        self.assertEqual(user_groups[self.alice.user_id], {self.group_ac.group_id})
+
+    @override_settings(GROUP_CACHE=False)
+    def test_shared_broker_reads_database(self):
+        # another worker kicks bob and adds carol: both are seen at once
+        get_members(self.group.group_id)
+        Groupmember.objects.filter(group=self.group, member_user=self.bob).update(member_user=self.carol)
+        self.assertFalse(utils_group.is_member(self.group.group_id, self.bob.user_id))
+        self.assertTrue(utils_group.is_member(self.group.group_id, self.carol.user_id))
+        self.assertEqual(group_cache, {})
+        self.assertEqual(user_groups, {})
@@ -129,6 +129,24 @@ class MessageTests(TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(res.json()['code'], 2)
 
+    def test_ack_msg_groups(self):
+        msg = Message.objects.create(sender=self.alice, group=self.test_group, msg_type="text", msg_body="hello")
+        msg_ab = Message.objects.create(sender=self.alice, group=self.group_ab, msg_type="text", msg_body="hello")
+        headers= {"HTTP_AUTHORIZATION": generate_jwt_token("alice")}
+        # one group in error: no group acked
+        data = {"groups": {str(self.test_group.group_id): msg.msg_id, str(self.test_group_2.group_id): 1}}
+        res = self.client.post('/api/msg/ack', data=data, content_type='application/json', **headers)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(Groupmember.objects.get(group=self.test_group, member_user=self.alice).ack_msg_id, -1)
+        data = {"groups": {str(self.test_group.group_id): msg.msg_id, str(self.group_ab.group_id): msg_ab.msg_id}}
+        res = self.client.post('/api/msg/ack', data=data, content_type='application/json', **headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Groupmember.objects.get(group=self.test_group, member_user=self.alice).ack_msg_id, msg.msg_id)
+        self.assertEqual(Groupmember.objects.get(group=self.group_ab, member_user=self.alice).ack_msg_id, msg_ab.msg_id)
+        res = self.client.post('/api/msg/ack', data={"groups": []}, content_type='application/json', **headers)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json()['code'], -2)
+
     def test_ack_msg_get(self):
         res = self.client.get('/api/msg/ack')
         self.assertEqual(res.status_code, 405)
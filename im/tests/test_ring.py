@@ -0,0 +1,138 @@
+from django.test import TestCase, override_settings
+from im.models import User, Group, Groupmember, Message, Userdelmsg
+
+from utils.utils_jwt import generate_jwt_token
+from utils import utils_ring
+from utils.utils_ring import rings, ring_stats, recent_messages
+from utils.utils_msg import get_latest_msg
+
+# Create your tests here.
+class RingTests(TestCase):
+    # Initializer
+    def setUp(self):
+        rings.clear()
+        for key in ring_stats:
+            ring_stats[key] = 0
+        self.size = utils_ring.RING_SIZE
+        self.max_bytes = utils_ring.RING_MAX_BYTES
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+
+    # destructor
+    def tearDown(self):
+        utils_ring.RING_SIZE = self.size
+        utils_ring.RING_MAX_BYTES = self.max_bytes
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def send(self, body, group=None):
+        return Message.objects.create(sender=self.alice, group=group or self.group, msg_type="text", msg_body=body)
+
+    def fetch(self, user_name, after_msg_id=None):
+        data = {"group_id": self.group.group_id}
+        if after_msg_id is not None:
+            data["after_msg_id"] = after_msg_id
+        headers = {"HTTP_AUTHORIZATION": generate_jwt_token(user_name)}
+        res = self.client.get('/api/msg/fetch', data=data, content_type='application/json', **headers)
+        self.assertEqual(res.status_code, 200)
+        return res.json()["msgs"]
+
+    def ack(self, user, msg):
+        Groupmember.objects.filter(group=self.group, member_user=user).update(ack_msg_id=msg.msg_id)
+
+    # ! Test section
+    def test_new_messages_in_ring(self):
+        first = self.send("first")
+        second = self.send("second")
+        with self.assertNumQueries(0):
+            recent = recent_messages(self.group, first.msg_id - 1)
+        self.assertListEqual([msg_id for msg_id, _ in recent], [first.msg_id, second.msg_id])
+        self.assertEqual(ring_stats["hit"], 1)
+        # older than the first message seen: unknown, read from database
+        self.assertIsNone(recent_messages(self.group, first.msg_id - 2))
+        self.assertEqual(ring_stats["miss"], 1)
+
+    def test_fetch_after_from_ring(self):
+        first = self.send("first")
+        second = self.send("second")
+        hits = ring_stats["hit"]
+        msgs = self.fetch("bob", first.msg_id)
+        self.assertListEqual([msg["msg_id"] for msg in msgs], [second.msg_id])
+        self.assertEqual(ring_stats["hit"] - hits, 1)
+
+    def test_recall_updates_ring(self):
+        msg = self.send("hello")
+        res = self.client.post('/api/msg/recall', data={"msg_id": msg.msg_id}, content_type='application/json',
+                               **{"HTTP_AUTHORIZATION": generate_jwt_token("alice")})
+        self.assertEqual(res.status_code, 200)
+        msgs = self.fetch("bob", msg.msg_id - 1)
+        self.assertEqual(msgs[0]["msg_type"], "recall")
+
+    def test_deleted_messages_filtered(self):
+        first = self.send("first")
+        second = self.send("second")
+        self.ack(self.bob, second)
+        Userdelmsg.objects.create(user=self.bob, msg=second)
+        self.assertEqual(get_latest_msg(Groupmember.objects.get(group=self.group, member_user=self.bob))["msg_id"], first.msg_id)
+        self.assertListEqual([msg["msg_id"] for msg in self.fetch("bob", first.msg_id - 1)], [first.msg_id])
+
+        first_id = first.msg_id
+        first.delete()
+        self.assertListEqual([msg_id for msg_id, _ in recent_messages(self.group, first_id - 1)], [second.msg_id])
+
+    def test_trim_raises_floor(self):
+        utils_ring.RING_SIZE = 3
+        msgs = [self.send(str(i)) for i in range(5)]
+        self.assertListEqual([msg_id for msg_id, _ in recent_messages(self.group, msgs[1].msg_id)], [msg.msg_id for msg in msgs[2:]])
+        self.assertIsNone(recent_messages(self.group, msgs[0].msg_id))
+        # the miss falls back to database
+        self.assertListEqual([msg["msg_id"] for msg in self.fetch("bob", msgs[0].msg_id)], [msg.msg_id for msg in msgs[1:]])
+
+    def test_latest_msg(self):
+        self.assertIsNone(get_latest_msg(Groupmember.objects.get(group=self.group, member_user=self.bob)))
+        msg = self.send("hello")
+        gm = Groupmember.objects.get(group=self.group, member_user=self.bob)
+        self.assertIsNone(get_latest_msg(gm))
+        self.ack(self.bob, msg)
+        gm.refresh_from_db()
+        hits = ring_stats["hit"]
+        self.assertEqual(get_latest_msg(gm)["msg_body"], "hello")
+        self.assertEqual(ring_stats["hit"] - hits, 1)
+
+    def test_lru_eviction(self):
+        other = Group.objects.create(group_name="other", group_owner=self.alice)
+        self.send("x" * 50)
+        self.send("y" * 50, other)
+        utils_ring.RING_MAX_BYTES = ring_stats["bytes"] + 10
+        # the first group was used last, the other one goes first
+        recent_messages(self.group, 0)
+        self.send("z" * 50)
+        self.assertEqual(ring_stats["evict"], 1)
+        self.assertIsNone(recent_messages(other, 0))
+        self.assertIsNotNone(recent_messages(self.group, 0))
+        self.assertLessEqual(ring_stats["bytes"], utils_ring.RING_MAX_BYTES)
+
+    @override_settings(MESSAGE_RINGS=False)
+    def test_off_with_shared_layer(self):
+        first = self.send("first")
+        self.assertEqual(len(rings), 0)
+        self.assertIsNone(recent_messages(self.group, first.msg_id - 1))
+        # saved and recalled by another worker: no signal here, database is read
+        Message.objects.filter(msg_id=first.msg_id).update(msg_type="recall", msg_body="")
+        second = Message.objects.bulk_create([Message(sender=self.alice, group=self.group, msg_type="text", msg_body="second")])[0]
+        msgs = self.fetch("bob", first.msg_id - 1)
+        self.assertListEqual([(msg["msg_id"], msg["msg_type"]) for msg in msgs], [(first.msg_id, "recall"), (second.msg_id, "text")])
+        self.ack(self.bob, second)
+        self.assertEqual(get_latest_msg(Groupmember.objects.get(group=self.group, member_user=self.bob))["msg_body"], "second")
+        self.assertEqual(ring_stats["hit"], 0)
+
+    def test_group_deleted(self):
+        self.send("hello")
+        group = self.group
+        group.delete()
+        self.assertEqual(ring_stats["bytes"], 0)
+        self.assertIsNone(recent_messages(group, 0))
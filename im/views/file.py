@@ -3,11 +3,14 @@ from django.http.response import HttpResponseBase
 from django.core.files.uploadedfile import UploadedFile
 
 from im.models import User, Group, Groupmember, Message, File
-from websocket.views import push_message
+from websocket.views import push_group
+from websocket.dispatch import dispatch
 
 from utils.utils_jwt import auth_jwt_token
 from utils.utils_request import BAD_METHOD, request_success, request_failed
 from utils.utils_msg import get_file_set
+from utils.utils_group import is_member
+from utils.utils_cursor import flush_cursors_if_due
 
 def upload(req: HttpRequest):
     if req.method != "POST":
@@ -29,8 +32,7 @@ def upload(req: HttpRequest):
     group = Group.objects.filter(group_id=group_id).first()
     if group is None:
         return request_failed(2, "Group does not exsist", 400)
-    gm = Groupmember.objects.filter(group=group, member_user=user).first()
-    if gm is None:
+    if not is_member(group.group_id, user.user_id):
         return request_failed(2, "You are not in the group", 400)
 
     file: UploadedFile = req.FILES.get("file")
@@ -48,12 +50,8 @@ def upload(req: HttpRequest):
         file=file,
         name=file.name,
     )
-    update_list = []
-    for member in Groupmember.objects.filter(group=group):
-        if push_message(member, msg):
-            update_list.append(member)
-    
-    Groupmember.objects.bulk_update(update_list, fields=["sent_msg_id"])
+    dispatch(push_group, msg)
+    flush_cursors_if_due()
     return request_success()
 
 def download(req: HttpRequest) -> HttpResponseBase:
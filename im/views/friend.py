@@ -2,7 +2,8 @@ import json
 from django.http import HttpRequest
 
 from im.models import User, Friend, Systemmsg, Systemop
-from websocket.views import push_sysmsg
+from websocket.views import push_sysmsg, push_sysmsgs
+from websocket.dispatch import dispatch
 
 from utils.utils_request import BAD_METHOD, request_failed, request_success, return_field
 from utils.utils_require import CheckRequire, require
@@ -151,12 +152,6 @@ def apply(req: HttpRequest):
         sup_user=user,
     )
 
-    update_user = []
-    if push_sysmsg(user, sysmsg_to_origin.sysmsg_id):
-        update_user.append(user)
-    if push_sysmsg(target, sysmsg_to_target.sysmsg_id):
-        update_user.append(target)
-    if len(update_user) > 0:
-        User.objects.bulk_update(update_user, fields=["read_sysmsg_id"])
+    dispatch(push_sysmsgs, [(user, sysmsg_to_origin.sysmsg_id), (target, sysmsg_to_target.sysmsg_id)])
 
     return request_success()
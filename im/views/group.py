@@ -4,12 +4,16 @@ from django.core.files.uploadedfile import UploadedFile
 from django.conf import settings
 
 from im.models import User, Group, Groupmember, Friend, Systemmsg, Systemop, Message
-from websocket.views import push_sysmsg, push_message
+from websocket.views import push_sysmsg, push_sysmsgs, push_group
+from websocket.dispatch import dispatch, dispatch_to
 
 from utils.utils_request import BAD_METHOD, request_failed, request_success, return_field
 from utils.utils_require import CheckRequire, require
+from utils.utils_admission import Admit
 from utils.utils_jwt import auth_jwt_token
 from utils.utils_msg import get_latest_msg
+from utils.utils_group import get_members, is_member, invalidate_group
+from utils.utils_cursor import apply_cursors, flush_cursors_if_due
 
 
 @CheckRequire
@@ -88,6 +92,7 @@ def create(req: HttpRequest):
     gm_list = [Groupmember(group=group, member_user=member, member_role="member") for member in member_list]
     gm_list.append(Groupmember(group=group, member_user=owner, member_role="admin"))
     Groupmember.objects.bulk_create(gm_list)
+    invalidate_group(group.group_id)
 
     sysop = Systemop.objects.create(
         user=owner,
@@ -104,7 +109,7 @@ def create(req: HttpRequest):
         message=sysop.message,
         can_operate=False,
         result=""
-    ) for gm in Groupmember.objects.filter(group=group)]
+    ) for gm in gm_list]
     Systemmsg.objects.bulk_create(msgs)
     update_user = []
     for msg in Systemmsg.objects.filter(sysop=sysop):
@@ -114,6 +119,7 @@ def create(req: HttpRequest):
 
     return request_success({"group_id": group.group_id, "group_name": group_name})
 
+@Admit("bulk")
 @CheckRequire
 def group_list(req: HttpRequest):
     if req.method != "GET":
@@ -127,6 +133,9 @@ def group_list(req: HttpRequest):
     if user is None:
         return request_failed(2, "User does not exsist", 400)
 
+    items = list(Groupmember.objects.filter(member_user=user))
+    members = {item.group_id: list(Groupmember.objects.filter(group=item.group)) for item in items}
+    apply_cursors([gm for gms in members.values() for gm in gms])
     groups = [{
         "members": [return_field(gm.serialize(private=True), [
             "member_id",
@@ -135,12 +144,12 @@ def group_list(req: HttpRequest):
             "join_time",
             "sent_msg_id",
             "ack_msg_id",
-        ]) for gm in Groupmember.objects.filter(group=item.group)],
+        ]) for gm in members[item.group_id]],
         "latest_msg": get_latest_msg(item),
         "do_not_disturb": item.do_not_disturb,
         "top": item.top,
         **(item.group.serialize()),
-    } for item in Groupmember.objects.filter(member_user=user)]
+    } for item in items]
     return request_success({"groups": groups})
 
 @CheckRequire
@@ -175,12 +184,12 @@ def group_delete(req: HttpRequest):
     )
     msgs = [Systemmsg(
         sysop=sysop,
-        target_user=gm.member_user,
+        target_user_id=user_id,
         sysmsg_type=sysop.sysop_type,
         message=sysop.message,
         can_operate=False,
         result=""
-    ) for gm in Groupmember.objects.filter(group=group)]
+    ) for user_id in get_members(group.group_id)]
     group.delete()
     Systemmsg.objects.bulk_create(msgs)
     update_user = []
@@ -213,7 +222,7 @@ def join(req: HttpRequest):
         return request_failed(2, "Group does not exsist", 400)
     if group.group_owner is None:
         return request_failed(2, "Cannot join friend group", 400)
-    if Groupmember.objects.filter(group=group, member_user=user).exists():
+    if is_member(group.group_id, user.user_id):
         return request_failed(2, "You are already in the group", 400)
 
     sysop = Systemop.objects.create(
@@ -234,10 +243,12 @@ def join(req: HttpRequest):
         sup_user=user,
         sup_group=group,
     )]
-    for gm in Groupmember.objects.filter(group=group, member_role="admin"):
+    for user_id, member in get_members(group.group_id).items():
+        if member.member_role != "admin":
+            continue
         msg = Systemmsg(
             sysop=sysop,
-            target_user=gm.member_user,
+            target_user_id=user_id,
             sysmsg_type="join_group",
             message=message,
             can_operate=True,
@@ -286,12 +297,12 @@ def leave(req: HttpRequest):
         )
         msgs = [Systemmsg(
             sysop=sysop,
-            target_user=gm.member_user,
+            target_user_id=user_id,
             sysmsg_type=sysop.sysop_type,
             message=sysop.message,
             can_operate=False,
             result=""
-        ) for gm in Groupmember.objects.filter(group=group)]
+        ) for user_id in get_members(group.group_id)]
         group.delete()
         Systemmsg.objects.bulk_create(msgs)
         update_user = []
@@ -316,14 +327,14 @@ def leave(req: HttpRequest):
         )
         msgs = [Systemmsg(
             sysop=sysop,
-            target_user=gm.member_user,
+            target_user_id=user_id,
             sysmsg_type=sysop.sysop_type,
             message=sysop.message,
             can_operate=False,
             result="",
             sup_user=user,
             sup_group=group
-        ) for gm in Groupmember.objects.filter(group=group)]
+        ) for user_id in get_members(group.group_id)]
         gm.delete()
         Systemmsg.objects.bulk_create(msgs)
         update_user = []
@@ -384,14 +395,14 @@ def kick_user(req: HttpRequest):
     )
     msgs = [Systemmsg(
         sysop=sysop,
-        target_user=gm.member_user,
+        target_user_id=user_id,
         sysmsg_type=sysop.sysop_type,
         message=sysop.message,
         can_operate=False,
         result="",
         sup_user=target,
         sup_group=group
-    ) for gm in Groupmember.objects.filter(group=group)]
+    ) for user_id in get_members(group.group_id)]
     gm_target.delete()
     Systemmsg.objects.bulk_create(msgs)
     update_user = []
@@ -469,13 +480,13 @@ def set_role(req: HttpRequest):
         )
     msgs = [Systemmsg(
         sysop=sysop,
-        target_user=gm.member_user,
+        target_user_id=user_id,
         sysmsg_type=sysop.sysop_type,
         message=sysop.message,
         can_operate=False,
         result="",
         sup_group=group
-    ) for gm in Groupmember.objects.filter(group=group)]
+    ) for user_id in get_members(group.group_id)]
     Systemmsg.objects.bulk_create(msgs)
     update_user = []
     for msg in Systemmsg.objects.filter(sysop=sysop):
@@ -498,7 +509,12 @@ def info(req: HttpRequest):
     if user is None:
         return request_failed(2, "User does not exsist", 400)
 
-    group_id = req.GET.get("group_id")
+    return info_for(user, req.GET)
+
+# group/info for user, params {"group_id"}, also run over the websocket by websocket.rpc
+@CheckRequire
+def info_for(user: User, params):
+    group_id = params.get("group_id")
     if group_id is None:
         return request_failed(-2, "Missing [group_id]", 400)
     try:
@@ -512,6 +528,8 @@ def info(req: HttpRequest):
     if gm is None:
         return request_failed(2, "You are not in the group", 400)
 
+    gms = list(Groupmember.objects.filter(group=group))
+    apply_cursors(gms)
     members = [return_field(gm.serialize(), [
         "member_id",
         "member_name",
@@ -519,7 +537,7 @@ def info(req: HttpRequest):
         "join_time",
         "sent_msg_id",
         "ack_msg_id",
-    ]) for gm in Groupmember.objects.filter(group=group)]
+    ]) for gm in gms]
     return request_success({
         "members": members,
         "latest_msg": get_latest_msg(gm),
@@ -574,19 +592,16 @@ def avatar(req: HttpRequest):
     )
     msgs = [Systemmsg(
         sysop=sysop,
-        target_user=gm.member_user,
+        target_user_id=user_id,
         sysmsg_type=sysop.sysop_type,
         message=sysop.message,
         can_operate=False,
         result="",
         sup_group=group
-    ) for gm in Groupmember.objects.filter(group=group)]
+    ) for user_id in get_members(group.group_id)]
     Systemmsg.objects.bulk_create(msgs)
-    update_user = []
-    for msg in Systemmsg.objects.filter(sysop=sysop):
-        if push_sysmsg(msg.target_user, msg.sysmsg_id):
-            update_user.append(msg.target_user)
-    User.objects.bulk_update(update_user, fields=["read_sysmsg_id"])
+    targets = [(msg.target_user, msg.sysmsg_id) for msg in Systemmsg.objects.filter(sysop=sysop).select_related("target_user")]
+    dispatch_to("sysmsg", push_sysmsgs, targets)
 
     return request_success()
 
@@ -609,8 +624,8 @@ def announce(req: HttpRequest):
     group = Group.objects.filter(group_id=group_id).first()
     if group is None:
         return request_failed(2, "Group does not exsist", 400)
-    gm = Groupmember.objects.filter(group=group, member_user=user, member_role="admin").first()
-    if gm is None:
+    member = get_members(group.group_id).get(user.user_id)
+    if member is None or member.member_role != "admin":
         return request_failed(2, "You are not in the group or not admin", 400)
 
     announcement = require(body, "announcement", "string", err_msg="Missing or error type of [announcement]")
@@ -620,12 +635,8 @@ def announce(req: HttpRequest):
         msg_body=announcement,
         msg_type="announcement",
     )
-    update_list = []
-    for member in Groupmember.objects.filter(group=group):
-        if push_message(member, msg):
-            update_list.append(member)
-    
-    Groupmember.objects.bulk_update(update_list, fields=["sent_msg_id"])
+    dispatch(push_group, msg)
+    flush_cursors_if_due()
     return request_success()
     
 
@@ -761,18 +772,15 @@ def modify(req: HttpRequest):
         )
         msgs = [Systemmsg(
             sysop=sysop,
-            target_user=gm.member_user,
+            target_user_id=user_id,
             sysmsg_type=sysop.sysop_type,
             message=sysop.message,
             can_operate=False,
             result="",
             sup_group=group
-        ) for gm in Groupmember.objects.filter(group=group)]
+        ) for user_id in get_members(group.group_id)]
         Systemmsg.objects.bulk_create(msgs)
-        update_user = []
-        for msg in Systemmsg.objects.filter(sysop=sysop):
-            if push_sysmsg(msg.target_user, msg.sysmsg_id):
-                update_user.append(msg.target_user)
-        User.objects.bulk_update(update_user, fields=["read_sysmsg_id"])
+        targets = [(msg.target_user, msg.sysmsg_id) for msg in Systemmsg.objects.filter(sysop=sysop).select_related("target_user")]
+        dispatch_to("sysmsg", push_sysmsgs, targets)
 
     return request_success()
\ No newline at end of file
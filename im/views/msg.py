@@ -1,4 +1,5 @@
 import json
+from django.db import transaction
 from django.http import HttpRequest
 from django.core.files.base import ContentFile
 from django.conf import settings
@@ -7,15 +8,22 @@ from hashlib import md5
 from requests import post
 
 from im.models import User, Group, Groupmember, Message, Systemop, Systemmsg, File, Userdelmsg
-from websocket.views import push_sysmsg, push_message
+from websocket.views import push_sysmsgs, push_message, push_group
+from websocket.dispatch import dispatch, dispatch_to
 
 from utils.utils_jwt import auth_jwt_token
-from utils.utils_request import BAD_METHOD, request_success, request_failed
+from utils.utils_request import BAD_METHOD, request_success, request_failed, request_success_encoded
 from utils.utils_require import CheckRequire, require
+from utils.utils_admission import Admit
 from utils.utils_msg import get_file_set, RECALL_TIME_LIMIT
+from utils.utils_group import is_member
+from utils.utils_frame import message_text, join_frame
+from utils.utils_ring import recent_messages
+from utils.utils_cursor import flush_cursors_if_due
 from utils.utils_time import get_timestamp
 
 
+@Admit("bulk")
 @CheckRequire
 def fetch(req: HttpRequest):
     if req.method != "GET":
@@ -29,7 +37,13 @@ def fetch(req: HttpRequest):
     if user is None:
         return request_failed(2, "User does not exsist", 400)
 
-    group_id = req.GET.get("group_id")
+    return fetch_for(user, req.GET)
+
+# msg/fetch of user, params {"group_id", "after_msg_id"?}, also run over the websocket by websocket.rpc
+@Admit("bulk")
+@CheckRequire
+def fetch_for(user: User, params):
+    group_id = params.get("group_id")
     if group_id is None:
         return request_failed(-2, "Missing [group_id]", 400)
     try:
@@ -43,10 +57,29 @@ def fetch(req: HttpRequest):
     if gm is None:
         return request_failed(2, "You are not in the group", 400)
 
+    # with after_msg_id: messages newer than it, pulled after a hint of a large group; without: history up to ack
+    after_msg_id = params.get("after_msg_id")
+    if after_msg_id is not None:
+        try:
+            after_msg_id = int(after_msg_id)
+        except:
+            return request_failed(-2, f"Error type of [after_msg_id]: {type(after_msg_id)}", 400)
+
     delids = Userdelmsg.objects.filter(user=user, msg__group=group).values("msg__msg_id")
-    qset = Message.objects.filter(group=group, msg_id__lte=gm.ack_msg_id).exclude(msg_id__in=delids)
-    msgs = [item.serialize() for item in qset]
-    return request_success({"msgs": msgs})
+    # the whole history is in the ring of a small group, the newest messages in that of any active one
+    recent = recent_messages(group, 0 if after_msg_id is None else after_msg_id)
+    if recent is not None:
+        deleted = {item["msg__msg_id"] for item in delids}
+        max_msg_id = gm.ack_msg_id if after_msg_id is None else float("inf")
+        texts = [text for msg_id, text in recent if msg_id <= max_msg_id and msg_id not in deleted]
+        return request_success_encoded({"msgs": join_frame(texts)})
+
+    if after_msg_id is None:
+        qset = Message.objects.filter(group=group, msg_id__lte=gm.ack_msg_id)
+    else:
+        qset = Message.objects.filter(group=group, msg_id__gt=after_msg_id).order_by("msg_id")
+    qset = qset.exclude(msg_id__in=delids).select_related("sender", "group")
+    return request_success_encoded({"msgs": join_frame([message_text(item) for item in qset])})
 
 @CheckRequire
 def ack(req: HttpRequest):
@@ -62,24 +95,53 @@ def ack(req: HttpRequest):
         return request_failed(2, "User does not exsist", 400)
 
     body = json.loads(req.body.decode("utf-8"))
-    group_id = require(body, "group_id", "int", "Missing or error type of [group_id]")
-    msg_id = require(body, "msg_id", "int", "Missing or error type of [msg_id]")
+    return ack_for(user, body)
+
+# msg/ack of user, body {"group_id", "msg_id"} or {"groups": {group_id: msg_id}} for several groups at once
+@CheckRequire
+def ack_for(user: User, body):
+    if "groups" in body:
+        groups = body["groups"]
+        assert isinstance(groups, dict) and groups, "Missing or error type of [groups]"
+        items = [{"group_id": group_id, "msg_id": msg_id} for group_id, msg_id in groups.items()]
+    else:
+        items = [body]
+    acks = [(require(item, "group_id", "int", "Missing or error type of [group_id]"),
+             require(item, "msg_id", "int", "Missing or error type of [msg_id]")) for item in items]
+
+    # every ack is checked before any is applied
+    targets = []
+    for group_id, msg_id in acks:
+        gm, failed = ack_target(user, group_id, msg_id)
+        if failed is not None:
+            return failed
+        targets.append((gm, msg_id))
+    with transaction.atomic():
+        for gm, msg_id in targets:
+            apply_ack(user, gm, msg_id)
+    return request_success()
 
+# membership of user to ack msg_id in, or the failure to answer
+def ack_target(user: User, group_id, msg_id):
     group = Group.objects.filter(group_id=group_id).first()
     if group is None:
-        return request_failed(2, "Group does not exsist", 400)
+        return None, request_failed(2, "Group does not exsist", 400)
     gm = Groupmember.objects.filter(group=group, member_user=user).first()
     if gm is None:
-        return request_failed(2, "You are not in the group", 400)
+        return None, request_failed(2, "You are not in the group", 400)
 
     if msg_id > gm.ack_msg_id:
         try:
             latest_msg = Message.objects.filter(group=group).latest("msg_id")
             if msg_id > latest_msg.msg_id:
-                return request_failed(2, "Cannot ack future message", 400)
+                return None, request_failed(2, "Cannot ack future message", 400)
         except Message.DoesNotExist:
-            return request_failed(2, "Group has no message", 400)
+            return None, request_failed(2, "Group has no message", 400)
+    return gm, None
 
+def apply_ack(user: User, gm: Groupmember, msg_id):
+    group = gm.group
+    if msg_id > gm.ack_msg_id:
         gm.ack_msg_id = msg_id
         gm.save(update_fields=["ack_msg_id"])
 
@@ -101,13 +163,8 @@ def ack(req: HttpRequest):
             sup_group=group,
         ) for gm in Groupmember.objects.filter(group=group)]
         Systemmsg.objects.bulk_create(msgs)
-        update_user = []
-        for msg in Systemmsg.objects.filter(sysop=sysop):
-            if push_sysmsg(msg.target_user, msg.sysmsg_id):
-                update_user.append(msg.target_user)
-        User.objects.bulk_update(update_user, ["read_sysmsg_id"])
-
-    return request_success()
+        targets = [(msg.target_user, msg.sysmsg_id) for msg in Systemmsg.objects.filter(sysop=sysop).select_related("target_user")]
+        dispatch_to("sysmsg", push_sysmsgs, targets)
 
 @CheckRequire
 def recall(req: HttpRequest):
@@ -123,6 +180,11 @@ def recall(req: HttpRequest):
         return request_failed(2, "User does not exsist", 400)
 
     body = json.loads(req.body.decode("utf-8"))
+    return recall_for(user, body)
+
+# msg/recall of user, body {"msg_id"}
+@CheckRequire
+def recall_for(user: User, body):
     msg_id = require(body, "msg_id", "int", "Missing or error type of [msg_id]")
 
     msg = Message.objects.filter(msg_id=msg_id).first()
@@ -148,11 +210,8 @@ def recall(req: HttpRequest):
     msg.msg_body = f"{user.user_name} recalled a message from {sender.user_name}"
     msg.save(update_fields=["msg_type", "msg_body"])
 
-    update_list = []
-    for gm in Groupmember.objects.filter(group=group):
-        if push_message(gm, msg):
-            update_list.append(gm)
-    Groupmember.objects.bulk_update(update_list, ["sent_msg_id"])
+    dispatch(push_group, msg)
+    flush_cursors_if_due()
     return request_success()
 
 @CheckRequire
@@ -169,6 +228,11 @@ def msg_delete(req: HttpRequest):
         return request_failed(2, "User does not exsist", 400)
 
     body = json.loads(req.body.decode("utf-8"))
+    return delete_for(user, body)
+
+# msg/delete of user, body {"msg_id"}
+@CheckRequire
+def delete_for(user: User, body):
     msg_id = require(body, "msg_id", "int", "Missing or error type of [msg_id]")
 
     msg = Message.objects.filter(msg_id=msg_id).first()
@@ -193,10 +257,11 @@ def msg_delete(req: HttpRequest):
             msg_type="delete",
             msg_body=f"{user.user_name} deleted a message",
         )
-        if push_message(gm, delmsg):
-            gm.save(update_fields=["sent_msg_id"])
+        push_message(gm, delmsg)
+        flush_cursors_if_due()
         return request_success()
 
+@Admit("bulk")
 @CheckRequire
 def forward(req: HttpRequest):
     if req.method != "POST":
@@ -218,12 +283,12 @@ def forward(req: HttpRequest):
     origin = Group.objects.filter(group_id=origin_group_id).first()
     if origin is None:
         return request_failed(2, "Origin group does not exsist", 400)
-    if not Groupmember.objects.filter(group=origin, member_user=user).exists():
+    if not is_member(origin.group_id, user.user_id):
         return request_failed(2, "You are not in the origin group", 400)
     target = Group.objects.filter(group_id=target_group_id).first()
     if target is None:
         return request_failed(2, "Target group does not exsist", 400)
-    if not Groupmember.objects.filter(group=target, member_user=user).exists():
+    if not is_member(target.group_id, user.user_id):
         return request_failed(2, "You are not in the target group", 400)
 
     ids = set()
@@ -274,11 +339,8 @@ def forward(req: HttpRequest):
         name="files.json",
     )
 
-    update_list = []
-    for gm in Groupmember.objects.filter(group=target):
-        if push_message(gm, msg):
-            update_list.append(gm)
-    Groupmember.objects.bulk_update(update_list, ["sent_msg_id"])
+    dispatch(push_group, msg)
+    flush_cursors_if_due()
 
     return request_success()
 
@@ -13,6 +13,7 @@ from utils.utils_require import MAX_CHAR_LENGTH, CheckRequire, require
 from utils.utils_time import get_timestamp
 from utils.utils_jwt import auth_jwt_token
 from utils.utils_sysmsg import extract_sysmsg
+from utils.utils_group import get_members
 
 
 def handle_sysmsg_teardown(sysop: Systemop, operation: str):
@@ -63,15 +64,16 @@ def handle_join_group(sysmsg: Systemmsg, operation: str) -> JsonResponse:
     if operation == "yes":
         create_list = []
         update_list = []
-        for gm in Groupmember.objects.filter(group=target):
-            msg = Systemmsg.objects.filter(sysop=sysop, target_user=gm.member_user).first()
+        notified = {msg.target_user_id: msg for msg in Systemmsg.objects.filter(sysop=sysop)}
+        for user_id in get_members(target.group_id):
+            msg = notified.get(user_id)
             if msg is not None:
                 msg.sup_group = target
                 update_list.append(msg)
             else:
                 create_list.append(Systemmsg(
                     sysop=sysop,
-                    target_user=gm.member_user,
+                    target_user_id=user_id,
                     sysmsg_type="join_group",
                     message=sysop.message,
                     can_operate=False,
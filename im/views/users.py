@@ -4,7 +4,8 @@ from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.conf import settings
 
 from im.models import User, Group, Groupmember, Friend, Systemmsg, Systemop, Message
-from websocket.views import push_sysmsg, push_message
+from websocket.views import push_sysmsg, push_sysmsgs, push_message
+from websocket.dispatch import dispatch_to
 from utils.utils_request import (
     BAD_METHOD,
     request_failed,
@@ -16,6 +17,7 @@ from utils.utils_time import get_timestamp
 from utils.utils_jwt import generate_jwt_token, auth_jwt_token
 from utils.utils_mail import verify_code
 from utils.utils_websocket import logout_user
+from utils.utils_group import get_members
 
 
 @CheckRequire
@@ -181,11 +183,8 @@ def modify(req: HttpRequest):
             #) for gm in Groupmember.objects.filter(group=group) if gm.member_user is not user and gm.member_user not in friends]
             ) for gm in Groupmember.objects.filter(group=group) if gm.member_user is not user]
             Systemmsg.objects.bulk_create(msgs)
-        update_user = []
-        for msg in Systemmsg.objects.filter(sysop=sysop):
-            if push_sysmsg(msg.target_user, msg.sysmsg_id):
-                update_user.append(msg.target_user)
-        User.objects.bulk_update(update_user, fields=["read_sysmsg_id"])
+        targets = [(msg.target_user, msg.sysmsg_id) for msg in Systemmsg.objects.filter(sysop=sysop).select_related("target_user")]
+        dispatch_to("sysmsg", push_sysmsgs, targets)
 
     return request_success({
         "jwt_token": generate_jwt_token(user.user_name),
@@ -237,13 +236,13 @@ def cancel(req: HttpRequest):
     for group in groups_member:
         msgs = [Systemmsg(
             sysop=sysop,
-            target_user=gm.member_user,
+            target_user_id=user_id,
             sysmsg_type=sysop.sysop_type,
             message=sysop.message,
             can_operate=False,
             result="",
-            sup_group=gm.group
-        ) for gm in Groupmember.objects.filter(group=group) if gm.member_user.user_id is not user.user_id]
+            sup_group=group
+        ) for user_id in get_members(group.group_id) if user_id != user.user_id]
         Systemmsg.objects.bulk_create(msgs)
     
     sysop = Systemop.objects.create(
@@ -257,12 +256,12 @@ def cancel(req: HttpRequest):
     for group in groups_owner:
         msgs = [Systemmsg(
             sysop=sysop,
-            target_user=gm.member_user,
+            target_user_id=user_id,
             sysmsg_type=sysop.sysop_type,
             message=sysop.message,
             can_operate=False,
             result=""
-        ) for gm in Groupmember.objects.filter(group=group) if gm.member_user.user_id is not user.user_id]
+        ) for user_id in get_members(group.group_id) if user_id != user.user_id]
         Systemmsg.objects.bulk_create(msgs)
 
     update_user = []
@@ -378,10 +377,7 @@ def avatar(req: HttpRequest):
         ) for gm in Groupmember.objects.filter(group=group) if gm.member_user.user_id is not user.user_id]
         Systemmsg.objects.bulk_create(msgs)
 
-    update_user = []
-    for msg in Systemmsg.objects.filter(sysop=sysop).order_by("-sysmsg_id"):
-        if push_sysmsg(msg.target_user, msg.sysmsg_id):
-            update_user.append(msg.target_user)
-    User.objects.bulk_update(update_user, fields=["read_sysmsg_id"])
+    targets = [(msg.target_user, msg.sysmsg_id) for msg in Systemmsg.objects.filter(sysop=sysop).order_by("-sysmsg_id").select_related("target_user")]
+    dispatch_to("sysmsg", push_sysmsgs, targets)
 
     return request_success()
@@ -13,4 +13,10 @@ python3 manage.py migrate
 #     --max-requests=5000 \
 #     --vacuum
 
+# several daphne workers sharing one channel layer broker, put them behind a load balancer:
+# export IM_BROKER=unix:/tmp/im-broker.sock
+# python3 -m websocket.broker $IM_BROKER &
+# daphne -b 0.0.0.0 -p 8001 DjangoHW.asgi:application &
+# daphne -b 0.0.0.0 -p 8002 DjangoHW.asgi:application
+
 daphne -b 0.0.0.0 -p 80 DjangoHW.asgi:application
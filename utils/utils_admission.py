@@ -0,0 +1,204 @@
+"""
+Admission control in front of the database work of the hot paths.
+
+At most ADMISSION_LIMIT requests work on the database at once. The others wait for a slot in
+one of two lanes:
+
+- "chat": chat sends (on_message), which may take every slot
+- "bulk": login catch-up and the heavy REST reads (group/list, msg/fetch, msg/forward), which leave
+  ADMISSION_RESERVED slots to chat sends, and never take a slot while a chat send is waiting
+
+A request waits at most ADMISSION_DEADLINE of its lane, behind at most ADMISSION_QUEUE others of
+its lane; past either it is rejected at once with Overloaded, and the client is told to retry
+after ADMISSION_RETRY_AFTER seconds: 503 with Retry-After for the REST views tagged by Admit, a
+busy frame or a 1013 close for websockets. Spikes thus turn into fast rejections instead of an
+ever longer queue in front of SQLite.
+"""
+import time
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from django.urls import resolve, Resolver404
+from django.utils.decorators import sync_and_async_middleware
+
+from utils.utils_request import request_failed
+
+ADMISSION_LIMIT = 8
+ADMISSION_RESERVED = 2
+ADMISSION_DEADLINE = {"chat": 1.0, "bulk": 0.25}  # seconds
+ADMISSION_QUEUE = {"chat": 256, "bulk": 64}
+ADMISSION_RETRY_AFTER = 1  # seconds
+
+# requests holding a slot, and requests waiting per lane
+admission_state = {"active": 0, "chat": 0, "bulk": 0}
+admission_stats = {"admitted": 0, "waited": 0, "rejected": 0}
+admission_cond = threading.Condition()
+# future -> its event loop, of the async waiters: admission_cond only wakes the threads
+admission_waiters = {}
+
+
+class Overloaded(Exception):
+    def __init__(self, lane):
+        super().__init__(f"Server busy, retry after {ADMISSION_RETRY_AFTER}s")
+        self.lane = lane
+        self.retry_after = ADMISSION_RETRY_AFTER
+
+
+# whether a request of lane may take a slot now, called with admission_cond held
+def _free(lane) -> bool:
+    if lane == "chat":
+        return admission_state["active"] < ADMISSION_LIMIT
+    return admission_state["active"] < ADMISSION_LIMIT - ADMISSION_RESERVED and admission_state["chat"] == 0
+
+def _resolve(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+# wake every waiter to try again, called with admission_cond held
+def _wake():
+    admission_cond.notify_all()
+    for waiter, loop in admission_waiters.items():
+        loop.call_soon_threadsafe(_resolve, waiter)
+    admission_waiters.clear()
+
+# take a slot right away, or start waiting: returns True if admitted, the deadline otherwise
+def _try_enter(lane, deadline=None):
+    with admission_cond:
+        if _free(lane):
+            if deadline is not None:
+                admission_state[lane] -= 1
+            admission_state["active"] += 1
+            admission_stats["admitted"] += 1
+            return True
+        if deadline is None:
+            if admission_state[lane] >= ADMISSION_QUEUE[lane]:
+                admission_stats["rejected"] += 1
+                raise Overloaded(lane)
+            admission_state[lane] += 1
+            admission_stats["waited"] += 1
+            return time.monotonic() + ADMISSION_DEADLINE[lane]
+        if time.monotonic() >= deadline:
+            admission_state[lane] -= 1
+            admission_stats["rejected"] += 1
+            # bulk requests may have been held back by this chat send
+            _wake()
+            raise Overloaded(lane)
+        return deadline
+
+# stop waiting without a slot, on anything but Overloaded (which does it itself): a cancelled task
+def _abandon(lane):
+    with admission_cond:
+        admission_state[lane] -= 1
+        _wake()
+
+def leave():
+    with admission_cond:
+        admission_state["active"] -= 1
+        _wake()
+
+def enter(lane):
+    deadline = _try_enter(lane)
+    try:
+        while deadline is not True:
+            with admission_cond:
+                admission_cond.wait(max(0, deadline - time.monotonic()))
+            deadline = _try_enter(lane, deadline)
+    except Overloaded:
+        raise
+    except BaseException:
+        _abandon(lane)
+        raise
+
+async def aenter(lane):
+    deadline = _try_enter(lane)
+    loop = asyncio.get_running_loop()
+    try:
+        while deadline is not True:
+            waiter = loop.create_future()
+            with admission_cond:
+                admission_waiters[waiter] = loop
+            try:
+                # registered first, so that a slot freed in between is not missed
+                deadline = _try_enter(lane, deadline)
+                if deadline is not True:
+                    await asyncio.wait([waiter], timeout=max(0, deadline - time.monotonic()))
+            finally:
+                with admission_cond:
+                    admission_waiters.pop(waiter, None)
+    except Overloaded:
+        raise
+    except BaseException:
+        _abandon(lane)
+        raise
+
+# hold a slot of lane for the duration of the block, raise Overloaded if none can be had
+@contextmanager
+def admit(lane):
+    enter(lane)
+    try:
+        yield
+    finally:
+        leave()
+
+@asynccontextmanager
+async def aadmit(lane):
+    await aenter(lane)
+    try:
+        yield
+    finally:
+        leave()
+
+# 503 with a Retry-After hint, returned to a rejected REST request
+def busy_response(e: Overloaded):
+    res = request_failed(3, str(e), 503)
+    res["Retry-After"] = str(e.retry_after)
+    return res
+
+# A decorator function putting views function in lane, see AdmissionMiddleware.
+def Admit(lane):
+    def decorator(view_fn):
+        view_fn.admission_lane = lane
+        return view_fn
+    return decorator
+
+# lane of the view serving path, None if it is not admission controlled
+def view_lane(path):
+    try:
+        return getattr(resolve(path).func, "admission_lane", None)
+    except Resolver404:
+        return None
+
+@sync_and_async_middleware
+def AdmissionMiddleware(get_response):
+    """
+    Run the views tagged by Admit in a slot of their lane.
+    Under ASGI the slot is awaited on the event loop, so a waiting request never holds the thread
+    the sync views and the database work of the consumers share.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            lane = view_lane(request.path_info)
+            if lane is None:
+                return await get_response(request)
+            try:
+                await aenter(lane)
+            except Overloaded as e:
+                return busy_response(e)
+            try:
+                return await get_response(request)
+            finally:
+                leave()
+    else:
+        def middleware(request):
+            lane = view_lane(request.path_info)
+            if lane is None:
+                return get_response(request)
+            try:
+                enter(lane)
+            except Overloaded as e:
+                return busy_response(e)
+            try:
+                return get_response(request)
+            finally:
+                leave()
+    return middleware
@@ -0,0 +1,122 @@
+"""
+Write-behind delivery cursors.
+
+Pushing a message moves Groupmember.sent_msg_id of every online member. Instead of writing those
+rows on every message, the new cursors are kept here and written in batches: when
+CURSOR_FLUSH_INTERVAL has passed since the last flush, when CURSOR_FLUSH_SIZE cursors are
+pending, when a websocket of the user disconnects, and at exit. Requests check the interval as they
+send; the flusher thread (start_flusher, started by DjangoHW/asgi.py) checks it every
+CURSOR_FLUSH_INTERVAL as well, so cursors moved before a quiet period, or read by another worker,
+are not held back until the next request.
+
+Crash recovery: cursors not yet flushed are lost, so sent_msg_id in database may lag behind what was
+really sent, by at most CURSOR_FLUSH_INTERVAL. After a restart the next push to that member starts
+from the older cursor and resends messages the client already has; a reconnect catches up from
+ack_msg_id as before. Clients therefore may see a message twice (and drop it by msg_id), but never
+miss one: cursors only ever lag, they are never ahead of what was sent.
+"""
+import time
+import atexit
+import logging
+import threading
+from django.db import close_old_connections
+
+from im.models import Groupmember
+
+CURSOR_FLUSH_INTERVAL = 1  # seconds
+CURSOR_FLUSH_SIZE = 1000
+
+# (group_id, user_id) -> sent_msg_id not yet written to Groupmember
+pending_cursors = {}
+cursor_stats = {"set": 0, "flushed": 0, "writes": 0}
+cursor_lock = threading.Lock()
+last_flush = time.time()
+
+logger = logging.getLogger(__name__)
+flusher = None
+flusher_stop = threading.Event()
+flusher_lock = threading.Lock()
+
+def set_cursors(group_id, user_ids, msg_id):
+    with cursor_lock:
+        for user_id in user_ids:
+            key = (group_id, user_id)
+            if pending_cursors.get(key, -1) < msg_id:
+                pending_cursors[key] = msg_id
+        cursor_stats["set"] += len(user_ids)
+
+# raise sent_msg_id of members loaded from database to their pending cursor
+def apply_cursors(members: list):
+    with cursor_lock:
+        for gm in members:
+            gm.sent_msg_id = max(gm.sent_msg_id, pending_cursors.get((gm.group_id, gm.member_user_id), -1))
+
+# forget the pending cursor of a member whose row was written directly
+def discard_cursor(group_id, user_id):
+    with cursor_lock:
+        pending_cursors.pop((group_id, user_id), None)
+
+def flush_cursors(user_id=None) -> int:
+    """
+    Write pending cursors (of user_id only, if given) to database.
+    Members that received the same message share one UPDATE.
+
+    :returns: number of cursors written
+    """
+    global last_flush
+    with cursor_lock:
+        if user_id is None:
+            batch = dict(pending_cursors)
+            pending_cursors.clear()
+            last_flush = time.time()
+        else:
+            batch = {key: pending_cursors.pop(key) for key in [key for key in pending_cursors if key[1] == user_id]}
+    if not batch:
+        return 0
+
+    by_value = {}
+    for (group_id, member_id), msg_id in batch.items():
+        by_value.setdefault((group_id, msg_id), []).append(member_id)
+    for (group_id, msg_id), member_ids in by_value.items():
+        # never move a cursor back, a newer value may have been written meanwhile
+        Groupmember.objects.filter(group_id=group_id, member_user_id__in=member_ids, sent_msg_id__lt=msg_id).update(sent_msg_id=msg_id)
+    cursor_stats["flushed"] += len(batch)
+    cursor_stats["writes"] += len(by_value)
+    return len(batch)
+
+def cursors_due() -> bool:
+    return len(pending_cursors) >= CURSOR_FLUSH_SIZE or (len(pending_cursors) > 0 and time.time() - last_flush >= CURSOR_FLUSH_INTERVAL)
+
+def flush_cursors_if_due() -> int:
+    return flush_cursors() if cursors_due() else 0
+
+def run_flusher():
+    while not flusher_stop.wait(CURSOR_FLUSH_INTERVAL):
+        try:
+            flush_cursors_if_due()
+        except Exception:
+            # kept pending cursors are lost, they only lag: see the module docstring
+            logger.exception("flushing cursors failed")
+        finally:
+            close_old_connections()
+
+def start_flusher():
+    global flusher
+    with flusher_lock:
+        if flusher is None or not flusher.is_alive():
+            flusher_stop.clear()
+            flusher = threading.Thread(target=run_flusher, name="cursor-flusher", daemon=True)
+            flusher.start()
+
+def stop_flusher():
+    with flusher_lock:
+        flusher_stop.set()
+        if flusher is not None:
+            flusher.join()
+
+@atexit.register
+def flush_at_exit():
+    try:
+        flush_cursors()
+    except Exception:
+        pass
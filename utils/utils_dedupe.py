@@ -0,0 +1,59 @@
+"""
+Idempotent chat sends.
+
+A client whose socket drops in the middle of a send cannot tell whether the message was stored, and
+sends it again. When the message carries a client_msg_id, the (sender, client_msg_id) pair is kept
+here with the msg_id it was stored as, for the last DEDUPE_SIZE sends: a retry is answered with that
+msg_id and neither stored nor fanned out again. A retry arriving while the first send is still being
+written is dropped, the first one answers for both. A send that fails gives its pair back, so that
+its retry is a new send.
+
+The index lives in memory, per worker: a retry reaching another worker, or coming after
+DEDUPE_SIZE other sends, is stored again.
+"""
+import threading
+from collections import OrderedDict
+
+DEDUPE_SIZE = 65536
+MAX_CLIENT_MSG_ID_LENGTH = 64
+
+# (user_name, client_msg_id) -> msg_id, None while the first send is being written
+recent_sends = OrderedDict()
+dedupe_stats = {"sends": 0, "duplicates": 0, "in_flight": 0}
+dedupe_lock = threading.Lock()
+
+# (user_name, client_msg_id) of a message.content, None without client_msg_id
+def send_key(user_name, content):
+    if not isinstance(content, dict) or content.get("client_msg_id") is None:
+        return None
+    client_msg_id = content["client_msg_id"]
+    assert isinstance(client_msg_id, (str, int)) and len(str(client_msg_id)) <= MAX_CLIENT_MSG_ID_LENGTH, \
+        "invalid client_msg_id"
+    return (user_name, client_msg_id)
+
+def claim(key):
+    """
+    Reserve key for a new send.
+
+    :returns: (True, None) for a new send, (False, msg_id) for a retry, msg_id None if still in flight
+    """
+    with dedupe_lock:
+        if key in recent_sends:
+            msg_id = recent_sends[key]
+            recent_sends.move_to_end(key)
+            dedupe_stats["duplicates" if msg_id is not None else "in_flight"] += 1
+            return False, msg_id
+        recent_sends[key] = None
+        dedupe_stats["sends"] += 1
+        while len(recent_sends) > DEDUPE_SIZE:
+            recent_sends.popitem(last=False)
+        return True, None
+
+def settle(key, msg_id):
+    with dedupe_lock:
+        recent_sends[key] = msg_id
+
+def release(key):
+    with dedupe_lock:
+        if key in recent_sends and recent_sends[key] is None:
+            recent_sends.pop(key)
@@ -0,0 +1,92 @@
+"""
+Per-device delivery cursors.
+
+Frames go to the channel layer group of a user, so every socket of that user gets each of them:
+the window a push resends from the member's sent_msg_id, or the login catch-up of a device just
+connected, reaches the devices that have these messages already. Frames carrying messages therefore
+tell, event by event, which (group_id, msg_id) they hold ("ids" of the chat.frame event), and each
+socket keeps the last msg_id it was given per group here. An event to be delivered whatever the
+cursors has [group_id, msg_id, True] (the message pushed, which may be a recall) or None (one that
+is not a message, e.g. a system message). A socket gets the events it is missing only; a
+frame it has all of is not sent at all.
+
+A cursor only stands for everything up to it once the socket had a login catch-up (a frame sent
+with catchup set): until then the socket is given every frame in full and its cursors are left
+alone, so that a live push overtaking the catch-up does not hide the older messages of the latter.
+A socket that never has one (a sync or resumed connection) is simply not filtered.
+
+The table lives in memory, keyed by user and channel of the socket, for as long as the socket is
+open. When it closes, its cursors are handed to utils.utils_cursor, written to sent_msg_id with the
+next flush.
+
+Trimming a frame does not decode it again for every socket: the events of the frames last trimmed
+are kept encoded one by one (frame_events), and the part sent is joined from those.
+"""
+import json
+from functools import lru_cache
+
+from .utils_cursor import set_cursors
+
+FRAME_CACHE_SIZE = 256  # frames
+
+# (user_id, channel_name) -> {group_id: last msg_id sent to that socket}, None before its catch-up
+device_cursors = {}
+device_stats = {"frames": 0, "events": 0, "duplicates": 0, "skipped": 0}
+
+def open_device(user_id, channel_name):
+    device_cursors[(user_id, channel_name)] = None
+
+def close_device(user_id, channel_name):
+    cursors = device_cursors.pop((user_id, channel_name), None) or {}
+    for group_id, msg_id in cursors.items():
+        set_cursors(group_id, [user_id], msg_id)
+
+# events of frame text, each encoded on its own
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def frame_events(text) -> tuple:
+    return tuple(json.dumps(event) for event in json.loads(text))
+
+# frame text cut down to its events at indices keep
+def trim_frame(text, keep) -> str:
+    events = frame_events(text)
+    return "[" + ", ".join(events[index] for index in keep) + "]"
+
+def missing(user_id, channel_name, text, ids, catchup=False, kept=None):
+    """
+    The part of frame text that the socket of (user_id, channel_name) has not been sent yet, None if nothing.
+
+    :param ids: [group_id, msg_id], [group_id, msg_id, True] or None for each event of text
+    :param catchup: text is a login catch-up
+    :param kept: list filled with the ids of the events returned
+    """
+    kept = [] if kept is None else kept
+    key = (user_id, channel_name)
+    if ids is None or key not in device_cursors:
+        kept.extend(ids or [])
+        return text
+    cursors = device_cursors[key]
+    if cursors is None:
+        if not catchup:
+            kept.extend(ids)
+            return text
+        cursors = device_cursors[key] = {}
+    keep = []
+    before = dict(cursors)
+    for index, item in enumerate(ids):
+        if item is None:
+            keep.append(index)
+            continue
+        group_id, msg_id, *forced = item
+        if forced or msg_id > before.get(group_id, -1):
+            cursors[group_id] = max(msg_id, cursors.get(group_id, -1))
+            keep.append(index)
+    device_stats["frames"] += 1
+    device_stats["events"] += len(keep)
+    kept.extend(ids[index] for index in keep)
+    if len(keep) == len(ids):
+        return text
+    device_stats["duplicates"] += len(ids) - len(keep)
+    if not keep:
+        device_stats["skipped"] += 1
+        return None
+    return trim_frame(text, keep)
@@ -0,0 +1,65 @@
+import json
+from collections import OrderedDict
+
+from im.models import Message
+
+FRAME_CACHE_SIZE = 4096
+
+# JSON text of Message.serialize(), (msg_id, msg_type, create_time) -> str
+# the key changes with the row: a recalled message never matches its old text, wherever it was recalled
+frame_cache = OrderedDict()
+frame_cache_stats = {"hit": 0, "miss": 0}
+
+def encode(obj) -> str:
+    return json.dumps(obj)
+
+# JSON text of msg.serialize(), shared by every push, catch-up and fetch of a stored message
+def message_text(msg: Message) -> str:
+    key = (msg.msg_id, msg.msg_type, msg.create_time)
+    text = frame_cache.get(key)
+    if text is not None:
+        frame_cache_stats["hit"] += 1
+        frame_cache.move_to_end(key)
+        return text
+    frame_cache_stats["miss"] += 1
+    text = encode(msg.serialize())
+    frame_cache[key] = text
+    if len(frame_cache) > FRAME_CACHE_SIZE:
+        frame_cache.popitem(last=False)
+    return text
+
+# event of a websocket frame holding an already encoded content
+def event_text(event_type: str, content_text: str) -> str:
+    return '{"type": ' + encode(event_type) + ', "content": ' + content_text + '}'
+
+def message_event_text(msg: Message, cached=True) -> str:
+    # messages not in database (e.g. a delete notice) are encoded without being cached
+    return event_text("message", message_text(msg) if cached else encode(msg.serialize()))
+
+# "group_id has a new (or recalled) message msg_id", sent instead of the message to large groups
+def hint_text(group_id, msg_id, msg_type) -> str:
+    return event_text("hint", encode({"group_id": group_id, "msg_id": msg_id, "msg_type": msg_type}))
+
+# "try again after retry_after seconds", sent back with the content of a chat send that was shed
+def busy_text(retry_after, content) -> str:
+    return event_text("busy", encode({"retry_after": retry_after, "message": content}))
+
+# "the send of client_msg_id is stored as msg_id", answer to a send (or its retry) with a client_msg_id
+def sent_text(client_msg_id, msg_id) -> str:
+    return event_text("sent", encode({"client_msg_id": client_msg_id, "msg_id": msg_id}))
+
+# answer to the rpc request_id, response_text the JSON body of the REST response with its HTTP status,
+# and its Retry-After if it was shed
+def rpc_text(request_id, status, response_text, retry_after=None) -> str:
+    tail = "" if retry_after is None else ', "retry_after": ' + str(retry_after)
+    return event_text("rpc", '{"id": ' + encode(request_id) + ', "status": ' + str(status) + ', "response": ' + response_text + tail + '}')
+
+# a websocket frame is a JSON array of events
+def join_frame(texts: list) -> str:
+    return "[" + ", ".join(texts) + "]"
+
+# one frame holding the events of frames, in order
+def merge_frames(frames: list) -> str:
+    if len(frames) == 1:
+        return frames[0]
+    return join_frame([frame[1:-1] for frame in frames if frame != "[]"])
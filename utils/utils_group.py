@@ -0,0 +1,74 @@
+import time
+from collections import namedtuple
+from django.conf import settings
+
+from im.models import Groupmember
+
+# seconds a cached membership is trusted, bounds staleness when another worker changed it
+GROUP_CACHE_TTL = 60
+GROUP_CACHE_SIZE = 10000
+# groups with more members get a hint instead of their new messages, see websocket/views.py push_group
+FANOUT_READ_THRESHOLD = 1000
+
+Member = namedtuple("Member", ["user_name", "member_role", "do_not_disturb"])
+
+# process-local membership cache, group_id -> (expire_time, {user_id: Member})
+# entries are dropped on every membership change made by this process, see im/signals.py
+# it decides who may post in a group: off (settings.GROUP_CACHE) when other workers change memberships too
+group_cache = {}
+# user_id -> group_ids of the cached groups holding user_id
+user_groups = {}
+group_cache_stats = {"hit": 0, "miss": 0, "invalidate": 0}
+
+def _drop(group_id):
+    entry = group_cache.pop(group_id, None)
+    if entry is not None:
+        for user_id in entry[1]:
+            groups = user_groups.get(user_id)
+            if groups is not None:
+                groups.discard(group_id)
+                if not groups:
+                    user_groups.pop(user_id)
+    return entry
+
+# members of group_id, user_id -> Member
+def get_members(group_id) -> dict:
+    entry = group_cache.get(group_id)
+    if entry is not None and entry[0] > time.time():
+        group_cache_stats["hit"] += 1
+        return entry[1]
+    group_cache_stats["miss"] += 1
+    members = {
+        user_id: Member(user_name, member_role, do_not_disturb)
+        for user_id, user_name, member_role, do_not_disturb in Groupmember.objects.filter(group_id=group_id).order_by("id")
+            .values_list("member_user_id", "member_user__user_name", "member_role", "do_not_disturb")
+    }
+    if not settings.GROUP_CACHE:
+        return members
+    _drop(group_id)
+    if len(group_cache) >= GROUP_CACHE_SIZE:
+        # dicts keep insertion order, the first entry is the oldest
+        _drop(next(iter(group_cache)))
+    group_cache[group_id] = (time.time() + GROUP_CACHE_TTL, members)
+    for user_id in members:
+        user_groups.setdefault(user_id, set()).add(group_id)
+    return members
+
+def is_member(group_id, user_id) -> bool:
+    return user_id in get_members(group_id)
+
+def fanout_on_read(group_id) -> bool:
+    return len(get_members(group_id)) > FANOUT_READ_THRESHOLD
+
+def invalidate_group(group_id):
+    if _drop(group_id) is not None:
+        group_cache_stats["invalidate"] += 1
+
+# drop every cached group containing user_id
+def invalidate_user(user_id):
+    for group_id in list(user_groups.get(user_id, ())):
+        invalidate_group(group_id)
+
+def cache_hit_rate() -> float:
+    total = group_cache_stats["hit"] + group_cache_stats["miss"]
+    return group_cache_stats["hit"] / total if total else 0.0
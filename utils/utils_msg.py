@@ -1,12 +1,16 @@
 import json
 
 from im.models import Groupmember, Message, Userdelmsg, File
+from utils.utils_ring import latest_message
 
 
 RECALL_TIME_LIMIT = 2 * 60 # 2 minutes
 
 def get_latest_msg(gm: Groupmember):
     delids = Userdelmsg.objects.filter(user=gm.member_user, msg__group=gm.group).values("msg__msg_id")
+    hit, text = latest_message(gm.group, gm.ack_msg_id, {item["msg__msg_id"] for item in delids})
+    if hit:
+        return None if text is None else json.loads(text)
     qset = Message.objects.filter(group=gm.group, msg_id__lte=gm.ack_msg_id).exclude(msg_id__in=delids)
     if not qset.exists():
         return None
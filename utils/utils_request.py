@@ -1,4 +1,5 @@
-from django.http import JsonResponse
+import json
+from django.http import JsonResponse, HttpResponse
 
 
 def request_failed(code, info, status_code=400):
@@ -16,6 +17,12 @@ def request_success(data={}):
     })
 
 
+# request_success with fields given as already encoded JSON text
+def request_success_encoded(encoded={}):
+    fields = "".join(f", {json.dumps(key)}: {text}" for key, text in encoded.items())
+    return HttpResponse('{"code": 0, "info": "Succeed"' + fields + '}', content_type="application/json")
+
+
 def return_field(obj_dict, field_list):
     for field in field_list:
         assert field in obj_dict, f"Field `{field}` not found in object."
@@ -0,0 +1,170 @@
+"""
+Ring buffers of the latest messages of recently active groups.
+
+A ring holds the JSON text (utils.utils_frame.message_text) of the last RING_SIZE messages of a
+group, together with a floor: every message of the group with msg_id > floor is in the ring.
+A read of the messages after some id is served by the ring when that id is >= floor, and goes to
+database otherwise (a miss).
+
+Rings are fed by the Message signals of im/signals.py (new messages, recalls, deletions), and filled
+by websocket.views.fetch_message_windows from the window it had to read anyway. All rings together
+hold at most RING_MAX_BYTES of text, the least recently used groups are dropped first.
+Rows deleted or recalled per user (Userdelmsg) stay in the ring, readers filter them out.
+
+A ring only sees the messages saved, recalled and deleted by its own process. With several workers
+sharing the broker it would miss those of the others, so rings are off unless settings.MESSAGE_RINGS:
+every read then goes to database, as a miss.
+"""
+import threading
+from bisect import bisect_right, insort
+from collections import OrderedDict
+from django.conf import settings
+
+from im.models import Group, Message
+from utils.utils_frame import message_text
+
+RING_SIZE = 64
+RING_MAX_BYTES = 16 << 20
+
+class Ring:
+    def __init__(self, floor):
+        self.floor = floor
+        self.entries = []   # (msg_id, text) ordered by msg_id
+        self.bytes = 0
+
+# (group_id, group create_time) -> Ring, least recently used first
+# like the frame cache, the key changes with the row: a group id reused after deletion never matches
+rings = OrderedDict()
+ring_stats = {"hit": 0, "miss": 0, "evict": 0, "bytes": 0}
+ring_lock = threading.Lock()
+
+def ring_key(group: Group):
+    return (group.group_id, group.create_time)
+
+def _trim(ring: Ring):
+    while len(ring.entries) > RING_SIZE:
+        msg_id, text = ring.entries.pop(0)
+        ring.floor = msg_id
+        ring.bytes -= len(text)
+        ring_stats["bytes"] -= len(text)
+
+def _evict():
+    while ring_stats["bytes"] > RING_MAX_BYTES and rings:
+        _, ring = rings.popitem(last=False)
+        ring_stats["bytes"] -= ring.bytes
+        ring_stats["evict"] += 1
+
+def _insert(ring: Ring, msg_id, text):
+    ids = [entry[0] for entry in ring.entries]
+    index = bisect_right(ids, msg_id)
+    if index > 0 and ids[index - 1] == msg_id:
+        old = ring.entries[index - 1][1]
+        ring.entries[index - 1] = (msg_id, text)
+        ring.bytes += len(text) - len(old)
+        ring_stats["bytes"] += len(text) - len(old)
+    else:
+        insort(ring.entries, (msg_id, text))
+        ring.bytes += len(text)
+        ring_stats["bytes"] += len(text)
+
+# a message was saved: add it to the ring of its group (starting one), or replace its text after a recall
+def ring_saved(msg: Message, created: bool):
+    if not settings.MESSAGE_RINGS:
+        return
+    key = ring_key(msg.group)
+    text = message_text(msg)
+    with ring_lock:
+        ring = rings.get(key)
+        if ring is None:
+            if not created:
+                return
+            # the newest message of the group: nothing after it is missing
+            ring = rings[key] = Ring(msg.msg_id - 1)
+        if msg.msg_id <= ring.floor:
+            return
+        _insert(ring, msg.msg_id, text)
+        _trim(ring)
+        rings.move_to_end(key)
+        _evict()
+
+def ring_deleted(msg: Message):
+    # looked up by group_id, msg.group may be deleted already when a group is deleted with its messages
+    with ring_lock:
+        ring = next((ring for key, ring in rings.items() if key[0] == msg.group_id), None)
+        if ring is None:
+            return
+        for index, (msg_id, text) in enumerate(ring.entries):
+            if msg_id == msg.msg_id:
+                ring.entries.pop(index)
+                ring.bytes -= len(text)
+                ring_stats["bytes"] -= len(text)
+                break
+
+def drop_ring(group: Group):
+    with ring_lock:
+        ring = rings.pop(ring_key(group), None)
+        if ring is not None:
+            ring_stats["bytes"] -= ring.bytes
+
+# fill the ring of group from messages, every message of it with msg_id > floor, ordered by msg_id
+def fill_ring(group: Group, floor, messages: list):
+    if not settings.MESSAGE_RINGS:
+        return
+    entries = [(msg.msg_id, message_text(msg)) for msg in messages[-RING_SIZE:]]
+    if len(messages) > RING_SIZE:
+        floor = messages[-RING_SIZE - 1].msg_id
+    key = ring_key(group)
+    with ring_lock:
+        old = rings.get(key)
+        if old is not None and old.floor <= floor:
+            return
+        ring = rings[key] = Ring(floor)
+        if old is not None:
+            # keep messages saved since messages were read
+            ring_stats["bytes"] -= old.bytes
+            entries += [entry for entry in old.entries if entry[0] > floor]
+        for msg_id, text in entries:
+            _insert(ring, msg_id, text)
+        _trim(ring)
+        rings.move_to_end(key)
+        _evict()
+
+def recent_messages(group: Group, after_msg_id):
+    """
+    Messages of group with msg_id > after_msg_id, as a list of (msg_id, text), None on a miss.
+    """
+    key = ring_key(group)
+    with ring_lock:
+        ring = rings.get(key) if settings.MESSAGE_RINGS else None
+        if ring is None or after_msg_id < ring.floor:
+            ring_stats["miss"] += 1
+            return None
+        ring_stats["hit"] += 1
+        rings.move_to_end(key)
+        ids = [entry[0] for entry in ring.entries]
+        return ring.entries[bisect_right(ids, after_msg_id):]
+
+def latest_message(group: Group, max_msg_id, excluded=()):
+    """
+    Text of the latest message of group with msg_id <= max_msg_id and not in excluded:
+    (True, text), (True, None) if there is no such message, (False, None) on a miss.
+    """
+    key = ring_key(group)
+    with ring_lock:
+        ring = rings.get(key) if settings.MESSAGE_RINGS else None
+        if ring is not None:
+            for msg_id, text in reversed(ring.entries):
+                if msg_id <= max_msg_id and msg_id not in excluded:
+                    ring_stats["hit"] += 1
+                    rings.move_to_end(key)
+                    return True, text
+            # msg_id starts at 1: the ring holds the whole group
+            if ring.floor <= 0:
+                ring_stats["hit"] += 1
+                return True, None
+        ring_stats["miss"] += 1
+        return False, None
+
+def ring_hit_rate() -> float:
+    total = ring_stats["hit"] + ring_stats["miss"]
+    return ring_stats["hit"] / total if total else 0.0
@@ -1,42 +1,98 @@
+import asyncio
+from hashlib import md5
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 
+# websocket connections held by this process, user_name -> {jwt_token: channel_name}
+# delivery goes through the channel layer, so connections held by other workers are reached as well
 ws_reg = {}
 
+# name of the channel layer group holding every connection of user_name
+def user_group(user_name):
+    return "user." + md5(user_name.encode("utf-8")).hexdigest()
+
+# number of channels in a layer group, None if the layer cannot tell
+def group_size(layer, group):
+    if hasattr(layer, "group_size"):
+        return layer.group_size(group)
+    groups = getattr(layer, "groups", None)
+    if isinstance(groups, dict):
+        return len(groups.get(group, {}))
+    return None
+
 # record websocket connection, using (user_name, jwt_token) as key
-def login_user(user_name, jwt_token, ws):
+# the consumer itself joins user_group(user_name) on the channel layer
+def login_user(user_name, jwt_token, channel_name):
     if user_name not in ws_reg:
         ws_reg[user_name] = {}
-    ws_reg[user_name][jwt_token] = ws
+    ws_reg[user_name][jwt_token] = channel_name
 
 # try sending message to all websocket connections of user_name
 def send_msg(user_name, content):
-    if user_name in ws_reg:
-        err_jwts = []
-        for jwt, ws in ws_reg[user_name].items():
-            try:
-                ws.send_json(content)
-            except:
-                err_jwts.append(jwt)
-        for jwt in err_jwts:
-            try:
-                ws_reg[user_name].pop(jwt).close()
-            except:
-                pass
+    async_to_sync(asend_msg)(user_name, content)
+
+# async version of send_msg, for callers running inside the event loop
+async def asend_msg(user_name, content):
+    await get_channel_layer().group_send(user_group(user_name), {
+        "type": "chat.push",
+        "content": content,
+    })
+
+# send an already encoded JSON frame to all websocket connections of user_name
+# the same str can be handed to every recipient, it is encoded only once
+# lane is the outbound lane of the frame on each connection, see websocket/outbound.py
+# ids and catchup let each connection drop the messages it has already, see utils/utils_device.py
+def send_frame(user_name, text, lane="chat", ids=None, catchup=False):
+    async_to_sync(asend_frame)(user_name, text, lane, ids, catchup)
+
+async def asend_frame(user_name, text, lane="chat", ids=None, catchup=False):
+    event = {
+        "type": "chat.frame",
+        "text": text,
+        "lane": lane,
+    }
+    if ids is not None:
+        event["ids"] = ids
+    if catchup:
+        event["catchup"] = True
+    await get_channel_layer().group_send(user_group(user_name), event)
 
 # remove websocket connection from registry
 def clear_reg(user_name, jwt_token):
     if (user_name in ws_reg) and (jwt_token in ws_reg[user_name]):
-        ws = ws_reg[user_name].pop(jwt_token)
+        channel_name = ws_reg[user_name].pop(jwt_token)
         if not ws_reg[user_name]:
             ws_reg.pop(user_name)
-        return ws
+        return channel_name
     return None
 
-# close websocket connection
+# close websocket connection, wherever it is held
 def logout_user(user_name, jwt_token):
-    ws = clear_reg(user_name, jwt_token)
-    if ws:
-        ws.close()
+    layer = get_channel_layer()
+    event = {"type": "chat.logout", "jwt_token": jwt_token}
+    channel_name = clear_reg(user_name, jwt_token)
+    if channel_name:
+        # held by this process: leave the group now so that online() is updated at once
+        async_to_sync(layer.group_discard)(user_group(user_name), channel_name)
+        async_to_sync(layer.send)(channel_name, event)
+    async_to_sync(layer.group_send)(user_group(user_name), event)
+
+# whether group of layer has channels
+# a layer reporting sizes once connected (websocket.layers.BrokerChannelLayer) is connected for it, from a
+# sync caller; until it reports, the group counts as empty: a push is left to the login catch-up rather than
+# marked as sent (sent_msg_id, read_sysmsg_id) for a user who may be offline
+# layers that cannot report group sizes at all are assumed non-empty, delivery is then simply dropped by the layer
+def present(layer, group):
+    size = group_size(layer, group)
+    if size is None and getattr(layer, "presence_prefix", None) is not None and group.startswith(layer.presence_prefix):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            async_to_sync(layer.connection)()
+            size = group_size(layer, group)
+        return size is not None and size > 0
+    return size is None or size > 0
 
 # check if user_name is online, i.e. has a websocket connection with any jwt_token
 def online(user_name):
-    return (user_name in ws_reg) and (ws_reg[user_name] is not None)
+    return present(get_channel_layer(), user_group(user_name))
@@ -0,0 +1,325 @@
+"""
+Pub/sub broker shared by several daphne workers on one host, used through
+websocket.layers.BrokerChannelLayer.
+
+    python -m websocket.broker unix:/tmp/im-broker.sock
+    python -m websocket.broker tcp:127.0.0.1:6390
+
+Protocol: every frame is a msgpack array prefixed by its length (4 bytes, big endian).
+
+client -> broker  [req_id, op, *args]       req_id == 0 means no reply is wanted
+broker -> client  [req_id, error, value]    req_id == 0 carries presence updates {group: size}
+
+ops:
+    hello  prefix                 identify the process owning channels "*.prefix!*"
+    send   channel message        error "full" when the channel is at capacity
+    recv   channel                replied once messages are queued, with up to BATCH of them
+    add    group channel
+    discard group channel
+    gsend  [[group, message], ...]   batch of group sends, channels at capacity are skipped
+    watch  prefix                 reply with sizes of groups starting with prefix, then push changes
+    flush
+"""
+import sys
+import time
+import asyncio
+import argparse
+from collections import deque
+
+import msgpack
+
+HEADER_SIZE = 4
+BATCH = 100
+
+DEFAULT_CAPACITY = 100
+DEFAULT_EXPIRY = 60
+DEFAULT_GROUP_EXPIRY = 86400
+
+
+def pack(frame) -> bytes:
+    data = msgpack.packb(frame, use_bin_type=True)
+    return len(data).to_bytes(HEADER_SIZE, "big") + data
+
+
+class FrameBuffer:
+    """Split a byte stream into frames."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def feed(self, data: bytes):
+        self.data += data
+
+    def frames(self) -> list:
+        ret = []
+        offset = 0
+        view = memoryview(self.data)
+        while len(self.data) - offset >= HEADER_SIZE:
+            size = int.from_bytes(view[offset:offset + HEADER_SIZE], "big")
+            if len(self.data) - offset - HEADER_SIZE < size:
+                break
+            ret.append(msgpack.unpackb(view[offset + HEADER_SIZE:offset + HEADER_SIZE + size], raw=False))
+            offset += HEADER_SIZE + size
+        view.release()
+        del self.data[:offset]
+        return ret
+
+
+async def open_connection(address: str):
+    """Open a stream to `unix:PATH` or `tcp:HOST:PORT`."""
+    kind, _, target = address.partition(":")
+    if kind == "unix":
+        return await asyncio.open_unix_connection(target)
+    elif kind == "tcp":
+        host, _, port = target.rpartition(":")
+        return await asyncio.open_connection(host, int(port))
+    raise ValueError(f"Unsupported broker address {address}")
+
+
+def owner_prefix(channel: str):
+    """Process prefix of a specific channel, e.g. "specific.abc!xyz" -> "abc"."""
+    if "!" not in channel:
+        return None
+    return channel[:channel.index("!")].rpartition(".")[2]
+
+
+class Channel:
+    def __init__(self):
+        self.queue = deque()    # (expire_time, message)
+        self.waiter = None      # (client, req_id)
+
+
+class Client:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.prefix = None
+        self.watch = None
+        self.out = []
+
+    def reply(self, req_id, error=None, value=None):
+        if req_id:
+            self.out.append(pack([req_id, error, value]))
+
+    def flush(self):
+        if self.out and not self.writer.is_closing():
+            self.writer.write(b"".join(self.out))
+        self.out.clear()
+
+
+class Broker:
+    def __init__(self, capacity=DEFAULT_CAPACITY, expiry=DEFAULT_EXPIRY, group_expiry=DEFAULT_GROUP_EXPIRY):
+        self.capacity = capacity
+        self.expiry = expiry
+        self.group_expiry = group_expiry
+        self.channels = {}      # channel -> Channel
+        self.groups = {}        # group -> {channel: expire_time}
+        self.clients = set()
+        self.changed = set()    # groups whose size changed while handling the current frame
+        self.stats = {"frames": 0, "delivered": 0, "dropped": 0}
+
+    # ! Queues
+
+    def _channel(self, name):
+        if name not in self.channels:
+            self.channels[name] = Channel()
+        return self.channels[name]
+
+    def _expire(self, channel: Channel, now):
+        while channel.queue and channel.queue[0][0] < now:
+            channel.queue.popleft()
+
+    def push(self, name, message, now) -> bool:
+        channel = self._channel(name)
+        if channel.waiter is not None:
+            client, req_id = channel.waiter
+            channel.waiter = None
+            client.reply(req_id, None, [message])
+            self.stats["delivered"] += 1
+            return True
+        self._expire(channel, now)
+        if len(channel.queue) >= self.capacity:
+            self.stats["dropped"] += 1
+            return False
+        channel.queue.append((now + self.expiry, message))
+        return True
+
+    def pop(self, name, client: Client, req_id, now):
+        channel = self._channel(name)
+        self._expire(channel, now)
+        if channel.queue:
+            batch = [channel.queue.popleft()[1] for _ in range(min(BATCH, len(channel.queue)))]
+            client.reply(req_id, None, batch)
+            self.stats["delivered"] += len(batch)
+            if not channel.queue and channel.waiter is None:
+                self.channels.pop(name)
+            return
+        if channel.waiter is not None:
+            # a receive cancelled by the client is superseded by the new one
+            old_client, old_req_id = channel.waiter
+            old_client.reply(old_req_id, None, [])
+        channel.waiter = (client, req_id)
+
+    # ! Groups
+
+    def group_add(self, group, channel, now):
+        members = self.groups.setdefault(group, {})
+        if channel not in members:
+            self.changed.add(group)
+        members[channel] = now + self.group_expiry
+
+    def group_discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None and members.pop(channel, None) is not None:
+            self.changed.add(group)
+            if not members:
+                self.groups.pop(group)
+
+    def group_send(self, group, message, now):
+        members = self.groups.get(group)
+        if not members:
+            return
+        for channel, expire in list(members.items()):
+            if expire < now:
+                self.group_discard(group, channel)
+            else:
+                self.push(channel, message, now)
+
+    def group_sizes(self, prefix):
+        return {group: len(members) for group, members in self.groups.items() if group.startswith(prefix)}
+
+    # ! Connections
+
+    def handle(self, client: Client, frame):
+        req_id, op, *args = frame
+        now = time.time()
+        self.stats["frames"] += 1
+        if op == "gsend":
+            for group, message in args[0]:
+                self.group_send(group, message, now)
+        elif op == "send":
+            client.reply(req_id, None if self.push(args[0], args[1], now) else "full")
+        elif op == "recv":
+            self.pop(args[0], client, req_id, now)
+        elif op == "add":
+            self.group_add(args[0], args[1], now)
+            client.reply(req_id)
+        elif op == "discard":
+            self.group_discard(args[0], args[1])
+            client.reply(req_id)
+        elif op == "hello":
+            client.prefix = args[0]
+            client.reply(req_id)
+        elif op == "watch":
+            client.watch = args[0]
+            client.reply(req_id, None, self.group_sizes(args[0]))
+        elif op == "flush":
+            self.channels.clear()
+            self.changed.update(self.groups)
+            self.groups.clear()
+            client.reply(req_id)
+        else:
+            client.reply(req_id, f"unknown op {op}")
+
+    def publish_changes(self):
+        if not self.changed:
+            return
+        for client in self.clients:
+            if client.watch is None:
+                continue
+            sizes = {group: len(self.groups.get(group, ())) for group in self.changed if group.startswith(client.watch)}
+            if sizes:
+                client.out.append(pack([0, None, sizes]))
+        self.changed.clear()
+
+    def drop_client(self, client: Client):
+        """Forget the waiters of a closed connection, and the channels of its process if it was the last one."""
+        self.clients.discard(client)
+        for name, channel in list(self.channels.items()):
+            if channel.waiter is not None and channel.waiter[0] is client:
+                channel.waiter = None
+        if client.prefix is None or any(other.prefix == client.prefix for other in self.clients):
+            return
+        for group, members in list(self.groups.items()):
+            for channel in list(members):
+                if owner_prefix(channel) == client.prefix:
+                    self.group_discard(group, channel)
+        for name in [name for name in self.channels if owner_prefix(name) == client.prefix]:
+            self.channels.pop(name)
+
+    def sweep(self):
+        """Drop expired messages, idle channels and expired group memberships."""
+        now = time.time()
+        for name, channel in list(self.channels.items()):
+            self._expire(channel, now)
+            if not channel.queue and channel.waiter is None:
+                self.channels.pop(name)
+        for group, members in list(self.groups.items()):
+            for channel, expire in list(members.items()):
+                if expire < now:
+                    self.group_discard(group, channel)
+        self.flush_all()
+
+    def flush_all(self):
+        self.publish_changes()
+        for client in self.clients:
+            client.flush()
+
+    async def serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = Client(writer)
+        self.clients.add(client)
+        buffer = FrameBuffer()
+        try:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    break
+                buffer.feed(data)
+                # every frame read at once is handled before writing back, so replies are batched too
+                for frame in buffer.frames():
+                    self.handle(client, frame)
+                self.flush_all()
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.drop_client(client)
+            self.flush_all()
+            writer.close()
+
+
+async def serve(address: str, broker: Broker):
+    kind, _, target = address.partition(":")
+    if kind == "unix":
+        server = await asyncio.start_unix_server(broker.serve_client, target)
+    elif kind == "tcp":
+        host, _, port = target.rpartition(":")
+        server = await asyncio.start_server(broker.serve_client, host, int(port))
+    else:
+        raise ValueError(f"Unsupported broker address {address}")
+    print(f"broker listening on {address}", file=sys.stderr)
+
+    async def sweeper():
+        while True:
+            await asyncio.sleep(broker.expiry)
+            broker.sweep()
+
+    async with server:
+        sweep_task = asyncio.create_task(sweeper())
+        try:
+            await server.serve_forever()
+        finally:
+            sweep_task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Channel layer broker for im-backend workers")
+    parser.add_argument("address", help="unix:PATH or tcp:HOST:PORT")
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="messages queued per channel")
+    parser.add_argument("--expiry", type=int, default=DEFAULT_EXPIRY, help="seconds a queued message is kept")
+    parser.add_argument("--group-expiry", type=int, default=DEFAULT_GROUP_EXPIRY, help="seconds a group membership is kept")
+    args = parser.parse_args()
+    asyncio.run(serve(args.address, Broker(args.capacity, args.expiry, args.group_expiry)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Login catch-up off the websocket handshake.
+
+ChatConsumer.connect only authenticates, accepts and joins the user's channel layer group; the
+replay of what the user missed (alogin_fetch) is queued here and run by at most LOGIN_SYNC_WORKERS
+tasks. When a worker restarts and every client reconnects at once, handshakes stay cheap and the
+database sees a bounded number of catch-ups at a time instead of one per connection.
+
+The queue is fair between users: a user waits at most once however many connections it opens,
+and its catch-up, sent to its user group, serves every one of them. A catch-up shed by admission
+control goes back to the end of the queue. Users gone offline by their turn are skipped. A
+catch-up failing otherwise closes the connections waiting for it with 1011 (chat.catchup_failed),
+so that the clients reconnect and queue another one instead of missing messages silently.
+
+LOGIN_SYNC_WORKERS = 0 runs the catch-up inside connect, as before.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from channels.layers import get_channel_layer
+
+from utils.utils_websocket import online, user_group
+from utils.utils_admission import Overloaded
+from .views import alogin_fetch
+
+LOGIN_SYNC_WORKERS = 4
+LOGIN_SYNC_RETRY_DELAY = 0.1  # seconds
+
+logger = logging.getLogger(__name__)
+
+# user_id -> user waiting for its catch-up, oldest first
+pending_logins = OrderedDict()
+login_sync_stats = {"queued": 0, "coalesced": 0, "served": 0, "skipped": 0, "retried": 0, "failed": 0, "max_depth": 0}
+worker_tasks = set()
+
+
+async def request_login_sync(user):
+    """Queue the catch-up of user, start a worker if fewer than LOGIN_SYNC_WORKERS are running."""
+    if LOGIN_SYNC_WORKERS <= 0:
+        await alogin_fetch(user)
+        return
+    if user.user_id in pending_logins:
+        login_sync_stats["coalesced"] += 1
+    else:
+        pending_logins[user.user_id] = user
+        login_sync_stats["queued"] += 1
+        login_sync_stats["max_depth"] = max(login_sync_stats["max_depth"], len(pending_logins))
+    # workers left behind by an event loop that was closed no longer count
+    for task in [task for task in worker_tasks if task.done() or task.get_loop().is_closed()]:
+        worker_tasks.discard(task)
+    if len(worker_tasks) < LOGIN_SYNC_WORKERS:
+        task = asyncio.get_running_loop().create_task(login_sync_worker())
+        worker_tasks.add(task)
+        task.add_done_callback(worker_tasks.discard)
+
+
+async def login_sync_worker():
+    while pending_logins:
+        _, user = pending_logins.popitem(last=False)
+        if not online(user.user_name):
+            login_sync_stats["skipped"] += 1
+            continue
+        try:
+            await alogin_fetch(user)
+            login_sync_stats["served"] += 1
+        except Overloaded:
+            login_sync_stats["retried"] += 1
+            await asyncio.sleep(LOGIN_SYNC_RETRY_DELAY)
+            pending_logins.setdefault(user.user_id, user)
+        except Exception:
+            logger.exception("login catch-up of %s failed", user.user_name)
+            login_sync_stats["failed"] += 1
+            try:
+                await get_channel_layer().group_send(user_group(user.user_name), {"type": "chat.catchup_failed"})
+            except Exception:
+                logger.exception("closing the connections of %s failed", user.user_name)
@@ -0,0 +1,92 @@
+"""
+Binary MessagePack subprotocol (optional, negotiated at connect).
+
+Frames are JSON text everywhere on the server: encoded once per message (utils/utils_frame.py),
+shared by every recipient through the channel layer, kept in rings, resume buffers and retransmit
+windows. A client opening the websocket with the "msgpack" subprotocol gets each of them as a binary
+frame instead, converted by the writer of its connection: the same array of events, packed with
+MessagePack and the field names of COMPACT_KEYS shortened, wherever they appear. It sends its frames
+the same way. A client asking for no subprotocol keeps JSON text, as before.
+
+A frame fanned out to many msgpack connections is converted once: the last PACK_CACHE_SIZE
+conversions are kept, keyed by the JSON text.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = "msgpack"
+PACK_CACHE_SIZE = 1024
+
+# field name -> key on the wire, for the events and the messages they carry
+COMPACT_KEYS = {
+    "type": "t",
+    "content": "c",
+    "msg_id": "i",
+    "sender_id": "s",
+    "group_id": "g",
+    "msg_body": "b",
+    "msg_type": "m",
+    "create_time": "ct",
+    "reply_msg_id": "r",
+    "client_msg_id": "cm",
+    "sysmsg_id": "si",
+    "sysmsg_type": "st",
+    "message": "ms",
+    "update_time": "ut",
+    "can_operate": "co",
+    "result": "rs",
+    "sup_user_id": "su",
+    "sup_group_id": "sg",
+}
+EXPANDED_KEYS = {key: name for name, key in COMPACT_KEYS.items()}
+
+# JSON text of a frame -> its msgpack bytes, least recently used first
+pack_cache = OrderedDict()
+codec_stats = {"packed": 0, "hit": 0, "unpacked": 0, "json_bytes": 0, "msgpack_bytes": 0}
+pack_lock = threading.Lock()
+
+def rename(obj, keys: dict):
+    if isinstance(obj, dict):
+        return {keys.get(key, key): rename(value, keys) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [rename(item, keys) for item in obj]
+    return obj
+
+def compact(obj):
+    return rename(obj, COMPACT_KEYS)
+
+def expand(obj):
+    return rename(obj, EXPANDED_KEYS)
+
+# compact on the JSON text of a frame, as written by json.dumps: '"name": ' is only ever a key there,
+# a string holding it has its quotes escaped
+def compact_text(text: str) -> str:
+    for name, key in COMPACT_KEYS.items():
+        text = text.replace(f'"{name}": ', f'"{key}": ')
+    return text
+
+# the msgpack frame of the JSON frame text
+def pack_frame(text: str) -> bytes:
+    with pack_lock:
+        data = pack_cache.get(text)
+        if data is not None:
+            pack_cache.move_to_end(text)
+            codec_stats["hit"] += 1
+            return data
+    data = msgpack.packb(json.loads(compact_text(text)))
+    with pack_lock:
+        pack_cache[text] = data
+        if len(pack_cache) > PACK_CACHE_SIZE:
+            pack_cache.popitem(last=False)
+        codec_stats["packed"] += 1
+        codec_stats["json_bytes"] += len(text.encode("utf-8"))
+        codec_stats["msgpack_bytes"] += len(data)
+    return data
+
+# a frame sent by a msgpack client, with the field names of JSON; ValueError if it is not msgpack
+def unpack_frame(data: bytes):
+    codec_stats["unpacked"] += 1
+    return expand(msgpack.unpackb(data))
@@ -1,14 +1,209 @@
-from channels.generic.websocket import JsonWebsocketConsumer
+from channels.generic.websocket import JsonWebsocketConsumer, AsyncJsonWebsocketConsumer
 from channels.exceptions import StopConsumer
+from channels.db import database_sync_to_async
+from asgiref.sync import async_to_sync
 import sys
+import asyncio
 
 from im.models import User
-from .views import login_fetch, on_message
+from .views import login_fetch, on_message, aon_message, on_messages, aon_messages, on_sync, aon_sync, on_delivered, parse_cursors
+from .catchup import request_login_sync
+from .outbound import OutboundQueue
+from .retransmit import UnackedWindow
+from . import retransmit
+from . import resume
+from . import rpc
+from .codec import MSGPACK_SUBPROTOCOL, pack_frame, unpack_frame
 from utils.utils_jwt import auth_jwt_token
-from utils.utils_websocket import login_user, clear_reg
+from utils.utils_frame import busy_text, join_frame
+from utils.utils_admission import Overloaded
+from utils.utils_websocket import login_user, clear_reg, user_group
+from utils.utils_cursor import flush_cursors
+from utils.utils_device import open_device, close_device, missing
 
 
-class ChatConsumer(JsonWebsocketConsumer):
+# ?<jwt_token>&flag&key=value -> jwt_token, {flag: "", key: value}
+def parse_query(scope):
+    jwt_token, *params = scope['query_string'].decode('utf-8').split('&')
+    return jwt_token, dict(param.partition('=')[::2] for param in params)
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Chat consumer running on the event loop.
+    Database work is handed to the database thread, so a connection never holds a thread while idle or sending.
+    Each connection joins the channel layer group of its user, which is where every push is delivered.
+    Frames are written by a writer task from a bounded queue, see websocket/outbound.py.
+    The login catch-up is queued to the workers of websocket/catchup.py, connect does not wait for it.
+    A client connecting with ?<jwt_token>&sync gets no catch-up and asks for the deltas it misses by
+    "sync" frames instead (websocket.views.fetch_sync), answered on this connection only.
+    With &resume the connection can be resumed after a drop, see websocket/resume.py.
+    Frames carrying messages the connection was given already are trimmed, see utils/utils_device.py.
+    With &delivered the client acknowledges what it got and the rest is sent again, see websocket/retransmit.py.
+    A "message" frame may carry a list of message.content, stored and pushed as one batch (websocket.views.on_messages).
+    "rpc" frames run REST operations on the connection, see websocket/rpc.py.
+    A client asking for the "msgpack" subprotocol talks in binary MessagePack frames, see websocket/codec.py.
+    """
+
+    async def send_text(self, text):
+        if self.msgpack:
+            await self.send(bytes_data=pack_frame(text))
+        else:
+            await self.send(text_data=text)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is None or not self.msgpack:
+            await super().receive(text_data, bytes_data, **kwargs)
+            return
+        try:
+            content = unpack_frame(bytes_data)
+        except ValueError:
+            await self.log_error("Invalid msgpack frame")
+            return
+        await self.receive_json(content)
+
+    async def log_error(self, msg):
+        self.outbound.put(await self.encode_json([{"type": "error", "content": msg}]))
+
+    async def connect(self):
+        self.msgpack = MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", [])
+        try:
+            user_name = self.scope['path'].split('/')[-1]
+            assert len(user_name) > 0, "Invalid [user_name]"
+
+            jwt_token, params = parse_query(self.scope)
+            self.session = None
+            parked = resume.take(params["resume"], user_name, jwt_token) if params.get("resume") else None
+            if parked is None:
+                assert auth_jwt_token(jwt_token) == user_name, "Invalid [jwt_token]"
+                user = await User.objects.filter(user_name=user_name).afirst()
+                assert user is not None, "no such user"
+                user_id = user.user_id
+            else:
+                user = None
+                user_id = parked.user_id
+            self.user = user
+            self.user_name = user_name
+            self.user_id = user_id
+            self.jwt_token = jwt_token
+            await self.accept(MSGPACK_SUBPROTOCOL if self.msgpack else None)
+            self.outbound = OutboundQueue(self.send_text, self.close)
+            self.writer = asyncio.get_running_loop().create_task(self.outbound.run())
+            self.window = None
+            # a login catch-up is queued for this socket and not sent yet
+            self.catching_up = False
+            if "delivered" in params:
+                self.window = UnackedWindow()
+                self.retransmitter = asyncio.get_running_loop().create_task(self.retransmit_loop())
+            await self.channel_layer.group_add(user_group(user_name), self.channel_name)
+            login_user(user_name, jwt_token, self.channel_name)
+            open_device(user_id, self.channel_name)
+            if "resume" in params:
+                self.session = resume.issue(user_name, user_id, jwt_token)
+                self.outbound.put(resume.session_frame(self.session.token, parked is not None))
+            if parked is not None:
+                for text, lane in await resume.unpark(parked):
+                    self.outbound.put(text, lane)
+            elif "sync" not in params:
+                self.catching_up = True
+                await request_login_sync(user)
+        except AssertionError:
+            self.user_name = None
+            self.user_id = None
+            self.jwt_token = None
+            await self.close()
+        except Overloaded:
+            # no room for the catch-up run inside connect: 1013 tells the client to reconnect later
+            self.outbound.shutdown(1013)
+
+    async def disconnect(self, close_code):
+        if self.user_name is not None:
+            self.writer.cancel()
+            if self.window is not None:
+                self.retransmitter.cancel()
+            if self.session is not None and self.outbound.closing is None:
+                # dropped: hold the user's place in the group for a resume
+                pending = [(text, "chat") for text in (self.window.drain() if self.window is not None else [])]
+                pending += [(text, lane) for lane, frames in self.outbound.lanes.items() for text in frames]
+                await resume.park(self.session, self.channel_name, pending)
+            else:
+                if self.session is not None:
+                    resume.sessions.pop(self.session.token, None)
+                await self.channel_layer.group_discard(user_group(self.user_name), self.channel_name)
+            close_device(self.user_id, self.channel_name)
+            await database_sync_to_async(flush_cursors)(self.user_id)
+        clear_reg(self.user_name, self.jwt_token)
+        print(f"websocket disconnected with close code {close_code}", file=sys.stderr)
+        raise StopConsumer
+
+    async def receive_json(self, json):
+        try:
+            assert isinstance(json, dict) and set(json.keys()) == {"type", "content"}, "Invalid json format"
+            assert json["type"] in {"message", "sync", "delivered", "rpc"}, "Invalid message [type]"
+            msg_type = json["type"]
+            if msg_type == "message":
+                if isinstance(json["content"], list):
+                    sent = await aon_messages(self.user_name, json["content"])
+                else:
+                    sent = await aon_message(self.user_name, json["content"])
+                if sent is not None:
+                    self.outbound.put(sent)
+            if msg_type == "sync":
+                self.outbound.put(await aon_sync(self.user_name, json["content"]))
+            if msg_type == "delivered":
+                if self.window is not None:
+                    self.window.ack(await database_sync_to_async(on_delivered)(self.user_id, json["content"]))
+                else:
+                    parse_cursors(json["content"])
+            if msg_type == "rpc":
+                if self.user is None:
+                    # resumed without a lookup, the first rpc makes it
+                    self.user = await User.objects.aget(user_id=self.user_id)
+                self.outbound.put(await rpc.acall(self.user, json["content"]))
+        except AssertionError as e:
+            await self.log_error(str(e))
+        except Overloaded as e:
+            self.outbound.put(join_frame([busy_text(e.retry_after, json["content"])]))
+
+    async def retransmit_loop(self):
+        while True:
+            await asyncio.sleep(retransmit.RETRANSMIT_TIMEOUT / 2)
+            for text in self.window.due():
+                self.outbound.put(text)
+
+    # ! Channel layer handlers
+
+    async def chat_push(self, event):
+        self.outbound.put(await self.encode_json(event["content"]))
+
+    async def chat_frame(self, event):
+        if event.get("catchup", False):
+            self.catching_up = False
+        ids = []
+        text = missing(self.user_id, self.channel_name, event["text"], event.get("ids"), event.get("catchup", False), ids)
+        if text is not None and self.outbound.put(text, event.get("lane", "chat")) and self.window is not None:
+            # the frame as sent to this socket, only its events not delivered are ever sent again
+            self.window.track(text, ids)
+
+    async def chat_catchup_failed(self, event):
+        if self.catching_up:
+            # 1011: the client reconnects and gets another catch-up
+            self.outbound.shutdown(1011)
+
+    async def chat_logout(self, event):
+        if event["jwt_token"] == self.jwt_token:
+            if self.session is not None:
+                # logged out: nothing to resume
+                resume.sessions.pop(self.session.token, None)
+                self.session = None
+            await self.close()
+
+
+class SyncChatConsumer(JsonWebsocketConsumer):
+    """
+    Synchronous chat consumer, each frame is handled on a thread of the sync_to_async pool.
+    Speaks the same protocol as ChatConsumer; kept as the baseline for benchmark/bench_consumer.py.
+    """
 
     def log_error(self, msg):
         self.send_json([{"type": "error", "content": msg}])
@@ -18,22 +213,32 @@ class ChatConsumer(JsonWebsocketConsumer):
             user_name = self.scope['path'].split('/')[-1]
             assert len(user_name) > 0, "Invalid [user_name]"
 
-            jwt_token = self.scope['query_string'].decode('utf-8')
+            jwt_token, params = parse_query(self.scope)
             assert auth_jwt_token(jwt_token) == user_name, "Invalid [jwt_token]"
 
             user = User.objects.filter(user_name=user_name).first()
             assert user is not None, "no such user"
-            login_user(user_name, jwt_token, self)
+            async_to_sync(self.channel_layer.group_add)(user_group(user_name), self.channel_name)
+            login_user(user_name, jwt_token, self.channel_name)
             self.user_name = user_name
+            self.user = user
+            self.user_id = user.user_id
             self.jwt_token = jwt_token
             self.accept()
-            login_fetch(user)
+            if "sync" not in params:
+                login_fetch(user)
         except AssertionError:
             self.user_name = None
+            self.user_id = None
             self.jwt_token = None
             self.close()
+        except Overloaded:
+            self.close(code=1013)
 
     def disconnect(self, close_code):
+        if self.user_name is not None:
+            async_to_sync(self.channel_layer.group_discard)(user_group(self.user_name), self.channel_name)
+            flush_cursors(self.user_id)
         clear_reg(self.user_name, self.jwt_token)
         print(f"websocket disconnected with close code {close_code}", file=sys.stderr)
         raise StopConsumer
@@ -41,9 +246,39 @@ class ChatConsumer(JsonWebsocketConsumer):
     def receive_json(self, json):
         try:
             assert set(json.keys()) == {"type", "content"}, "Invalid json format"
-            assert json["type"] in {"message"}, "Invalid message [type]"
+            assert json["type"] in {"message", "sync", "delivered", "rpc"}, "Invalid message [type]"
             msg_type = json["type"]
             if msg_type == "message":
-                return on_message(self.user_name, json["content"])
+                if isinstance(json["content"], list):
+                    sent = on_messages(self.user_name, json["content"])
+                else:
+                    sent = on_message(self.user_name, json["content"])
+                if sent is not None:
+                    self.send(text_data=sent)
+            if msg_type == "sync":
+                self.send(text_data=on_sync(self.user_name, json["content"]))
+            if msg_type == "delivered":
+                # no retransmit window on this consumer, nothing to drop
+                parse_cursors(json["content"])
+            if msg_type == "rpc":
+                self.send(text_data=rpc.call(self.user, json["content"]))
         except AssertionError as e:
             self.log_error(str(e))
+        except Overloaded as e:
+            self.send(text_data=join_frame([busy_text(e.retry_after, json["content"])]))
+
+    # ! Channel layer handlers
+
+    def chat_push(self, event):
+        self.send_json(event["content"])
+
+    def chat_frame(self, event):
+        self.send(text_data=event["text"])
+
+    def chat_catchup_failed(self, event):
+        # the catch-up of this consumer runs inside connect, none is ever waited for
+        pass
+
+    def chat_logout(self, event):
+        if event["jwt_token"] == self.jwt_token:
+            self.close()
@@ -0,0 +1,194 @@
+"""
+Websocket pushes taken out of the request that caused them (optional, DISPATCH_ENABLED).
+
+Without it, a view writes its rows and then pushes to every online member before returning, so
+the HTTP latency of e.g. msg/recall grows with the size of the group. With it, the view hands the
+push to dispatch() and returns: the push is queued by transaction.on_commit, only once the rows it
+announces are committed (at once in autocommit), and a background thread delivers the queue.
+
+The thread takes up to DISPATCH_BATCH pushes per wakeup, runs them in order and flushes the
+delivery cursors once for the whole batch. A push that raises is retried up to DISPATCH_RETRIES
+times, DISPATCH_RETRY_DELAY seconds apart, then dropped and counted. A retried push may reach
+members it had already reached before it failed; clients drop duplicates by msg_id, and members
+missed for good catch up at their next login from ack_msg_id.
+
+Pushes are queued in lanes, "chat" for messages and "sysmsg" for system messages: a batch takes
+pushes from each lane in turn, up to DISPATCH_WEIGHTS of them per turn, so that a large fan-out of
+system messages (an avatar change, a group update) is spread between the chat pushes queued after it
+rather than delivered before them. dispatch_depth() tells the backlog of each lane.
+
+The channel layer sends of a push (async_to_sync in utils.utils_websocket, websocket.fanout) run on
+the event loop of the server, captured when the push is queued, as they do from a request: the
+in-memory layer wakes its receivers on that loop only, and the broker layer keeps one connection per
+loop. Without a server loop (a management command), each of them runs on a loop of its own.
+
+The queue lives in memory: pushes not yet delivered when the process exits are lost in the same way.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from django.db import transaction, close_old_connections
+from asgiref.sync import SyncToAsync
+
+from utils.utils_cursor import flush_cursors_if_due
+
+DISPATCH_ENABLED = False
+DISPATCH_BATCH = 64
+DISPATCH_RETRIES = 3
+DISPATCH_RETRY_DELAY = 0.1  # seconds
+DISPATCH_WEIGHTS = {"chat": 4, "sysmsg": 1}
+
+logger = logging.getLogger(__name__)
+
+# lane -> (not_before, attempts, lane, fn, args) of pushes committed and waiting for the dispatcher
+dispatch_lanes = {lane: deque() for lane in DISPATCH_WEIGHTS}
+dispatch_cond = threading.Condition()
+dispatch_stats = {"queued": 0, "delivered": 0, "batches": 0, "retries": 0, "dropped": 0}
+dispatcher = None
+dispatcher_lock = threading.Lock()
+dispatcher_stop = threading.Event()
+# event loop of the server, the pushes send on it
+dispatch_loop = None
+
+
+def dispatch(fn, *args):
+    """
+    Call fn(*args) once the current transaction commits, from the dispatcher thread.
+    Called right away, in the caller's thread, when DISPATCH_ENABLED is off.
+    """
+    dispatch_to("chat", fn, *args)
+
+
+# dispatch in lane
+def dispatch_to(lane, fn, *args):
+    if not DISPATCH_ENABLED:
+        fn(*args)
+        return
+    transaction.on_commit(lambda: enqueue(lane, fn, args))
+
+
+# the loop of the server, seen from a request: its own, or that of the thread running a sync view
+def server_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return getattr(SyncToAsync.threadlocal, "main_event_loop", None)
+
+
+# have async_to_sync in this thread run on loop, as it does in the threads running sync views
+def use_loop(loop):
+    if loop is not None and not loop.is_closed():
+        SyncToAsync.threadlocal.main_event_loop = loop
+        SyncToAsync.threadlocal.main_event_loop_pid = os.getpid()
+    else:
+        SyncToAsync.threadlocal.main_event_loop = None
+
+
+def enqueue(lane, fn, args, attempts=0, not_before=0.0):
+    global dispatch_loop
+    loop = server_loop()
+    if loop is not None:
+        dispatch_loop = loop
+    with dispatch_cond:
+        dispatch_lanes[lane].append((not_before, attempts, lane, fn, args))
+        dispatch_stats["queued"] += 1
+        dispatch_cond.notify()
+    start_dispatcher()
+
+
+def dispatch_depth() -> dict:
+    return {lane: len(pushes) for lane, pushes in dispatch_lanes.items()}
+
+
+def start_dispatcher():
+    global dispatcher
+    with dispatcher_lock:
+        if dispatcher is None or not dispatcher.is_alive():
+            dispatcher_stop.clear()
+            dispatcher = threading.Thread(target=run_dispatcher, name="push-dispatcher", daemon=True)
+            dispatcher.start()
+
+
+def stop_dispatcher():
+    """Stop the dispatcher thread once its batch is done, pushes still queued stay there (see drain)."""
+    with dispatcher_lock:
+        with dispatch_cond:
+            dispatcher_stop.set()
+            dispatch_cond.notify_all()
+        if dispatcher is not None:
+            dispatcher.join()
+
+
+def take_batch(block=True) -> list:
+    """Up to DISPATCH_BATCH pushes, DISPATCH_WEIGHTS of each lane in turn."""
+    batch = []
+    with dispatch_cond:
+        while block and not any(dispatch_lanes.values()) and not dispatcher_stop.is_set():
+            dispatch_cond.wait()
+        while len(batch) < DISPATCH_BATCH and any(dispatch_lanes.values()):
+            for lane, weight in DISPATCH_WEIGHTS.items():
+                pushes = dispatch_lanes[lane]
+                for _ in range(min(weight, len(pushes), DISPATCH_BATCH - len(batch))):
+                    batch.append(pushes.popleft())
+    return batch
+
+
+def run_batch(batch: list) -> int:
+    """
+    Deliver the pushes of batch, requeue those that failed.
+
+    :returns: number of pushes delivered
+    """
+    delivered = 0
+    now = time.time()
+    for not_before, attempts, lane, fn, args in batch:
+        if not_before > now:
+            time.sleep(not_before - now)
+            now = time.time()
+        try:
+            fn(*args)
+            delivered += 1
+        except Exception:
+            if attempts < DISPATCH_RETRIES:
+                dispatch_stats["retries"] += 1
+                enqueue(lane, fn, args, attempts + 1, time.time() + DISPATCH_RETRY_DELAY)
+            else:
+                dispatch_stats["dropped"] += 1
+                logger.exception("dropping push %s after %d attempts", getattr(fn, "__name__", fn), attempts + 1)
+    flush_cursors_if_due()
+    dispatch_stats["batches"] += 1
+    dispatch_stats["delivered"] += delivered
+    return delivered
+
+
+def run_dispatcher():
+    while True:
+        batch = take_batch()
+        if dispatcher_stop.is_set():
+            # put back what was taken, for the next dispatcher or drain()
+            with dispatch_cond:
+                for push in reversed(batch):
+                    dispatch_lanes[push[2]].appendleft(push)
+            return
+        use_loop(dispatch_loop)
+        try:
+            run_batch(batch)
+        finally:
+            close_old_connections()
+
+
+def drain() -> int:
+    """
+    Deliver everything queued so far in the calling thread, retries included (tests, shutdown).
+
+    :returns: number of pushes delivered
+    """
+    delivered = 0
+    batch = take_batch(block=False)
+    while batch:
+        delivered += run_batch(batch)
+        batch = take_batch(block=False)
+    return delivered
@@ -0,0 +1,61 @@
+"""
+Fan-out of encoded frames to the members of a group.
+
+The sender's own echo goes out first. The other recipients are cut into shards of
+FANOUT_SHARD_SIZE users, each shard delivered by its own asyncio task, at most FANOUT_WORKERS
+of them at a time. Every shard yields to the event loop before it starts, so that the
+connections of a shard already delivered write their frames while the next shards are being
+sent, instead of the whole group waiting for the last member to be queued.
+
+Sync callers (HTTP views, the sync consumer) hand the whole fan-out to the event loop at once,
+rather than switching to it for every member.
+"""
+import asyncio
+from asgiref.sync import async_to_sync
+
+from utils.utils_websocket import asend_frame
+
+FANOUT_SHARD_SIZE = 128
+FANOUT_WORKERS = 8
+
+fanout_stats = {"fanouts": 0, "shards": 0, "frames": 0}
+
+
+def shards(frames: list, size: int) -> list:
+    return [frames[i:i + size] for i in range(0, len(frames), size)]
+
+
+async def send_one(user_name, frame, ids=None):
+    await asend_frame(user_name, frame, ids=ids)
+
+
+async def adeliver(frames: list, first=None, shard_size=None, workers=None):
+    """
+    Send every frame of frames, a list of (user_name, encoded frame) or (user_name, encoded frame, ids).
+
+    :param first: (user_name, encoded frame[, ids]) sent before any other, e.g. the echo to the sender
+    """
+    shard_size = shard_size or FANOUT_SHARD_SIZE
+    workers = asyncio.Semaphore(workers or FANOUT_WORKERS)
+    fanout_stats["fanouts"] += 1
+    if first is not None:
+        await send_one(*first)
+        fanout_stats["frames"] += 1
+
+    async def worker(shard):
+        async with workers:
+            await asyncio.sleep(0)
+            for item in shard:
+                await send_one(*item)
+            fanout_stats["shards"] += 1
+            fanout_stats["frames"] += len(shard)
+
+    if len(frames) <= shard_size:
+        await worker(frames)
+    else:
+        await asyncio.gather(*[worker(shard) for shard in shards(frames, shard_size)])
+
+
+def deliver(frames: list, first=None, shard_size=None, workers=None):
+    if frames or first is not None:
+        async_to_sync(adeliver)(frames, first, shard_size, workers)
@@ -0,0 +1,275 @@
+import time
+import uuid
+import asyncio
+from collections import deque, defaultdict
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .broker import pack, FrameBuffer, open_connection
+
+
+class BrokerConnection:
+    """
+    One stream to the broker per event loop.
+    Frames written during one loop iteration go out in a single write; group sends
+    issued in the same iteration travel as one "gsend" batch.
+    """
+
+    def __init__(self, layer: "BrokerChannelLayer", loop: asyncio.AbstractEventLoop):
+        self.layer = layer
+        self.loop = loop
+        self.reader = None
+        self.writer = None
+        self.read_task = None
+        self.last_id = 0
+        self.pending = {}                   # req_id -> future
+        self.recv_channels = {}             # req_id -> channel, for recv requests
+        self.buffers = defaultdict(deque)   # channel -> (expire_time, message) already received from the broker
+        self.out = []
+        self.gsend = []
+        self.flush_scheduled = False
+
+    async def open(self):
+        self.reader, self.writer = await open_connection(self.layer.address)
+        self.read_task = self.loop.create_task(self.read_loop())
+        await self.request("hello", self.layer.client_prefix)
+        if self.layer.presence_prefix is not None:
+            _, sizes = await self.request("watch", self.layer.presence_prefix)
+            self.layer.sizes = {}
+            self.layer.update_sizes(sizes)
+            self.layer.presence_ready = True
+
+    @property
+    def closed(self):
+        return self.writer is None or self.writer.is_closing() or self.read_task.done()
+
+    # ! Writing
+
+    def _schedule_flush(self):
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self._flush)
+
+    def _flush(self):
+        self.flush_scheduled = False
+        self._pack_gsend()
+        if self.out and not self.writer.is_closing():
+            self.writer.write(b"".join(self.out))
+        self.out.clear()
+
+    def _pack_gsend(self):
+        if self.gsend:
+            self.out.append(pack([0, "gsend", self.gsend]))
+            self.gsend = []
+
+    def write(self, frame):
+        # keep the order of group sends and other requests
+        self._pack_gsend()
+        self.out.append(pack(frame))
+        self._schedule_flush()
+
+    def group_send(self, group, message):
+        self.gsend.append([group, message])
+        if len(self.gsend) >= self.layer.batch_size:
+            self._pack_gsend()
+        self._schedule_flush()
+
+    async def request(self, op, *args, channel=None):
+        """Send a request and wait for its (error, value) reply."""
+        self.last_id += 1
+        req_id = self.last_id
+        future = self.loop.create_future()
+        self.pending[req_id] = future
+        if channel is not None:
+            self.recv_channels[req_id] = channel
+        self.write([req_id, op, *args])
+        return await future
+
+    # ! Reading
+
+    async def read_loop(self):
+        buffer = FrameBuffer()
+        try:
+            while True:
+                data = await self.reader.read(1 << 16)
+                if not data:
+                    break
+                buffer.feed(data)
+                for req_id, error, value in buffer.frames():
+                    self.dispatch(req_id, error, value)
+        except ConnectionError:
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost connection to broker"))
+            self.pending.clear()
+            self.writer.close()
+
+    def dispatch(self, req_id, error, value):
+        if req_id == 0:
+            self.layer.update_sizes(value)
+            return
+        future = self.pending.pop(req_id, None)
+        channel = self.recv_channels.pop(req_id, None)
+        if future is not None and not future.done():
+            future.set_result((error, value))
+        elif channel is not None and value:
+            # the receive was cancelled meanwhile, keep its messages for the next one
+            expire = time.time() + self.layer.expiry
+            self.buffers[channel].extend((expire, message) for message in value)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.read_task is not None:
+            self.read_task.cancel()
+
+
+class BrokerChannelLayer(BaseChannelLayer):
+    """
+    Channel layer backed by websocket.broker, shared by every worker connected to the same broker.
+
+    CHANNEL_LAYERS = {"default": {
+        "BACKEND": "websocket.layers.BrokerChannelLayer",
+        "CONFIG": {"address": "unix:/tmp/im-broker.sock"},
+    }}
+
+    Capacity and expiry of channels are enforced by the broker (see its command line).
+    If presence_prefix is set, sizes of groups starting with it are mirrored locally,
+    so group_size() can be answered without a round trip.
+    The broker forgets the groups of a process whose connections are all gone, e.g. when it restarts:
+    the group_add calls of this process are kept, and made again on every new connection.
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(self, address="unix:/tmp/im-broker.sock", expiry=60, capacity=100, channel_capacity=None,
+                 batch_size=100, presence_prefix=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.address = address
+        self.batch_size = batch_size
+        self.presence_prefix = presence_prefix
+        self.client_prefix = uuid.uuid4().hex
+        self.connections = {}
+        self.opening = {}   # loop -> task opening its connection, awaited by every caller meanwhile
+        self.memberships = set()    # (group, channel) added and not discarded by this process
+        self.sizes = {}
+        self.presence_ready = False
+
+    async def connection(self) -> BrokerConnection:
+        loop = asyncio.get_running_loop()
+        conn = self.connections.get(loop)
+        if conn is not None and not conn.closed:
+            return conn
+        task = self.opening.get(loop)
+        if task is None:
+            task = loop.create_task(self._open(loop))
+            self.opening[loop] = task
+            task.add_done_callback(lambda _: self.opening.pop(loop, None))
+        # a caller cancelled does not cancel the opening the others wait for
+        return await asyncio.shield(task)
+
+    async def _open(self, loop) -> BrokerConnection:
+        for other in [other for other in self.connections if other.is_closed()]:
+            self.connections.pop(other).close()
+        old = self.connections.pop(loop, None)
+        if old is not None:
+            # replaced once it is done with: its read loop has failed its pending requests
+            old.close()
+            if old.read_task is not None:
+                await asyncio.gather(old.read_task, return_exceptions=True)
+        conn = BrokerConnection(self, loop)
+        try:
+            await conn.open()
+            if self.memberships:
+                await asyncio.gather(*[conn.request("add", group, channel) for group, channel in list(self.memberships)])
+        except BaseException:
+            conn.close()
+            raise
+        self.connections[loop] = conn
+        return conn
+
+    # ! Channel layer spec
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        conn = await self.connection()
+        error, _ = await conn.request("send", channel, message)
+        if error == "full":
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        conn = await self.connection()
+        buffer = conn.buffers.get(channel)
+        now = time.time()
+        while buffer:
+            expire, message = buffer.popleft()
+            if expire >= now:
+                return message
+        conn.buffers.pop(channel, None)
+        while True:
+            _, messages = await conn.request("recv", channel, channel=channel)
+            if messages:
+                break
+        if len(messages) > 1:
+            expire = now + self.expiry
+            conn.buffers[channel].extend((expire, message) for message in messages[1:])
+        return messages[0]
+
+    async def new_channel(self, prefix="specific"):
+        return f"{prefix}.{self.client_prefix}!{uuid.uuid4().hex}"
+
+    async def flush(self):
+        conn = await self.connection()
+        await conn.request("flush")
+        conn.buffers.clear()
+        self.memberships.clear()
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        for task in list(self.opening.values()):
+            task.cancel()
+        for conn in self.connections.values():
+            conn.close()
+            if conn.loop is loop and conn.read_task is not None:
+                await asyncio.gather(conn.read_task, return_exceptions=True)
+        self.connections.clear()
+
+    # ! Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self.memberships.add((group, channel))
+        conn = await self.connection()
+        await conn.request("add", group, channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self.memberships.discard((group, channel))
+        conn = await self.connection()
+        await conn.request("discard", group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Group name not valid"
+        conn = await self.connection()
+        conn.group_send(group, message)
+
+    def update_sizes(self, sizes: dict):
+        for group, size in sizes.items():
+            if size:
+                self.sizes[group] = size
+            else:
+                self.sizes.pop(group, None)
+
+    def group_size(self, group):
+        """Number of channels in group as last reported by the broker, None before the first report."""
+        if not self.presence_ready or self.presence_prefix is None or not group.startswith(self.presence_prefix):
+            return None
+        return self.sizes.get(group, 0)
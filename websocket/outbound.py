@@ -0,0 +1,187 @@
+"""
+Per-connection outbound queue.
+
+Channel layer handlers only append encoded frames to the queue of their connection, a writer task
+sends them. A client that does not keep up can therefore no longer hold up the delivery of channel
+layer events (whose channel would fill up and drop them silently): its backlog grows in the queue
+instead, up to OUTBOUND_MAX_FRAMES frames or OUTBOUND_MAX_BYTES bytes, and then OUTBOUND_POLICY applies
+(a single frame larger than OUTBOUND_MAX_BYTES, such as a large login catch-up, is still let into an
+empty queue: the byte limit is on the backlog):
+
+- "close": the backlog is dropped and the socket is closed (code 1013, try again later) after a
+  [{"type": "reconnect", "content": {"after": seconds}}] frame
+- "resync": the backlog is replaced by a single
+  [{"type": "resync", "content": {"dropped": n, "reconnect_after": seconds}}] frame, and the socket is
+  closed once it is written
+
+Either way the client reconnects, and the login catch-up resends everything not acked. The delay
+hinted is drawn from RECONNECT_JITTER for each socket, so that the clients of a worker closing many
+sockets at once do not all come back at the same time.
+
+With a coalescing window (OUTBOUND_COALESCE_WINDOW seconds, off by default), the writer waits that long
+after the first frame of a burst and merges the frames queued meanwhile into one array frame of at most
+OUTBOUND_MAX_FRAME_BYTES, every frame of the protocol being an array of events.
+
+Frames are queued in lanes: "chat" for messages, "sysmsg" for system messages. When both have a
+backlog, the writer alternates between them by OUTBOUND_WEIGHTS (smooth weighted round robin), so a
+burst of system messages delays a chat message by at most a frame. Frames waiting in a lane of
+OUTBOUND_COALESCED_LANES are always merged into the one being sent, window or not: low priority
+traffic that piles up goes out in fewer, larger frames.
+"""
+import json
+import random
+import asyncio
+import weakref
+from collections import deque
+
+OUTBOUND_MAX_FRAMES = 256
+OUTBOUND_MAX_BYTES = 1 << 20
+OUTBOUND_POLICY = "resync"
+OVERFLOW_CLOSE_CODE = 1013
+OUTBOUND_COALESCE_WINDOW = 0
+OUTBOUND_MAX_FRAME_BYTES = 64 << 10
+OUTBOUND_WEIGHTS = {"chat": 4, "sysmsg": 1}
+OUTBOUND_COALESCED_LANES = {"sysmsg"}
+RECONNECT_JITTER = (1, 10)  # seconds
+
+outbound_stats = {"queued": 0, "sent": 0, "merged": 0, "dropped": 0, "overflows": 0, "max_depth": 0}
+queues = weakref.WeakSet()
+
+
+def reconnect_after() -> float:
+    return round(random.uniform(*RECONNECT_JITTER), 3)
+
+
+def resync_frame(dropped: int) -> str:
+    return json.dumps([{"type": "resync", "content": {"dropped": dropped, "reconnect_after": reconnect_after()}}])
+
+
+def reconnect_frame() -> str:
+    return json.dumps([{"type": "reconnect", "content": {"after": reconnect_after()}}])
+
+
+class OutboundQueue:
+    def __init__(self, send, close, max_frames=None, max_bytes=None, policy=None, window=None, max_frame_bytes=None):
+        """
+        :param send: coroutine function sending one text frame
+        :param close: coroutine function closing the socket, given a close code
+        :param window: coalescing window in seconds, 0 to send every frame as it is
+        """
+        self.send = send
+        self.close = close
+        self.max_frames = max_frames or OUTBOUND_MAX_FRAMES
+        self.max_bytes = max_bytes or OUTBOUND_MAX_BYTES
+        self.policy = policy or OUTBOUND_POLICY
+        self.window = OUTBOUND_COALESCE_WINDOW if window is None else window
+        self.max_frame_bytes = max_frame_bytes or OUTBOUND_MAX_FRAME_BYTES
+        self.lanes = {lane: deque() for lane in OUTBOUND_WEIGHTS}
+        self.current = {lane: 0 for lane in OUTBOUND_WEIGHTS}
+        self.bytes = 0
+        self.closing = None     # close code once the queue stopped accepting frames
+        self.ready = asyncio.Event()
+        queues.add(self)
+
+    def __len__(self):
+        return sum(len(frames) for frames in self.lanes.values())
+
+    def put(self, text: str, lane="chat") -> bool:
+        """Queue a frame in lane, applying the overflow policy. Returns False if the frame was dropped."""
+        if self.closing is not None:
+            outbound_stats["dropped"] += 1
+            return False
+        depth = len(self) + 1
+        if depth > self.max_frames or (depth > 1 and self.bytes + len(text) > self.max_bytes):
+            self.overflow()
+            return False
+        self.lanes[lane].append(text)
+        self.bytes += len(text)
+        outbound_stats["queued"] += 1
+        outbound_stats["max_depth"] = max(outbound_stats["max_depth"], depth)
+        self.ready.set()
+        return True
+
+    def overflow(self):
+        dropped = len(self) + 1
+        outbound_stats["overflows"] += 1
+        outbound_stats["dropped"] += dropped
+        for frames in self.lanes.values():
+            frames.clear()
+        self.bytes = 0
+        if self.policy == "resync":
+            self.lanes["chat"].append(resync_frame(dropped))
+            self.closing = 1000
+        else:
+            self.lanes["chat"].append(reconnect_frame())
+            self.closing = OVERFLOW_CLOSE_CODE
+        self.ready.set()
+
+    def shutdown(self, code):
+        """Stop accepting frames, close with code once the backlog and a reconnect hint are written."""
+        if self.closing is None:
+            self.lanes["chat"].append(reconnect_frame())
+            self.closing = code
+            self.ready.set()
+
+    async def run(self):
+        """Writer task, runs until the queue is closed or the task cancelled."""
+        idle = True
+        while True:
+            while not len(self):
+                if self.closing is not None:
+                    await self.close(self.closing)
+                    return
+                self.ready.clear()
+                await self.ready.wait()
+                idle = True
+            if idle and self.window:
+                # first frame of a burst: give the following ones the window to join it
+                idle = False
+                await asyncio.sleep(self.window)
+                continue
+            idle = False
+            await self.send(self.take())
+            outbound_stats["sent"] += 1
+
+    def pick(self) -> str:
+        """Lane of the next frame, by smooth weighted round robin over the lanes with a backlog."""
+        ready = [lane for lane, frames in self.lanes.items() if frames]
+        if len(ready) == 1:
+            return ready[0]
+        total = 0
+        for lane in ready:
+            self.current[lane] += OUTBOUND_WEIGHTS[lane]
+            total += OUTBOUND_WEIGHTS[lane]
+        lane = max(ready, key=self.current.get)
+        self.current[lane] -= total
+        return lane
+
+    def take(self) -> str:
+        """Pop the next frame, merged with the following ones of its lane if coalescing."""
+        lane = self.pick()
+        frames = self.lanes[lane]
+        text = frames.popleft()
+        self.bytes -= len(text)
+        if not (self.window or lane in OUTBOUND_COALESCED_LANES) or not frames:
+            return text
+        items = [text[1:-1]] if text != "[]" else []
+        size = len(text)
+        while frames and size + len(frames[0]) <= self.max_frame_bytes:
+            text = frames.popleft()
+            self.bytes -= len(text)
+            size += len(text)
+            outbound_stats["merged"] += 1
+            if text != "[]":
+                items.append(text[1:-1])
+        return "[" + ", ".join(items) + "]"
+
+
+def outbound_depth() -> dict:
+    """Current backlog of every live connection of this process."""
+    depths = [len(queue) for queue in queues]
+    return {
+        "connections": len(depths),
+        "frames": sum(depths),
+        "bytes": sum(queue.bytes for queue in queues),
+        "max_frames": max(depths, default=0),
+        "lanes": {lane: sum(len(queue.lanes[lane]) for queue in queues) for lane in OUTBOUND_WEIGHTS},
+    }
@@ -0,0 +1,134 @@
+"""
+Session resume after a short drop.
+
+A client connecting with ?<jwt_token>&resume is given a resume token by a
+[{"type": "session", "content": {"resume_token": token, "resumed": bool, "window": seconds}}] frame.
+When that connection drops, a channel of its own takes its place in the user's channel layer group for
+RESUME_WINDOW seconds, read by a parking task which buffers every frame pushed meanwhile (along with the
+frames the connection had not written yet), at most RESUME_BUFFER of them. The user stays online for
+the pushes.
+
+Reconnecting with ?<jwt_token>&resume=<token> within the window replays that buffer and nothing else:
+no JWT decoding, no user query and no login catch-up from the database. A channel leaves the group
+only once the one replacing it has joined, so no push falls in between; one sent in the overlap may
+arrive twice, clients drop duplicates by msg_id.
+
+A token is good for one reconnect, by the same user with the same jwt_token, on the worker holding
+the session. Otherwise (unknown, expired, overflowed buffer, logged out meanwhile) the connection
+goes on as a new one, with the login catch-up, and "resumed" tells the client which happened.
+"""
+import json
+import time
+import asyncio
+import secrets
+from collections import deque
+from channels.layers import get_channel_layer
+
+from utils.utils_websocket import user_group
+
+RESUME_WINDOW = 30  # seconds
+RESUME_BUFFER = 256  # frames
+
+resume_stats = {"issued": 0, "parked": 0, "resumed": 0, "missed": 0, "expired": 0, "overflowed": 0}
+# resume token -> Session
+sessions = {}
+
+
+class Session:
+    def __init__(self, token, user_name, user_id, jwt_token):
+        self.token = token
+        self.user_name = user_name
+        self.user_id = user_id
+        self.jwt_token = jwt_token
+        self.channel_name = None  # parking channel
+        self.frames = deque()   # (text, lane) pushed since the drop
+        self.overflowed = False
+        self.parking = None     # task reading the channel of the dropped connection
+
+    def buffer(self, text, lane="chat"):
+        if len(self.frames) >= RESUME_BUFFER:
+            if not self.overflowed:
+                resume_stats["overflowed"] += 1
+            self.overflowed = True
+            return
+        self.frames.append((text, lane))
+
+
+def session_frame(token, resumed: bool) -> str:
+    return json.dumps([{"type": "session", "content": {"resume_token": token, "resumed": resumed, "window": RESUME_WINDOW}}])
+
+
+def issue(user_name, user_id, jwt_token) -> Session:
+    token = secrets.token_urlsafe(24)
+    sessions[token] = Session(token, user_name, user_id, jwt_token)
+    resume_stats["issued"] += 1
+    return sessions[token]
+
+
+async def park(session: Session, channel_name, pending=()):
+    """
+    Put a parking channel in place of channel_name, the channel of the dropped connection of session,
+    in the user's group for RESUME_WINDOW seconds, and buffer what is pushed to it.
+
+    :param pending: (text, lane) queued on the connection and not written when it dropped
+    """
+    layer = get_channel_layer()
+    session.channel_name = await layer.new_channel()
+    await layer.group_add(user_group(session.user_name), session.channel_name)
+    await layer.group_discard(user_group(session.user_name), channel_name)
+    for text, lane in pending:
+        session.buffer(text, lane)
+    session.parking = asyncio.get_running_loop().create_task(hold(session, time.time() + RESUME_WINDOW))
+    resume_stats["parked"] += 1
+
+
+async def hold(session: Session, deadline):
+    layer = get_channel_layer()
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(layer.receive(session.channel_name), max(0, deadline - time.time()))
+            except asyncio.TimeoutError:
+                resume_stats["expired"] += 1
+                break
+            if event["type"] == "chat.frame":
+                session.buffer(event["text"], event.get("lane", "chat"))
+            elif event["type"] == "chat.push":
+                session.buffer(json.dumps(event["content"]))
+            elif event["type"] == "chat.logout" and event["jwt_token"] == session.jwt_token:
+                break
+            elif event["type"] == "resume.stop":
+                return
+            if session.overflowed:
+                # cannot be resumed any more: stop holding the user online
+                break
+    finally:
+        if sessions.get(session.token) is session:
+            sessions.pop(session.token)
+            await layer.group_discard(user_group(session.user_name), session.channel_name)
+
+
+def take(token, user_name, jwt_token):
+    """The parked session of token if the reconnecting user may resume it, else None. Single use."""
+    session = sessions.get(token)
+    if session is None or session.parking is None or session.parking.done() \
+            or session.user_name != user_name or session.jwt_token != jwt_token or session.overflowed:
+        resume_stats["missed"] += 1
+        return None
+    sessions.pop(token)
+    return session
+
+
+async def unpark(session: Session) -> list:
+    """
+    Take the parking channel out of the group, once the new connection joined it, and stop reading it
+    once what was pushed to it before is buffered.
+
+    :returns: (text, lane) buffered since the drop
+    """
+    layer = get_channel_layer()
+    await layer.group_discard(user_group(session.user_name), session.channel_name)
+    await layer.send(session.channel_name, {"type": "resume.stop"})
+    await session.parking
+    resume_stats["resumed"] += 1
+    return list(session.frames)
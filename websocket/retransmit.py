@@ -0,0 +1,98 @@
+"""
+Per-connection window of frames not acknowledged as delivered (optional, ?<jwt_token>&delivered).
+
+A frame written to the socket is not a frame the client got: a mobile connection can drop it and
+still look open. A client connecting with &delivered reports what it has by
+[{"type": "delivered", "content": {group_id: msg_id}}] frames, meaning every message of these groups
+up to msg_id. Until then, the frames carrying messages it was sent (those with ids, see
+utils/utils_device.py) stay in the window of its connection:
+
+- every RETRANSMIT_TIMEOUT seconds, the events of a frame still not delivered are sent again, at most
+  RETRANSMIT_TRIES times, then the frame is given up
+- the window holds at most RETRANSMIT_WINDOW frames, the oldest is given up beyond that
+- a resumed connection (websocket/resume.py) gets the frames of the window first, trimmed to their
+  events not delivered: a reconnect within the resume window only brings what was not delivered,
+  instead of everything not read
+
+Delivered cursors belong to the connection (and its resumed successor) only: another device of the
+same user has not got these messages. A new connection has its login catch-up from ack_msg_id, as
+before, and a frame given up is not lost either, its messages come with that catch-up.
+"""
+import time
+from collections import deque
+
+from utils.utils_device import trim_frame
+
+RETRANSMIT_TIMEOUT = 5  # seconds
+RETRANSMIT_TRIES = 3
+RETRANSMIT_WINDOW = 256  # frames
+
+retransmit_stats = {"tracked": 0, "delivered": 0, "resent": 0, "resent_bytes": 0, "given_up": 0}
+
+
+class UnackedWindow:
+    def __init__(self, timeout=None, tries=None, size=None):
+        self.timeout = timeout or RETRANSMIT_TIMEOUT
+        self.tries = tries or RETRANSMIT_TRIES
+        self.size = size or RETRANSMIT_WINDOW
+        self.frames = deque()   # [sent_at, tries, text, ids], oldest first
+        self.delivered = {}     # group_id -> msg_id the client has everything up to
+
+    def __len__(self):
+        return len(self.frames)
+
+    def track(self, text, ids):
+        """Keep a frame just sent, if it carries messages."""
+        if not ids or all(item is None for item in ids):
+            return
+        if len(self.frames) >= self.size:
+            self.frames.popleft()
+            retransmit_stats["given_up"] += 1
+        self.frames.append([time.time(), 0, text, ids])
+        retransmit_stats["tracked"] += 1
+
+    def is_delivered(self, item) -> bool:
+        return item is None or item[1] <= self.delivered.get(item[0], -1)
+
+    def ack(self, cursors: dict):
+        """Drop the frames delivered in full by cursors, {group_id: msg_id}."""
+        for group_id, msg_id in cursors.items():
+            self.delivered[group_id] = max(msg_id, self.delivered.get(group_id, -1))
+        left = deque(frame for frame in self.frames if not all(self.is_delivered(item) for item in frame[3]))
+        retransmit_stats["delivered"] += len(self.frames) - len(left)
+        self.frames = left
+
+    def undelivered(self, frame) -> str:
+        """The events of frame not delivered yet."""
+        _, _, text, ids = frame
+        keep = [index for index, item in enumerate(ids) if item is not None and not self.is_delivered(item)]
+        if len(keep) == len(ids):
+            return text
+        # the same frame is trimmed again on every try: decoded once, see utils/utils_device.py
+        return trim_frame(text, keep)
+
+    def due(self, now=None) -> list:
+        """Frames to send again now, trimmed to their undelivered events."""
+        now = time.time() if now is None else now
+        texts = []
+        left = deque()
+        for frame in self.frames:
+            if frame[0] + self.timeout > now:
+                left.append(frame)
+            elif frame[1] >= self.tries:
+                retransmit_stats["given_up"] += 1
+            else:
+                frame[0] = now
+                frame[1] += 1
+                texts.append(self.undelivered(frame))
+                left.append(frame)
+        self.frames = left
+        retransmit_stats["resent"] += len(texts)
+        retransmit_stats["resent_bytes"] += sum(len(text) for text in texts)
+        return texts
+
+    def drain(self) -> list:
+        """Every frame not delivered, trimmed, emptying the window."""
+        texts = [self.undelivered(frame) for frame in self.frames]
+        self.frames.clear()
+        return texts
@@ -0,0 +1,92 @@
+"""
+REST operations over the websocket (request/response multiplexing).
+
+A client holding a websocket runs msg/fetch, msg/ack, msg/recall, msg/delete and group/info on it
+instead of opening an HTTP request for each, which would parse its JWT and look its user up again:
+
+    [{"type": "rpc", "content": {"id": 1, "method": "msg/ack", "params": {"groups": {"3": 120, "7": 88}}}}]
+
+The method is the path of the REST view, params its query (GET) or body, and the call runs the same
+code as the view (im/views/msg.py, im/views/group.py) for the user of the connection, in the
+admission lane of the view. The answer goes to the requesting connection only, with the status and
+body of the REST response, in any order with the other frames: the client matches it by id.
+
+    [{"type": "rpc", "content": {"id": 1, "status": 200, "response": {"code": 0, "info": "Succeed"}}}]
+
+A call shed by admission control is answered the same way, with the 503 of the view and its
+Retry-After as "retry_after".
+"""
+from channels.db import database_sync_to_async
+
+from im.views import msg, group
+from utils.utils_frame import rpc_text, join_frame
+from utils.utils_request import BAD_METHOD
+from utils.utils_admission import admit, aadmit, Overloaded, busy_response
+
+RPC_METHODS = {
+    "msg/fetch": msg.fetch_for,
+    "msg/ack": msg.ack_for,
+    "msg/recall": msg.recall_for,
+    "msg/delete": msg.delete_for,
+    "group/info": group.info_for,
+}
+
+rpc_stats = {"calls": 0, "failed": 0}
+
+
+def parse_rpc(content: dict):
+    """
+    Check an rpc request {"id": str or int, "method": str, "params": dict}, params optional.
+
+    :returns: id, the function of the method (None if unknown), params
+    """
+    assert isinstance(content, dict) and set(content.keys()) <= {"id", "method", "params"}, "invalid rpc request"
+    request_id = content.get("id")
+    assert isinstance(request_id, (str, int)), "invalid rpc id"
+    params = content.get("params", {})
+    assert isinstance(params, dict), "invalid rpc params"
+    return request_id, RPC_METHODS.get(content.get("method")), params
+
+
+def answer(request_id, response) -> str:
+    rpc_stats["calls"] += 1
+    if response.status_code != 200:
+        rpc_stats["failed"] += 1
+    retry_after = response.get("Retry-After")
+    return join_frame([rpc_text(request_id, response.status_code, response.content.decode("utf-8"), retry_after)])
+
+
+def call(user, content: dict) -> str:
+    """
+    Run the rpc request content for user.
+
+    :returns: the answer frame
+    """
+    request_id, fn, params = parse_rpc(content)
+    if fn is None:
+        return answer(request_id, BAD_METHOD)
+    lane = getattr(fn, "admission_lane", None)
+    if lane is None:
+        return answer(request_id, fn(user, params))
+    try:
+        with admit(lane):
+            return answer(request_id, fn(user, params))
+    except Overloaded as e:
+        return answer(request_id, busy_response(e))
+
+
+async def acall(user, content: dict) -> str:
+    """
+    Async version of call: the admission slot is awaited on the event loop, the method runs on the database thread.
+    """
+    request_id, fn, params = parse_rpc(content)
+    if fn is None:
+        return answer(request_id, BAD_METHOD)
+    lane = getattr(fn, "admission_lane", None)
+    if lane is None:
+        return answer(request_id, await database_sync_to_async(fn)(user, params))
+    try:
+        async with aadmit(lane):
+            return answer(request_id, await database_sync_to_async(fn)(user, params))
+    except Overloaded as e:
+        return answer(request_id, busy_response(e))
@@ -0,0 +1,194 @@
+import time
+import asyncio
+import threading
+from unittest.mock import patch
+from django.test import TestCase
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import User, Group, Groupmember, Message
+from websocket.consumers import ChatConsumer
+from websocket import catchup
+
+from utils import utils_admission
+from utils.utils_admission import admission_state, admission_stats, admit, aadmit, Overloaded
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_cursor import pending_cursors
+from utils.utils_websocket import online
+
+# Create your tests here.
+class AdmissionTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.workers = catchup.LOGIN_SYNC_WORKERS
+        self.deadline = dict(utils_admission.ADMISSION_DEADLINE)
+        utils_admission.ADMISSION_DEADLINE.update({"chat": 0.05, "bulk": 0.01})
+        for key in admission_stats:
+            admission_stats[key] = 0
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+
+    # destructor
+    def tearDown(self):
+        catchup.LOGIN_SYNC_WORKERS = self.workers
+        utils_admission.ADMISSION_DEADLINE.update(self.deadline)
+        admission_state.update({"active": 0, "chat": 0, "bulk": 0})
+        pending_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def occupy(self, slots):
+        admission_state["active"] = slots
+
+    def fetch(self, user_name):
+        headers = {"HTTP_AUTHORIZATION": generate_jwt_token(user_name)}
+        return self.client.get('/api/msg/fetch', data={"group_id": self.group.group_id}, **headers)
+
+    def get_ws(self, user_name: str):
+        token = generate_jwt_token(user_name)
+        return WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user_name}?{token}")
+
+    # ! Test section
+    def test_bulk_rejected_with_retry_after(self):
+        self.occupy(utils_admission.ADMISSION_LIMIT - utils_admission.ADMISSION_RESERVED)
+        start = time.monotonic()
+        res = self.fetch("bob")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res["Retry-After"], str(utils_admission.ADMISSION_RETRY_AFTER))
+        self.assertEqual(admission_stats["rejected"], 1)
+        # the slot is back once the load is gone, and views without a lane never wait
+        self.occupy(0)
+        self.assertEqual(self.fetch("bob").status_code, 200)
+        self.occupy(utils_admission.ADMISSION_LIMIT)
+        res = self.client.get('/api/group/announcements', data={"group_id": self.group.group_id},
+                              **{"HTTP_AUTHORIZATION": generate_jwt_token("bob")})
+        self.assertEqual(res.status_code, 200)
+
+    def test_chat_uses_reserved_slots(self):
+        self.occupy(utils_admission.ADMISSION_LIMIT - utils_admission.ADMISSION_RESERVED)
+        with admit("chat"):
+            self.assertEqual(admission_state["active"], utils_admission.ADMISSION_LIMIT - utils_admission.ADMISSION_RESERVED + 1)
+        with self.assertRaises(Overloaded):
+            with admit("bulk"):
+                pass
+
+    def test_waiting_chat_goes_first(self):
+        self.occupy(utils_admission.ADMISSION_LIMIT)
+        utils_admission.ADMISSION_DEADLINE["chat"] = 1
+        order = []
+
+        def chat():
+            with admit("chat"):
+                order.append("chat")
+
+        waiter = threading.Thread(target=chat)
+        waiter.start()
+        while admission_state["chat"] == 0:
+            time.sleep(0.001)
+        # a slot frees up: it goes to the waiting chat send, bulk stays out while it waits
+        utils_admission.leave()
+        waiter.join()
+        self.assertListEqual(order, ["chat"])
+        # with every slot free, bulk still waits behind a chat send
+        self.occupy(0)
+        admission_state["chat"] = 1
+        with self.assertRaises(Overloaded):
+            with admit("bulk"):
+                pass
+
+    def test_queue_full_rejected_at_once(self):
+        self.occupy(utils_admission.ADMISSION_LIMIT)
+        admission_state["bulk"] = utils_admission.ADMISSION_QUEUE["bulk"]
+        utils_admission.ADMISSION_DEADLINE["bulk"] = 10
+        start = time.monotonic()
+        self.assertEqual(self.fetch("bob").status_code, 503)
+        self.assertLess(time.monotonic() - start, 1)
+
+    async def test_cancelled_waiter(self):
+        self.occupy(utils_admission.ADMISSION_LIMIT)
+        utils_admission.ADMISSION_DEADLINE["chat"] = 10
+
+        async def chat():
+            async with aadmit("chat"):
+                pass
+
+        waiter = asyncio.get_running_loop().create_task(chat())
+        while admission_state["chat"] == 0:
+            await asyncio.sleep(0.001)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        # it no longer counts as waiting: bulk gets a slot once there is one
+        self.assertEqual(admission_state["chat"], 0)
+        self.occupy(0)
+        async with aadmit("bulk"):
+            self.assertEqual(admission_state["active"], 1)
+
+    async def test_waiter_woken_by_leave(self):
+        self.occupy(utils_admission.ADMISSION_LIMIT)
+        utils_admission.ADMISSION_DEADLINE["chat"] = 10
+        loop = asyncio.get_running_loop()
+
+        async def chat():
+            async with aadmit("chat"):
+                return loop.time()
+
+        with patch.object(utils_admission, "_try_enter", wraps=utils_admission._try_enter) as try_enter:
+            waiter = loop.create_task(chat())
+            while admission_state["chat"] == 0:
+                await asyncio.sleep(0.001)
+            await asyncio.sleep(0.1)
+            # the slot is freed by another thread, the waiter does not poll for it meanwhile
+            threading.Thread(target=utils_admission.leave).start()
+            freed = loop.time()
+            admitted = await asyncio.wait_for(waiter, 5)
+        self.assertLess(admitted - freed, 0.5)
+        self.assertLessEqual(try_enter.call_count, 3)
+        self.assertEqual(utils_admission.admission_waiters, {})
+
+    async def test_chat_send_shed(self):
+        ws = self.get_ws("alice")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        await ws.receive_json_from()
+        self.occupy(utils_admission.ADMISSION_LIMIT)
+        content = {"group_id": self.group.group_id, "msg_type": "text", "msg_body": "hello"}
+        await ws.send_json_to({"type": "message", "content": content})
+        ret = await ws.receive_json_from()
+        self.assertEqual(ret[0]["type"], "busy")
+        self.assertEqual(ret[0]["content"]["retry_after"], utils_admission.ADMISSION_RETRY_AFTER)
+        self.assertDictEqual(ret[0]["content"]["message"], content)
+        self.assertFalse(await Message.objects.filter(group=self.group).aexists())
+        self.occupy(0)
+        await ws.disconnect()
+
+    async def test_login_deferred_when_busy(self):
+        self.occupy(utils_admission.ADMISSION_LIMIT)
+        ws = self.get_ws("alice")
+        connected, _ = await ws.connect()
+        # the handshake does not wait for the catch-up, which is retried once there is room
+        self.assertTrue(connected)
+        self.assertTrue(await ws.receive_nothing(0.05))
+        self.occupy(0)
+        ret = await ws.receive_json_from()
+        self.assertListEqual(ret, [])
+        await ws.disconnect()
+
+    async def test_login_closed_when_busy(self):
+        catchup.LOGIN_SYNC_WORKERS = 0
+        self.occupy(utils_admission.ADMISSION_LIMIT)
+        ws = self.get_ws("alice")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        ret = await ws.receive_json_from()
+        self.assertEqual(ret[0]["type"], "reconnect")
+        ret = await ws.receive_output()
+        self.assertEqual(ret["type"], "websocket.close")
+        self.assertEqual(ret["code"], 1013)
+        self.occupy(0)
+        await ws.disconnect()
+        self.assertFalse(online("alice"))
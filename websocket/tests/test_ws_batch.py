@@ -0,0 +1,131 @@
+import json
+from django.test import TestCase
+from channels.layers import get_channel_layer
+from channels.testing.websocket import WebsocketCommunicator
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember, Message
+from websocket.consumers import ChatConsumer
+from websocket import views
+from websocket.views import on_messages, create_messages
+from websocket.fanout import fanout_stats
+
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import user_group
+from utils.utils_ring import recent_messages, rings
+from utils.utils_dedupe import recent_sends
+from utils.utils_cursor import pending_cursors
+from utils.utils_device import device_cursors
+from websocket.catchup import pending_logins
+
+# Create your tests here.
+class BatchTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.batch_size = views.MAX_BATCH_SIZE
+        self.layer = get_channel_layer()
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.groups = []
+        for name in ["first", "second"]:
+            group = Group.objects.create(group_name=name, group_owner=self.alice)
+            Groupmember.objects.create(group=group, member_user=self.alice, member_role="admin")
+            Groupmember.objects.create(group=group, member_user=self.bob, member_role="member")
+            self.groups.append(group)
+        self.lonely = Group.objects.create(group_name="lonely", group_owner=self.bob)
+        Groupmember.objects.create(group=self.lonely, member_user=self.bob, member_role="admin")
+        self.channel = None
+
+    # destructor
+    def tearDown(self):
+        views.MAX_BATCH_SIZE = self.batch_size
+        if self.channel is not None:
+            async_to_sync(self.layer.group_discard)(user_group("bob"), self.channel)
+        rings.clear()
+        recent_sends.clear()
+        pending_cursors.clear()
+        pending_logins.clear()
+        device_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def content(self, group, body, **kwargs):
+        return {"group_id": group.group_id, "msg_type": "text", "msg_body": body, **kwargs}
+
+    def set_online(self, user_name):
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(user_group(user_name), self.channel)
+
+    def bodies(self):
+        return list(Message.objects.order_by("msg_id").values_list("msg_body", flat=True))
+
+    # ! Test section
+    def test_one_frame(self):
+        self.set_online("bob")
+        fanouts, frames = fanout_stats["fanouts"], fanout_stats["frames"]
+        contents = [self.content(self.groups[0], "a"), self.content(self.groups[1], "b"), self.content(self.groups[0], "c")]
+        self.assertIsNone(on_messages("alice", contents))
+        self.assertListEqual(self.bodies(), ["a", "b", "c"])
+        # one fan-out, one frame for bob holding the three messages, group by group
+        self.assertEqual(fanout_stats["fanouts"], fanouts + 1)
+        self.assertEqual(fanout_stats["frames"], frames + 1)
+        ret = json.loads(async_to_sync(self.layer.receive)(self.channel)["text"])
+        self.assertListEqual([item["content"]["msg_body"] for item in ret], ["a", "c", "b"])
+        # the rings have them, as for single sends
+        for group, count in zip(self.groups, [2, 1]):
+            self.assertEqual(len(recent_messages(group, -1)), count)
+        # bob's cursors moved to the last message of each group
+        msgs = list(Message.objects.order_by("msg_id"))
+        self.assertEqual(pending_cursors[(self.groups[0].group_id, self.bob.user_id)], msgs[2].msg_id)
+        self.assertEqual(pending_cursors[(self.groups[1].group_id, self.bob.user_id)], msgs[1].msg_id)
+
+    def test_all_or_nothing(self):
+        Message.objects.create(sender=self.bob, group=self.lonely, msg_type="text", msg_body="other")
+        reply = Message.objects.create(sender=self.alice, group=self.groups[1], msg_type="text", msg_body="reply")
+        for bad in [self.content(self.lonely, "b"),
+                    self.content(self.groups[0], "b", reply_msg_id=reply.msg_id),
+                    self.content(self.groups[0], "b", reply_msg_id=reply.msg_id + 100),
+                    {"group_id": self.groups[0].group_id},
+                    "b"]:
+            with self.assertRaises(AssertionError):
+                on_messages("alice", [self.content(self.groups[0], "a"), bad])
+            self.assertListEqual(self.bodies(), ["other", "reply"])
+        msgs = create_messages("alice", [self.content(self.groups[1], "a", reply_msg_id=reply.msg_id)])
+        self.assertEqual(msgs[0].reply_msg_id, reply.msg_id)
+
+    def test_size(self):
+        views.MAX_BATCH_SIZE = 2
+        for contents in [[], [self.content(self.groups[0], str(i)) for i in range(3)]]:
+            with self.assertRaises(AssertionError):
+                on_messages("alice", contents)
+        self.assertListEqual(self.bodies(), [])
+
+    def test_client_msg_id(self):
+        contents = [self.content(self.groups[0], "a", client_msg_id="a"),
+                    self.content(self.groups[0], "b"),
+                    self.content(self.groups[0], "c", client_msg_id="c")]
+        sent = json.loads(on_messages("alice", contents))
+        retry = json.loads(on_messages("alice", [contents[0], contents[2]]))
+        self.assertListEqual(sent, retry)
+        self.assertListEqual([item["content"]["client_msg_id"] for item in sent], ["a", "c"])
+        self.assertListEqual(self.bodies(), ["a", "b", "c"])
+        # a failed batch gives its client_msg_id back
+        with self.assertRaises(AssertionError):
+            on_messages("alice", [self.content(self.groups[0], "d", client_msg_id="d"), self.content(self.lonely, "e")])
+        on_messages("alice", [self.content(self.groups[0], "d", client_msg_id="d")])
+        self.assertListEqual(self.bodies(), ["a", "b", "c", "d"])
+
+    async def test_consumer(self):
+        ws = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/alice?{generate_jwt_token('alice')}&sync")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        await ws.send_json_to({"type": "message", "content": [self.content(self.groups[0], str(i)) for i in range(3)]})
+        ret = await ws.receive_json_from()
+        self.assertListEqual([item["content"]["msg_body"] for item in ret], ["0", "1", "2"])
+        self.assertTrue(await ws.receive_nothing())
+        await ws.send_json_to({"type": "message", "content": [self.content(self.lonely, "x")]})
+        ret = await ws.receive_json_from()
+        self.assertEqual(ret[0]["type"], "error")
+        self.assertEqual(await Message.objects.acount(), 3)
+        await ws.disconnect()
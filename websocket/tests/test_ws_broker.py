@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import asyncio
+import tempfile
+import subprocess
+
+import requests
+import websockets
+from django.test import SimpleTestCase
+from django.conf import settings
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+
+from websocket.layers import BrokerChannelLayer
+from utils.utils_websocket import present
+
+FIXTURE = """
+from im.models import User, Group, Groupmember
+alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+group = Group.objects.create(group_name="group", group_owner=alice)
+Groupmember.objects.create(group=group, member_user=alice, member_role="admin")
+Groupmember.objects.create(group=group, member_user=bob, member_role="member")
+print(group.group_id)
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class BrokerLayerTests(SimpleTestCase):
+    # Initializer
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.address = f"unix:{self.tmp.name}/broker.sock"
+        self.start_broker()
+
+    # destructor
+    def tearDown(self):
+        self.broker.kill()
+        self.broker.wait()
+        self.tmp.cleanup()
+
+    # ! Utility functions
+    def start_broker(self):
+        self.broker = subprocess.Popen([sys.executable, "-m", "websocket.broker", self.address, "--capacity", "10"],
+                                       cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL)
+        while not os.path.exists(f"{self.tmp.name}/broker.sock"):
+            time.sleep(0.05)
+
+    # ! Test section
+    def test_presence_awaited(self):
+        worker = BrokerChannelLayer(address=self.address, presence_prefix="user.")
+        channel = async_to_sync(worker.new_channel)()
+        async_to_sync(BrokerChannelLayer(address=self.address).group_add)("user.a", channel)
+        self.assertIsNone(worker.group_size("user.a"))
+
+        async def from_loop():
+            return present(worker, "user.a")
+
+        # on the event loop nothing can be waited for: unknown counts as offline
+        self.assertFalse(async_to_sync(from_loop)())
+        # a sync caller waits for the first report of the broker
+        self.assertTrue(present(worker, "user.a"))
+        self.assertFalse(present(worker, "user.b"))
+        # groups out of the prefix are never reported
+        self.assertTrue(present(worker, "other"))
+
+    @async_to_sync
+    async def test_groups_added_again_after_broker_restart(self):
+        worker_1 = BrokerChannelLayer(address=self.address)
+        channel = await worker_1.new_channel()
+        await worker_1.group_add("user.a", channel)
+        await worker_1.group_add("user.b", channel)
+        await worker_1.group_discard("user.b", channel)
+        conn = await worker_1.connection()
+        self.broker.kill()
+        self.broker.wait()
+        os.unlink(f"{self.tmp.name}/broker.sock")
+        await asyncio.gather(conn.read_task, return_exceptions=True)
+        await asyncio.to_thread(self.start_broker)
+
+        # the new connection has the channel in its groups again
+        await worker_1.connection()
+        worker_2 = BrokerChannelLayer(address=self.address, presence_prefix="user.")
+        await worker_2.connection()
+        self.assertEqual(worker_2.group_size("user.a"), 1)
+        self.assertEqual(worker_2.group_size("user.b"), 0)
+        await worker_2.group_send("user.a", {"type": "test"})
+        self.assertEqual((await asyncio.wait_for(worker_1.receive(channel), 5))["type"], "test")
+        await worker_1.close()
+        await worker_2.close()
+
+    @async_to_sync
+    async def test_capacity_and_presence(self):
+        worker_1 = BrokerChannelLayer(address=self.address, presence_prefix="user.")
+        worker_2 = BrokerChannelLayer(address=self.address, presence_prefix="user.")
+        channel = await worker_1.new_channel()
+        await worker_1.group_add("user.a", channel)
+        await worker_2.connection()
+        self.assertEqual(worker_2.group_size("user.a"), 1)
+        self.assertIsNone(worker_2.group_size("other"))
+
+        for i in range(10):
+            await worker_2.send(channel, {"type": "test", "i": i})
+        with self.assertRaises(ChannelFull):
+            await worker_2.send(channel, {"type": "test", "i": 10})
+        # group sends to a full channel are dropped silently
+        await worker_2.group_send("user.a", {"type": "test", "i": 11})
+        self.assertListEqual([(await worker_1.receive(channel))["i"] for _ in range(10)], list(range(10)))
+
+        await worker_2.group_send("user.a", {"type": "test", "i": 12})
+        self.assertEqual((await worker_1.receive(channel))["i"], 12)
+
+        # a worker going away takes its channels out of every group
+        await worker_1.close()
+        for _ in range(20):
+            if worker_2.group_size("user.a") == 0:
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual(worker_2.group_size("user.a"), 0)
+        await worker_2.close()
+
+    @async_to_sync
+    async def test_connection_opened_once(self):
+        worker = BrokerChannelLayer(address=self.address, presence_prefix="user.")
+        channels = [await worker.new_channel() for _ in range(10)]
+        # the first callers of a loop all wait for the same connection
+        await asyncio.gather(*[worker.group_add("user.a", channel) for channel in channels])
+        self.assertEqual(len(worker.connections), 1)
+        conn = await worker.connection()
+        self.assertEqual(worker.group_size("user.a"), 10)
+        # and a lost one is replaced once
+        conn.writer.close()
+        await asyncio.gather(conn.read_task, return_exceptions=True)
+        conns = await asyncio.gather(*[worker.connection() for _ in range(10)])
+        self.assertEqual(len({id(other) for other in conns}), 1)
+        self.assertIsNot(conns[0], conn)
+        self.assertTrue(conn.read_task.done())
+        await worker.close()
+
+    def test_two_workers(self):
+        env = {**os.environ, "IM_BROKER": self.address, "IM_DATABASE": f"{self.tmp.name}/db.sqlite3"}
+        subprocess.run([sys.executable, "manage.py", "migrate", "--run-syncdb"], cwd=settings.BASE_DIR, env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        out = subprocess.run([sys.executable, "manage.py", "shell", "-c", FIXTURE], cwd=settings.BASE_DIR, env=env,
+                             check=True, capture_output=True)
+        group_id = int(out.stdout.decode().strip())
+
+        ports = [free_port(), free_port()]
+        workers = [subprocess.Popen([sys.executable, "-m", "daphne", "-b", "127.0.0.1", "-p", str(port), "DjangoHW.asgi:application"],
+                                    cwd=settings.BASE_DIR, env=env, stderr=subprocess.DEVNULL) for port in ports]
+        try:
+            for port in ports:
+                for _ in range(100):
+                    try:
+                        socket.create_connection(("127.0.0.1", port)).close()
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+            self.run_two_workers(ports, group_id)
+        finally:
+            for worker in workers:
+                worker.kill()
+                worker.wait()
+
+    def login(self, port, user_name):
+        # the jwt salt depends on the minute each process started at, so ask the worker for its own token
+        res = requests.post(f"http://127.0.0.1:{port}/api/user/login", json={"user_name": user_name, "password": "123456"})
+        return res.json()["jwt_token"]
+
+    def cursors_flushed(self, group_id, msg_id):
+        with sqlite3.connect(f"{self.tmp.name}/db.sqlite3") as db:
+            rows = db.execute("SELECT sent_msg_id FROM im_groupmember WHERE group_id = ?", (group_id,)).fetchall()
+        return all(sent_msg_id >= msg_id for sent_msg_id, in rows)
+
+    @async_to_sync
+    async def run_two_workers(self, ports, group_id):
+        token_a = await asyncio.to_thread(self.login, ports[0], "alice")
+        token_b = await asyncio.to_thread(self.login, ports[1], "bob")
+        token_a_2 = await asyncio.to_thread(self.login, ports[1], "alice")
+        async with websockets.connect(f"ws://127.0.0.1:{ports[0]}/ws/chat/alice?{token_a}") as ws_a, \
+                   websockets.connect(f"ws://127.0.0.1:{ports[1]}/ws/chat/bob?{token_b}") as ws_b:
+            self.assertListEqual(json.loads(await ws_a.recv()), [])
+            self.assertListEqual(json.loads(await ws_b.recv()), [])
+
+            # websocket message on worker 1 reaches bob on worker 2
+            await ws_a.send(json.dumps({
+                "type": "message",
+                "content": {"group_id": group_id, "msg_type": "text", "msg_body": "hello"},
+            }))
+            ret = json.loads(await asyncio.wait_for(ws_b.recv(), 5))
+            self.assertEqual(ret[0]["content"]["msg_body"], "hello")
+            ret = json.loads(await asyncio.wait_for(ws_a.recv(), 5))
+            self.assertEqual(ret[0]["content"]["msg_body"], "hello")
+            hello = ret[0]["content"]["msg_id"]
+
+            # the cursors moved by worker 1 reach database on its flusher's timer, with no further request
+            for _ in range(50):
+                if await asyncio.to_thread(self.cursors_flushed, group_id, hello):
+                    break
+                await asyncio.sleep(0.1)
+            self.assertTrue(await asyncio.to_thread(self.cursors_flushed, group_id, hello))
+
+            # REST call on worker 2 reaches alice on worker 1, without resending "hello"
+            res = await asyncio.to_thread(requests.post, f"http://127.0.0.1:{ports[1]}/api/group/announce",
+                                          json={"group_id": group_id, "announcement": "notice"},
+                                          headers={"Authorization": token_a_2})
+            self.assertEqual(res.json()["code"], 0)
+            ret = json.loads(await asyncio.wait_for(ws_a.recv(), 5))
+            self.assertEqual(ret[0]["content"]["msg_body"], "notice")
+            ret = json.loads(await asyncio.wait_for(ws_b.recv(), 5))
+            self.assertEqual(ret[0]["content"]["msg_body"], "notice")
@@ -0,0 +1,142 @@
+import asyncio
+from unittest.mock import patch
+from django.test import TestCase
+from channels.layers import get_channel_layer
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import User, Group, Groupmember, Message
+from websocket.consumers import ChatConsumer
+
+from websocket import catchup
+from websocket.catchup import request_login_sync, pending_logins, login_sync_stats
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import user_group
+from utils.utils_cursor import pending_cursors
+
+# Create your tests here.
+class CatchupTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.workers = catchup.LOGIN_SYNC_WORKERS
+        for key in login_sync_stats:
+            login_sync_stats[key] = 0
+        self.layer = get_channel_layer()
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+        self.channels = []
+
+    # destructor
+    def tearDown(self):
+        catchup.LOGIN_SYNC_WORKERS = self.workers
+        pending_logins.clear()
+        pending_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def get_ws(self, user_name: str):
+        token = generate_jwt_token(user_name)
+        return WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user_name}?{token}")
+
+    async def set_online(self, user_name):
+        channel = await self.layer.new_channel()
+        await self.layer.group_add(user_group(user_name), channel)
+        self.channels.append((user_name, channel))
+
+    async def set_all_offline(self):
+        for user_name, channel in self.channels:
+            await self.layer.group_discard(user_group(user_name), channel)
+
+    async def wait_served(self, count):
+        while login_sync_stats["served"] + login_sync_stats["skipped"] < count:
+            await asyncio.sleep(0.001)
+
+    # ! Test section
+    async def test_catchup_after_accept(self):
+        msg = await Message.objects.acreate(sender=self.alice, group=self.group, msg_type="text", msg_body="hello")
+        ws = self.get_ws("bob")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        ret = await ws.receive_json_from()
+        self.assertListEqual([item["content"]["msg_id"] for item in ret], [msg.msg_id])
+        self.assertEqual(login_sync_stats["served"], 1)
+        await ws.disconnect()
+
+    async def test_bounded_workers(self):
+        catchup.LOGIN_SYNC_WORKERS = 2
+        running = []
+        peak = []
+
+        async def slow_fetch(user):
+            running.append(user.user_name)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(user.user_name)
+
+        users = [await User.objects.acreate(user_name=f"user{i}", password="123456", user_email=f"user{i}@163.com")
+                 for i in range(6)]
+        for user in users:
+            await self.set_online(user.user_name)
+        with patch("websocket.catchup.alogin_fetch", slow_fetch):
+            for user in users:
+                await request_login_sync(user)
+            await self.wait_served(6)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(login_sync_stats["max_depth"], 6)
+        await self.set_all_offline()
+
+    async def test_one_catchup_per_user(self):
+        catchup.LOGIN_SYNC_WORKERS = 1
+        served = []
+
+        async def fetch(user):
+            served.append(user.user_name)
+
+        for user_name in ["alice", "bob"]:
+            await self.set_online(user_name)
+        with patch("websocket.catchup.alogin_fetch", fetch):
+            # bob opens three connections while alice waits: one catch-up serves them all
+            await request_login_sync(self.alice)
+            for _ in range(3):
+                await request_login_sync(self.bob)
+            await self.wait_served(2)
+        self.assertListEqual(served, ["alice", "bob"])
+        self.assertEqual(login_sync_stats["coalesced"], 2)
+        await self.set_all_offline()
+
+    async def test_offline_user_skipped(self):
+        served = []
+
+        async def fetch(user):
+            served.append(user.user_name)
+
+        with patch("websocket.catchup.alogin_fetch", fetch):
+            await request_login_sync(self.bob)
+            await self.wait_served(1)
+        self.assertListEqual(served, [])
+        self.assertEqual(login_sync_stats["skipped"], 1)
+
+    async def test_failed_catchup_closes(self):
+        async def broken_fetch(user):
+            raise RuntimeError("database is locked")
+
+        synced = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/bob?{generate_jwt_token('bob')}&sync")
+        connected, _ = await synced.connect()
+        self.assertTrue(connected)
+        with patch("websocket.catchup.alogin_fetch", broken_fetch), self.assertLogs("websocket.catchup"):
+            ws = self.get_ws("bob")
+            connected, _ = await ws.connect()
+            self.assertTrue(connected)
+            ret = await ws.receive_json_from()
+            self.assertEqual(ret[0]["type"], "reconnect")
+            ret = await ws.receive_output()
+        self.assertEqual(ret["type"], "websocket.close")
+        self.assertEqual(ret["code"], 1011)
+        self.assertEqual(login_sync_stats["failed"], 1)
+        # a connection not waiting for a catch-up stays open
+        self.assertTrue(await synced.receive_nothing())
+        await ws.disconnect()
+        await synced.disconnect()
@@ -0,0 +1,140 @@
+import json
+import time
+from unittest.mock import patch
+from django.test import TestCase
+from channels.layers import get_channel_layer
+from channels.testing.websocket import WebsocketCommunicator
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+
+from im.models import User, Group, Groupmember, Message
+from websocket.consumers import ChatConsumer
+from websocket.views import push_group_message, online_members
+
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import user_group
+from utils import utils_cursor
+from utils.utils_cursor import pending_cursors, cursor_stats, flush_cursors, start_flusher, stop_flusher
+
+# Create your tests here.
+class CursorTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.interval = utils_cursor.CURSOR_FLUSH_INTERVAL
+        flush_cursors()
+        self.layer = get_channel_layer()
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+        self.channels = {}
+
+    # destructor
+    def tearDown(self):
+        utils_cursor.CURSOR_FLUSH_INTERVAL = self.interval
+        for user_name, channel in self.channels.items():
+            async_to_sync(self.layer.group_discard)(user_group(user_name), channel)
+        pending_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def set_online(self, user_name):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(user_group(user_name), channel)
+        self.channels[user_name] = channel
+
+    def receive(self, user_name):
+        return json.loads(async_to_sync(self.layer.receive)(self.channels[user_name])["text"])
+
+    def push(self, body):
+        msg = Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body=body)
+        push_group_message(online_members(self.group.group_id), msg)
+        return msg
+
+    def stored_cursor(self, user):
+        return Groupmember.objects.get(group=self.group, member_user=user).sent_msg_id
+
+    # ! Test section
+    def test_cursors_written_in_batch(self):
+        self.set_online("alice")
+        self.set_online("bob")
+        for i in range(5):
+            msg = self.push(str(i))
+        self.assertEqual(self.stored_cursor(self.bob), -1)
+        self.assertEqual(pending_cursors[(self.group.group_id, self.bob.user_id)], msg.msg_id)
+
+        writes = cursor_stats["writes"]
+        with self.assertNumQueries(1):
+            self.assertEqual(flush_cursors(), 2)
+        self.assertEqual(cursor_stats["writes"] - writes, 1)
+        self.assertEqual(self.stored_cursor(self.alice), msg.msg_id)
+        self.assertEqual(self.stored_cursor(self.bob), msg.msg_id)
+
+    def test_group_views_show_pending_cursors(self):
+        self.set_online("alice")
+        self.set_online("bob")
+        msg = self.push("hello")
+        pending = dict(pending_cursors)
+        headers = {"HTTP_AUTHORIZATION": generate_jwt_token("alice")}
+        res = self.client.get("/api/group/list", **headers)
+        self.assertEqual(res.json()["code"], 0)
+        self.assertEqual({member["sent_msg_id"] for member in res.json()["groups"][0]["members"]}, {msg.msg_id})
+        res = self.client.get("/api/group/info", {"group_id": self.group.group_id}, **headers)
+        self.assertEqual(res.json()["code"], 0)
+        self.assertEqual({member["sent_msg_id"] for member in res.json()["members"]}, {msg.msg_id})
+        # shown, but left to the flusher
+        self.assertEqual(pending_cursors, pending)
+        self.assertEqual(self.stored_cursor(self.bob), -1)
+
+    def test_flusher(self):
+        utils_cursor.CURSOR_FLUSH_INTERVAL = 0.01
+        with patch("utils.utils_cursor.flush_cursors_if_due") as flush:
+            start_flusher()
+            # no request needed: the interval is checked on a timer
+            for _ in range(100):
+                if flush.call_count >= 2:
+                    break
+                time.sleep(0.01)
+            stop_flusher()
+        self.assertGreaterEqual(flush.call_count, 2)
+        self.assertFalse(utils_cursor.flusher.is_alive())
+
+    def test_pending_cursor_used_by_next_push(self):
+        self.set_online("bob")
+        self.push("first")
+        self.assertEqual(len(self.receive("bob")), 1)
+        msg = self.push("second")
+        ret = self.receive("bob")
+        self.assertListEqual([item["content"]["msg_id"] for item in ret], [msg.msg_id])
+
+    def test_flush_never_moves_back(self):
+        self.set_online("bob")
+        msg = self.push("hello")
+        Groupmember.objects.filter(group=self.group, member_user=self.bob).update(sent_msg_id=msg.msg_id + 10)
+        flush_cursors()
+        self.assertEqual(self.stored_cursor(self.bob), msg.msg_id + 10)
+
+    def test_lost_cursors_resend(self):
+        self.set_online("bob")
+        first = self.push("first")
+        self.receive("bob")
+        # a crash before the flush loses the pending cursor: the client gets the message again, never a gap
+        pending_cursors.clear()
+        msg = self.push("second")
+        ret = self.receive("bob")
+        self.assertListEqual([item["content"]["msg_id"] for item in ret], [first.msg_id, msg.msg_id])
+
+    @async_to_sync
+    async def test_flush_on_disconnect(self):
+        ws = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/bob?{generate_jwt_token('bob')}")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        await ws.receive_json_from()
+        msg = await database_sync_to_async(self.push)("hello")
+        ret = await ws.receive_json_from()
+        self.assertEqual(ret[0]["content"]["msg_id"], msg.msg_id)
+        self.assertEqual(await database_sync_to_async(self.stored_cursor)(self.bob), -1)
+        await ws.disconnect()
+        self.assertEqual(await database_sync_to_async(self.stored_cursor)(self.bob), msg.msg_id)
@@ -0,0 +1,120 @@
+import json
+from django.test import TestCase
+from channels.layers import get_channel_layer
+from channels.testing.websocket import WebsocketCommunicator
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember, Message
+from websocket.consumers import ChatConsumer
+from websocket.views import on_message
+from websocket.fanout import fanout_stats
+
+from utils import utils_dedupe
+from utils.utils_dedupe import claim, settle, release, send_key, recent_sends, dedupe_stats
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import user_group
+from utils.utils_cursor import pending_cursors
+from utils.utils_device import device_cursors
+from websocket.catchup import pending_logins
+
+# Create your tests here.
+class DedupeTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.size = utils_dedupe.DEDUPE_SIZE
+        for key in dedupe_stats:
+            dedupe_stats[key] = 0
+        self.layer = get_channel_layer()
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+        self.channel = None
+
+    # destructor
+    def tearDown(self):
+        utils_dedupe.DEDUPE_SIZE = self.size
+        if self.channel is not None:
+            async_to_sync(self.layer.group_discard)(user_group("bob"), self.channel)
+        recent_sends.clear()
+        pending_cursors.clear()
+        pending_logins.clear()
+        device_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def content(self, client_msg_id, body="hello"):
+        return {"group_id": self.group.group_id, "msg_type": "text", "msg_body": body, "client_msg_id": client_msg_id}
+
+    def set_online(self, user_name):
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(user_group(user_name), self.channel)
+
+    # ! Test section
+    def test_claim(self):
+        key = send_key("alice", {"client_msg_id": "a"})
+        self.assertEqual(claim(key), (True, None))
+        self.assertEqual(claim(key), (False, None))
+        settle(key, 10)
+        self.assertEqual(claim(key), (False, 10))
+        self.assertDictEqual(dedupe_stats, {"sends": 1, "duplicates": 1, "in_flight": 1})
+        # a failed send gives its key back, a stored one keeps it
+        release(key)
+        self.assertEqual(claim(key), (False, 10))
+        other = send_key("alice", {"client_msg_id": 1})
+        claim(other)
+        release(other)
+        self.assertEqual(claim(other), (True, None))
+        self.assertIsNone(send_key("alice", {}))
+        for content in [{"client_msg_id": []}, {"client_msg_id": "x" * 65}]:
+            with self.assertRaises(AssertionError):
+                send_key("alice", content)
+
+    def test_bounded(self):
+        utils_dedupe.DEDUPE_SIZE = 2
+        for client_msg_id in range(3):
+            claim(("alice", client_msg_id))
+        self.assertListEqual(list(recent_sends), [("alice", 1), ("alice", 2)])
+
+    def test_retry_not_stored_again(self):
+        self.set_online("bob")
+        frames = fanout_stats["frames"]
+        sent = json.loads(on_message("alice", self.content("c1")))
+        retry = json.loads(on_message("alice", self.content("c1")))
+        self.assertEqual(sent, retry)
+        self.assertEqual(sent[0]["type"], "sent")
+        msg = Message.objects.get(group=self.group)
+        self.assertDictEqual(sent[0]["content"], {"client_msg_id": "c1", "msg_id": msg.msg_id})
+        # bob got the message once
+        self.assertEqual(fanout_stats["frames"], frames + 1)
+        ret = json.loads(async_to_sync(self.layer.receive)(self.channel)["text"])
+        self.assertListEqual([item["content"]["msg_id"] for item in ret], [msg.msg_id])
+        # another client_msg_id is another message
+        on_message("alice", self.content("c2"))
+        self.assertEqual(Message.objects.filter(group=self.group).count(), 2)
+        # without client_msg_id, nothing changes
+        self.assertIsNone(on_message("alice", self.content(None)))
+        self.assertEqual(Message.objects.filter(group=self.group).count(), 3)
+
+    def test_failed_send_retried(self):
+        content = self.content("c1")
+        content["group_id"] = self.group.group_id + 100
+        with self.assertRaises(AssertionError):
+            on_message("alice", content)
+        on_message("alice", self.content("c1"))
+        self.assertEqual(Message.objects.filter(group=self.group).count(), 1)
+
+    async def test_consumer(self):
+        ws = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/alice?{generate_jwt_token('alice')}&sync")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        events = []
+        for _ in range(2):
+            await ws.send_json_to({"type": "message", "content": self.content("c1")})
+        while not await ws.receive_nothing():
+            events += await ws.receive_json_from()
+        self.assertListEqual(sorted(item["type"] for item in events), ["message", "sent", "sent"])
+        self.assertEqual(await Message.objects.filter(group=self.group).acount(), 1)
+        await ws.disconnect()
@@ -0,0 +1,110 @@
+import json
+from django.test import TestCase
+from channels.db import database_sync_to_async
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import User, Group, Groupmember, Message
+from websocket.consumers import ChatConsumer
+from websocket.views import push_group, fetch_message_windows
+
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_device import open_device, close_device, missing, frame_events, device_cursors, device_stats
+from utils.utils_cursor import pending_cursors
+from websocket.catchup import pending_logins
+
+# Create your tests here.
+class DeviceTests(TestCase):
+    # Initializer
+    def setUp(self):
+        for key in device_stats:
+            device_stats[key] = 0
+        frame_events.cache_clear()
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+
+    # destructor
+    def tearDown(self):
+        device_cursors.clear()
+        pending_cursors.clear()
+        pending_logins.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def get_ws(self, user_name: str):
+        token = generate_jwt_token(user_name)
+        return WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user_name}?{token}")
+
+    def frame(self, *msg_ids):
+        return json.dumps([{"type": "message", "content": {"msg_id": msg_id}} for msg_id in msg_ids])
+
+    async def receive_ids(self, ws):
+        return [item["content"]["msg_id"] for item in await ws.receive_json_from()]
+
+    # ! Test section
+    def test_missing(self):
+        open_device(1, "a")
+        # no catch-up yet: everything goes through, cursors untouched
+        self.assertEqual(missing(1, "a", self.frame(5), [[7, 5]]), self.frame(5))
+        self.assertEqual(missing(1, "a", self.frame(1, 2, 3), [[7, 1], [7, 2], [7, 3]], catchup=True), self.frame(1, 2, 3))
+        self.assertIsNone(missing(1, "a", self.frame(2, 3), [[7, 2], [7, 3]]))
+        kept = []
+        self.assertEqual(missing(1, "a", self.frame(3, 4), [[7, 3], [7, 4]], kept=kept), self.frame(4))
+        # the ids of what is left, for the retransmit window
+        self.assertListEqual(kept, [[7, 4]])
+        # forced events and events without ids always go through
+        self.assertEqual(missing(1, "a", self.frame(3), [[7, 3, True]]), self.frame(3))
+        self.assertEqual(missing(1, "a", self.frame(3), [None]), self.frame(3))
+        # frames of unknown sockets, or without ids, are left alone
+        self.assertEqual(missing(2, "a", self.frame(1), [[7, 1]]), self.frame(1))
+        self.assertEqual(missing(1, "a", self.frame(1), None), self.frame(1))
+        self.assertEqual(device_stats["duplicates"], 3)
+        self.assertEqual(device_stats["skipped"], 1)
+        close_device(1, "a")
+        self.assertEqual(pending_cursors[(7, 1)], 4)
+
+    def test_shared_frame_decoded_once(self):
+        text = self.frame(1, 2, 3)
+        for channel in "abc":
+            open_device(1, channel)
+            missing(1, channel, self.frame(1), [[7, 1]], catchup=True)
+        # frames sent in full are not decoded
+        self.assertEqual(missing(1, "a", self.frame(2), [[7, 2]]), self.frame(2))
+        self.assertEqual(frame_events.cache_info().misses, 0)
+        for channel in "abc":
+            self.assertEqual(missing(1, channel, text, [[7, 1], [7, 2], [7, 3]]), self.frame(2, 3) if channel != "a" else self.frame(3))
+        self.assertEqual(frame_events.cache_info().misses, 1)
+        for channel in "abc":
+            close_device(1, channel)
+
+    def test_window_ids(self):
+        msgs = [Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body=str(i)) for i in range(3)]
+        members = list(Groupmember.objects.filter(group=self.group).select_related("member_user"))
+        for gm, frame, ids in fetch_message_windows(members, msgs[-1]):
+            self.assertEqual(len(json.loads(frame)), len(ids))
+            # the message pushed is never trimmed, it may be a recall
+            self.assertListEqual(ids, [[self.group.group_id, msgs[0].msg_id], [self.group.group_id, msgs[1].msg_id],
+                                       [self.group.group_id, msgs[2].msg_id, True]])
+
+    async def test_second_device(self):
+        msgs = [await Message.objects.acreate(sender=self.alice, group=self.group, msg_type="text", msg_body=str(i))
+                for i in range(3)]
+        first = self.get_ws("bob")
+        await first.connect()
+        self.assertListEqual(await self.receive_ids(first), [msg.msg_id for msg in msgs])
+        # the catch-up of the second device is not sent again to the first one
+        second = self.get_ws("bob")
+        await second.connect()
+        self.assertListEqual(await self.receive_ids(second), [msg.msg_id for msg in msgs])
+        self.assertTrue(await first.receive_nothing())
+        self.assertEqual(device_stats["duplicates"], 3)
+
+        msg = await Message.objects.acreate(sender=self.alice, group=self.group, msg_type="text", msg_body="new")
+        await database_sync_to_async(push_group)(msg)
+        for ws in [first, second]:
+            self.assertListEqual(await self.receive_ids(ws), [msg.msg_id])
+        await first.disconnect()
+        await second.disconnect()
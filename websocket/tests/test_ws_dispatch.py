@@ -0,0 +1,172 @@
+import json
+import asyncio
+from unittest.mock import patch
+from django.test import TestCase
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember, Message
+
+from websocket import dispatch
+from websocket.dispatch import dispatch_stats, dispatch_depth, drain, stop_dispatcher
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import user_group, send_frame
+from utils.utils_cursor import pending_cursors
+
+# Create your tests here.
+class DispatchTests(TestCase):
+    # Initializer
+    def setUp(self):
+        dispatch.DISPATCH_ENABLED = True
+        self.retry_delay = dispatch.DISPATCH_RETRY_DELAY
+        dispatch.DISPATCH_RETRY_DELAY = 0
+        for key in dispatch_stats:
+            dispatch_stats[key] = 0
+        # pushes stay queued until the test drains them in its own thread
+        self.starter = patch("websocket.dispatch.start_dispatcher")
+        self.starter.start()
+        self.layer = get_channel_layer()
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+        self.channels = {}
+
+    # destructor
+    def tearDown(self):
+        dispatch.DISPATCH_ENABLED = False
+        dispatch.DISPATCH_RETRY_DELAY = self.retry_delay
+        drain()
+        self.starter.stop()
+        for user_name, channel in self.channels.items():
+            async_to_sync(self.layer.group_discard)(user_group(user_name), channel)
+        pending_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def set_online(self, user_name):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(user_group(user_name), channel)
+        self.channels[user_name] = channel
+
+    def receive(self, user_name):
+        return json.loads(async_to_sync(self.layer.receive)(self.channels[user_name])["text"])
+
+    def post(self, path, user_name, data):
+        headers = {"HTTP_AUTHORIZATION": generate_jwt_token(user_name)}
+        return self.client.post(path, data=data, content_type='application/json', **headers)
+
+    # ! Test section
+    def test_push_after_commit(self):
+        self.set_online("bob")
+        with self.captureOnCommitCallbacks() as callbacks:
+            res = self.post('/api/group/announce', "alice", {"group_id": self.group.group_id, "announcement": "hi"})
+            self.assertEqual(res.status_code, 200)
+            # nothing is queued before the transaction commits
+            self.assertEqual(sum(dispatch_depth().values()), 0)
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(dispatch_stats["queued"], 1)
+        self.assertEqual(drain(), 1)
+        ret = self.receive("bob")
+        self.assertEqual(ret[0]["content"]["msg_type"], "announcement")
+
+    def test_recall_dispatched(self):
+        self.set_online("bob")
+        msg = Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body="hello")
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.post('/api/msg/recall', "alice", {"msg_id": msg.msg_id})
+        self.assertEqual(res.status_code, 200)
+        drain()
+        ret = self.receive("bob")
+        self.assertEqual(ret[-1]["content"]["msg_type"], "recall")
+
+    def test_sysmsg_read_saved_by_dispatcher(self):
+        self.set_online("bob")
+        read_sysmsg_id = self.bob.read_sysmsg_id
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.post('/api/friend/apply', "alice", {"friend_user_id": self.bob.user_id, "message": "hi"})
+        self.assertEqual(res.status_code, 200)
+        self.bob.refresh_from_db()
+        self.assertEqual(self.bob.read_sysmsg_id, read_sysmsg_id)
+        drain()
+        ret = self.receive("bob")
+        self.bob.refresh_from_db()
+        self.assertEqual(self.bob.read_sysmsg_id, ret[-1]["content"]["sysmsg_id"])
+
+    def test_failed_push_retried(self):
+        calls = []
+
+        def flaky(value):
+            calls.append(value)
+            if len(calls) < 3:
+                raise RuntimeError("layer down")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch.dispatch(flaky, 1)
+        self.assertEqual(drain(), 1)
+        self.assertListEqual(calls, [1, 1, 1])
+        self.assertEqual(dispatch_stats["retries"], 2)
+        self.assertEqual(dispatch_stats["dropped"], 0)
+
+    def test_failed_push_dropped(self):
+        def broken():
+            raise RuntimeError("layer down")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch.dispatch(broken)
+        with self.assertLogs("websocket.dispatch", level="ERROR"):
+            self.assertEqual(drain(), 0)
+        self.assertEqual(dispatch_stats["retries"], dispatch.DISPATCH_RETRIES)
+        self.assertEqual(dispatch_stats["dropped"], 1)
+
+    def test_batches(self):
+        delivered = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(dispatch.DISPATCH_BATCH + 1):
+                dispatch.dispatch(delivered.append, i)
+        self.assertEqual(drain(), dispatch.DISPATCH_BATCH + 1)
+        self.assertListEqual(delivered, list(range(dispatch.DISPATCH_BATCH + 1)))
+        self.assertEqual(dispatch_stats["batches"], 2)
+
+    def test_disabled_pushes_at_once(self):
+        dispatch.DISPATCH_ENABLED = False
+        self.set_online("bob")
+        res = self.post('/api/group/announce', "alice", {"group_id": self.group.group_id, "announcement": "hi"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sum(dispatch_depth().values()), 0)
+        self.assertEqual(self.receive("bob")[0]["content"]["msg_type"], "announcement")
+
+    def test_sysmsg_lane_weighted(self):
+        delivered = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                dispatch.dispatch_to("sysmsg", delivered.append, f"sysmsg{i}")
+            for i in range(6):
+                dispatch.dispatch(delivered.append, f"chat{i}")
+        self.assertDictEqual(dispatch_depth(), {"chat": 6, "sysmsg": 3})
+        drain()
+        # a large fan-out of system messages queued first does not hold back the chat pushes
+        self.assertListEqual(delivered, ["chat0", "chat1", "chat2", "chat3", "sysmsg0",
+                                         "chat4", "chat5", "sysmsg1", "sysmsg2"])
+
+    async def test_dispatcher_sends_on_server_loop(self):
+        channel = await self.layer.new_channel()
+        await self.layer.group_add(user_group("bob"), channel)
+        receiver = asyncio.get_running_loop().create_task(self.layer.receive(channel))
+        await asyncio.sleep(0)
+        # the real dispatcher thread: its send wakes the receiver waiting on this loop at once
+        self.starter.stop()
+        try:
+            start = asyncio.get_running_loop().time()
+            dispatch.enqueue("chat", send_frame, ("bob", "[]"))
+            message = await asyncio.wait_for(receiver, 5)
+            self.assertLess(asyncio.get_running_loop().time() - start, 0.5)
+        finally:
+            await asyncio.to_thread(stop_dispatcher)
+            self.starter.start()
+            await self.layer.group_discard(user_group("bob"), channel)
+        self.assertEqual(message["text"], "[]")
+        self.assertEqual(dispatch_stats["delivered"], 1)
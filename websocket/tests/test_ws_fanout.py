@@ -0,0 +1,66 @@
+import json
+from django.test import TestCase
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember, Message
+from websocket.views import push_group_message
+from websocket.fanout import adeliver, deliver, fanout_stats
+
+from utils.utils_websocket import user_group
+from utils.utils_cursor import pending_cursors
+
+# Create your tests here.
+class FanoutTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.layer = get_channel_layer()
+        self.channels = {}
+
+    # destructor
+    def tearDown(self):
+        for user_name, channel in self.channels.items():
+            async_to_sync(self.layer.group_discard)(user_group(user_name), channel)
+        pending_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def set_online(self, user_name):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(user_group(user_name), channel)
+        self.channels[user_name] = channel
+
+    def receive(self, user_name):
+        return async_to_sync(self.layer.receive)(self.channels[user_name])["text"]
+
+    # ! Test section
+    def test_sender_first(self):
+        self.set_online("alice")
+        deliver([("alice", str(i)) for i in range(10)], first=("alice", "echo"), shard_size=3, workers=2)
+        self.assertListEqual([self.receive("alice") for _ in range(11)], ["echo"] + [str(i) for i in range(10)])
+
+    @async_to_sync
+    async def test_shards(self):
+        for i in range(10):
+            self.channels[f"user{i}"] = await self.layer.new_channel()
+            await self.layer.group_add(user_group(f"user{i}"), self.channels[f"user{i}"])
+        shards = fanout_stats["shards"]
+        await adeliver([(f"user{i}", f"frame{i}") for i in range(10)], shard_size=4)
+        self.assertEqual(fanout_stats["shards"] - shards, 3)
+        for i in range(10):
+            self.assertEqual(await self.layer.receive(self.channels[f"user{i}"]), {"type": "chat.frame", "text": f"frame{i}", "lane": "chat"})
+
+    def test_group_message_delivered(self):
+        users = [User.objects.create(user_name=f"user{i}", password="123456", user_email=f"user{i}@163.com") for i in range(5)]
+        group = Group.objects.create(group_name="group", group_owner=users[0])
+        for user in users:
+            Groupmember.objects.create(group=group, member_user=user, member_role="member")
+            self.set_online(user.user_name)
+        msg = Message.objects.create(sender=users[3], group=group, msg_type="text", msg_body="hello")
+        frames = fanout_stats["frames"]
+        members = push_group_message(Groupmember.objects.filter(group=group).select_related("member_user"), msg)
+        self.assertEqual(len(members), 5)
+        self.assertEqual(fanout_stats["frames"] - frames, 5)
+        for user in users:
+            self.assertEqual(json.loads(self.receive(user.user_name))[0]["content"]["msg_id"], msg.msg_id)
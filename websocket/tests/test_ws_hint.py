@@ -0,0 +1,117 @@
+import json
+from django.test import TestCase
+from channels.layers import get_channel_layer
+from channels.testing.websocket import WebsocketCommunicator
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember, Message
+from websocket.consumers import ChatConsumer
+from websocket.views import push_group
+
+import utils.utils_group
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import user_group
+from utils.utils_group import get_members
+from utils.utils_cursor import pending_cursors, flush_cursors
+
+# Create your tests here.
+class HintTests(TestCase):
+    # Initializer
+    def setUp(self):
+        flush_cursors()
+        self.threshold = utils.utils_group.FANOUT_READ_THRESHOLD
+        utils.utils_group.FANOUT_READ_THRESHOLD = 2
+        self.layer = get_channel_layer()
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.carol = User.objects.create(user_name="carol", password="123456", user_email="carol@163.com")
+        self.small = Group.objects.create(group_name="small", group_owner=self.alice)
+        self.large = Group.objects.create(group_name="large", group_owner=self.alice)
+        for user in [self.alice, self.bob]:
+            Groupmember.objects.create(group=self.small, member_user=user, member_role="member")
+        for user in [self.alice, self.bob, self.carol]:
+            Groupmember.objects.create(group=self.large, member_user=user, member_role="member")
+        self.channels = {}
+
+    # destructor
+    def tearDown(self):
+        utils.utils_group.FANOUT_READ_THRESHOLD = self.threshold
+        for user_name, channel in self.channels.items():
+            async_to_sync(self.layer.group_discard)(user_group(user_name), channel)
+        pending_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def set_online(self, user_name):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(user_group(user_name), channel)
+        self.channels[user_name] = channel
+
+    def receive(self, user_name):
+        return json.loads(async_to_sync(self.layer.receive)(self.channels[user_name])["text"])
+
+    def get_ws(self, user_name: str):
+        token = generate_jwt_token(user_name)
+        return WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user_name}?{token}")
+
+    def fetch(self, user_name, group, after_msg_id):
+        data = {"group_id": group.group_id, "after_msg_id": after_msg_id}
+        headers = {"HTTP_AUTHORIZATION": generate_jwt_token(user_name)}
+        return self.client.get('/api/msg/fetch', data=data, content_type='application/json', **headers)
+
+    # ! Test section
+    def test_small_group_pushed(self):
+        self.set_online("bob")
+        msg = Message.objects.create(sender=self.alice, group=self.small, msg_type="text", msg_body="hello")
+        self.assertEqual(push_group(msg), 1)
+        ret = self.receive("bob")
+        self.assertEqual(ret[0]["type"], "message")
+        self.assertEqual(ret[0]["content"]["msg_id"], msg.msg_id)
+
+    def test_large_group_hinted(self):
+        self.set_online("bob")
+        self.set_online("carol")
+        msg = Message.objects.create(sender=self.alice, group=self.large, msg_type="text", msg_body="hello")
+        get_members(self.large.group_id)
+        # membership comes from the cache, and no cursor is read or written
+        with self.assertNumQueries(0):
+            self.assertEqual(push_group(msg), 2)
+        for user_name in ["bob", "carol"]:
+            self.assertListEqual(self.receive(user_name), [{"type": "hint", "content": {
+                "group_id": self.large.group_id, "msg_id": msg.msg_id, "msg_type": "text",
+            }}])
+        self.assertNotIn((self.large.group_id, self.bob.user_id), pending_cursors)
+
+    def test_fetch_after_hint(self):
+        first = Message.objects.create(sender=self.alice, group=self.large, msg_type="text", msg_body="first")
+        second = Message.objects.create(sender=self.alice, group=self.large, msg_type="text", msg_body="second")
+        res = self.fetch("bob", self.large, first.msg_id)
+        self.assertEqual(res.status_code, 200)
+        self.assertListEqual([msg["msg_id"] for msg in res.json()["msgs"]], [second.msg_id])
+        res = self.fetch("bob", self.large, -1)
+        self.assertListEqual([msg["msg_id"] for msg in res.json()["msgs"]], [first.msg_id, second.msg_id])
+
+    def test_fetch_after_wrong_type(self):
+        res = self.fetch("bob", self.large, "abc")
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json()['code'], -2)
+
+    @async_to_sync
+    async def test_message_to_large_group(self):
+        ws_a = self.get_ws("alice")
+        ws_b = self.get_ws("bob")
+        for ws in [ws_a, ws_b]:
+            connected, _ = await ws.connect()
+            self.assertTrue(connected)
+            await ws.receive_json_from()
+        await ws_a.send_json_to({
+            "type": "message",
+            "content": {"group_id": self.large.group_id, "msg_type": "text", "msg_body": "hello"},
+        })
+        for ws in [ws_a, ws_b]:
+            ret = await ws.receive_json_from()
+            self.assertEqual(ret[0]["type"], "hint")
+            self.assertEqual(ret[0]["content"]["group_id"], self.large.group_id)
+        await ws_a.disconnect()
+        await ws_b.disconnect()
@@ -0,0 +1,100 @@
+import json
+from django.test import TestCase
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember, Message, Inbox
+from websocket.views import push_group, fetch_login_msgs
+
+from utils import utils_inbox
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import user_group
+from utils.utils_cursor import pending_cursors
+from utils.utils_ring import rings
+
+# Create your tests here.
+class InboxTests(TestCase):
+    # Initializer
+    def setUp(self):
+        utils_inbox.INBOX_ENABLED = True
+        self.layer = get_channel_layer()
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.groups = []
+        for i in range(5):
+            group = Group.objects.create(group_name=f"group{i}", group_owner=self.alice)
+            Groupmember.objects.create(group=group, member_user=self.alice, member_role="admin")
+            Groupmember.objects.create(group=group, member_user=self.bob, member_role="member")
+            self.groups.append(group)
+        self.channels = {}
+
+    # destructor
+    def tearDown(self):
+        utils_inbox.INBOX_ENABLED = False
+        for user_name, channel in self.channels.items():
+            async_to_sync(self.layer.group_discard)(user_group(user_name), channel)
+        pending_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def set_online(self, user_name):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(user_group(user_name), channel)
+        self.channels[user_name] = channel
+
+    def set_offline(self, user_name):
+        async_to_sync(self.layer.group_discard)(user_group(user_name), self.channels.pop(user_name))
+
+    def send(self, group, body):
+        msg = Message.objects.create(sender=self.alice, group=group, msg_type="text", msg_body=body)
+        push_group(msg)
+        return msg
+
+    def replayed(self, user):
+        return [item["content"]["msg_id"] for item in json.loads(fetch_login_msgs(user)) if item["type"] == "message"]
+
+    # ! Test section
+    def test_offline_members_recorded(self):
+        self.set_online("alice")
+        msg = self.send(self.groups[0], "hello")
+        self.assertListEqual(list(Inbox.objects.values_list("user_id", "msg_id")), [(self.bob.user_id, msg.msg_id)])
+
+    def test_login_reads_pending_groups_only(self):
+        self.set_online("alice")
+        msgs = [self.send(self.groups[i], str(i)) for i in [1, 3]]
+        self.assertListEqual(self.replayed(self.bob), [msg.msg_id for msg in msgs])
+
+        # read messages from database rather than from the rings of the groups
+        rings.clear()
+        utils_inbox.INBOX_ENABLED = False
+        with self.assertNumQueries(8):
+            # memberships, a read for each of the 5 groups, sent_msg_id, system messages
+            self.replayed(self.bob)
+        utils_inbox.INBOX_ENABLED = True
+        with self.assertNumQueries(5):
+            # pending memberships, a read for each of the 2 pending groups only, sent_msg_id, system messages
+            self.assertListEqual(self.replayed(self.bob), [msg.msg_id for msg in msgs])
+
+    def test_ack_trims_inbox(self):
+        first = self.send(self.groups[0], "first")
+        second = self.send(self.groups[0], "second")
+        data = {"group_id": self.groups[0].group_id, "msg_id": first.msg_id}
+        headers = {"HTTP_AUTHORIZATION": generate_jwt_token("bob")}
+        res = self.client.post('/api/msg/ack', data=data, content_type='application/json', **headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertListEqual(list(Inbox.objects.filter(user=self.bob).values_list("msg_id", flat=True)), [second.msg_id])
+        self.assertListEqual(self.replayed(self.bob), [second.msg_id])
+
+    def test_unacked_push_replayed(self):
+        self.set_online("bob")
+        msg = self.send(self.groups[2], "hello")
+        self.assertFalse(Inbox.objects.filter(user=self.bob).exists())
+        self.set_offline("bob")
+        # sent while online, never acked: the pending cursor brings the group back
+        self.assertListEqual(self.replayed(self.bob), [msg.msg_id])
+
+    def test_leave_group_trims_inbox(self):
+        self.send(self.groups[0], "hello")
+        Groupmember.objects.filter(group=self.groups[0], member_user=self.bob).delete()
+        self.assertFalse(Inbox.objects.filter(user=self.bob).exists())
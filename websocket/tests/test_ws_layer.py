@@ -0,0 +1,90 @@
+from django.test import TestCase
+from channels.testing.websocket import WebsocketCommunicator
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember
+from websocket.consumers import ChatConsumer
+
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import ws_reg, online
+from utils.utils_assert import assertSingleMessage
+
+# Create your tests here.
+class LayerTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="114514", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+
+    # destructor
+    def tearDown(self):
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def get_ws(self, user_name: str, token=None):
+        token = token or generate_jwt_token(user_name)
+        return WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user_name}?{token}")
+
+    def async_post(self, path, data, jwt_user_name, token=None):
+        headers = {"Authorization": token or generate_jwt_token(jwt_user_name)}
+        return self.async_client.post(path, data=data, content_type='application/json', **headers)
+
+    # ! Test section
+    @async_to_sync
+    async def test_deliver_to_connection_of_other_worker(self):
+        ws = self.get_ws("bob")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        ret = await ws.receive_json_from()
+        self.assertListEqual(ret, [])
+
+        # pretend bob is held by another worker: only the channel layer knows him
+        held = ws_reg.pop("bob")
+        self.assertTrue(online("bob"))
+
+        res = await self.async_post("/api/group/announce", {"group_id": self.group.group_id, "announcement": "hi"}, "alice")
+        self.assertEqual(res.status_code, 200)
+        ret = await ws.receive_json_from()
+        assertSingleMessage(self, ret, self.alice.user_id, self.group.group_id, "announcement", "hi")
+
+        ws_reg["bob"] = held
+        await ws.disconnect()
+        self.assertFalse(online("bob"))
+
+    @async_to_sync
+    async def test_logout_connection_of_other_worker(self):
+        token = generate_jwt_token("bob")
+        ws = self.get_ws("bob", token)
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        _ = await ws.receive_json_from()
+
+        ws_reg.pop("bob")
+        res = await self.async_post("/api/user/logout", {}, "bob", token)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["code"], 0)
+        ret = await ws.receive_output()
+        self.assertEqual(ret["type"], "websocket.close")
+        await ws.disconnect()
+
+    @async_to_sync
+    async def test_logout_keeps_other_connection(self):
+        ws_1 = self.get_ws("bob")
+        connected, _ = await ws_1.connect()
+        self.assertTrue(connected)
+        _ = await ws_1.receive_json_from()
+
+        ws_2 = self.get_ws("bob")
+        connected, _ = await ws_2.connect()
+        self.assertTrue(connected)
+        _ = await ws_1.receive_json_from()
+        _ = await ws_2.receive_json_from()
+
+        await ws_1.disconnect()
+        self.assertTrue(online("bob"))
+        await ws_2.disconnect()
+        self.assertFalse(online("bob"))
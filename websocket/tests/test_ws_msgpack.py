@@ -0,0 +1,102 @@
+import json
+import msgpack
+from django.test import TestCase
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import User, Group, Groupmember, Message
+from websocket.consumers import ChatConsumer
+from websocket.views import fetch_login_msgs
+
+from websocket import codec
+from websocket.codec import pack_frame, unpack_frame, compact, pack_cache, codec_stats
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_cursor import pending_cursors
+from utils.utils_device import device_cursors
+from websocket.catchup import pending_logins
+
+# Create your tests here.
+class MsgpackTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.cache_size = codec.PACK_CACHE_SIZE
+        for key in codec_stats:
+            codec_stats[key] = 0
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+
+    # destructor
+    def tearDown(self):
+        codec.PACK_CACHE_SIZE = self.cache_size
+        pack_cache.clear()
+        pending_cursors.clear()
+        pending_logins.clear()
+        device_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def ws(self, user_name, subprotocols=None):
+        return WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user_name}?{generate_jwt_token(user_name)}",
+                                     subprotocols=subprotocols)
+
+    # ! Test section
+    def test_codec(self):
+        msg = Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body="hello")
+        text = fetch_login_msgs(self.bob)
+        data = pack_frame(text)
+        self.assertLess(len(data), len(text.encode()))
+        wire = msgpack.unpackb(data)
+        self.assertListEqual(sorted(wire[0].keys()), ["c", "t"])
+        self.assertListEqual(sorted(wire[0]["c"].keys()), ["b", "ct", "g", "i", "m", "r", "s"])
+        self.assertEqual(wire[0]["c"]["i"], msg.msg_id)
+        self.assertEqual(unpack_frame(data), json.loads(text))
+        # the conversion of a frame is shared
+        self.assertIs(pack_frame(text), data)
+        self.assertEqual(codec_stats["packed"], 1)
+        self.assertEqual(codec_stats["hit"], 1)
+        # field names in the text of a message are left alone
+        body = '{"msg_id": 1, "type": "x"} "content": '
+        text = json.dumps([{"type": "message", "content": {"msg_id": 1, "msg_body": body}}])
+        self.assertEqual(msgpack.unpackb(pack_frame(text)), [{"t": "message", "c": {"i": 1, "b": body}}])
+        # other keys go as they are
+        self.assertDictEqual(compact({"groups": {"3": 1}, "type": "sync"}), {"groups": {"3": 1}, "t": "sync"})
+
+    def test_cache_bounded(self):
+        codec.PACK_CACHE_SIZE = 2
+        for i in range(3):
+            pack_frame(json.dumps([{"type": "hint", "content": {"msg_id": i}}]))
+        self.assertEqual(len(pack_cache), 2)
+
+    async def test_consumer(self):
+        msg = await Message.objects.acreate(sender=self.alice, group=self.group, msg_type="text", msg_body="hello")
+        ws = self.ws("bob", [codec.MSGPACK_SUBPROTOCOL])
+        connected, subprotocol = await ws.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, "msgpack")
+        # catch-up in a binary frame
+        ret = msgpack.unpackb(await ws.receive_from())
+        self.assertListEqual([item["c"]["i"] for item in ret], [msg.msg_id])
+        # a send in msgpack, answered in msgpack
+        content = {"g": self.group.group_id, "m": "text", "b": "hi", "cm": "x"}
+        await ws.send_to(bytes_data=msgpack.packb({"t": "message", "c": content}))
+        events = []
+        while not await ws.receive_nothing():
+            events += msgpack.unpackb(await ws.receive_from())
+        self.assertListEqual(sorted(item["t"] for item in events), ["message", "sent"])
+        self.assertEqual(await Message.objects.filter(msg_body="hi").acount(), 1)
+        await ws.send_to(bytes_data=b"\xc1")
+        self.assertEqual(msgpack.unpackb(await ws.receive_from())[0]["t"], "error")
+        await ws.disconnect()
+
+    async def test_json_by_default(self):
+        await Message.objects.acreate(sender=self.alice, group=self.group, msg_type="text", msg_body="hello")
+        ws = self.ws("bob")
+        connected, subprotocol = await ws.connect()
+        self.assertTrue(connected)
+        self.assertIsNone(subprotocol)
+        ret = await ws.receive_json_from()
+        self.assertEqual(ret[0]["content"]["msg_body"], "hello")
+        await ws.disconnect()
@@ -0,0 +1,143 @@
+import json
+import asyncio
+from django.test import SimpleTestCase
+from asgiref.sync import async_to_sync
+
+from websocket.outbound import OutboundQueue, outbound_stats, outbound_depth, reconnect_after, RECONNECT_JITTER
+
+# Create your tests here.
+class OutboundTests(SimpleTestCase):
+    # Initializer
+    def setUp(self):
+        self.sent = []
+        self.closed = []
+
+    # ! Utility functions
+    async def send(self, text):
+        self.sent.append(text)
+
+    async def close(self, code):
+        self.closed.append(code)
+
+    def get_queue(self, policy, max_frames=3, max_bytes=1000, **kwargs):
+        return OutboundQueue(self.send, self.close, max_frames=max_frames, max_bytes=max_bytes, policy=policy, **kwargs)
+
+    # ! Test section
+    @async_to_sync
+    async def test_frames_written_in_order(self):
+        queue = self.get_queue("resync")
+        writer = asyncio.create_task(queue.run())
+        for i in range(3):
+            self.assertTrue(queue.put(str(i)))
+        await asyncio.sleep(0)
+        self.assertListEqual(self.sent, ["0", "1", "2"])
+        self.assertEqual(len(queue), 0)
+        writer.cancel()
+
+    @async_to_sync
+    async def test_overflow_resync(self):
+        queue = self.get_queue("resync")
+        overflows = outbound_stats["overflows"]
+        for i in range(3):
+            self.assertTrue(queue.put(str(i)))
+        self.assertGreaterEqual(outbound_depth()["max_frames"], 3)
+        self.assertFalse(queue.put("3"))
+        self.assertFalse(queue.put("4"))
+        self.assertEqual(outbound_stats["overflows"] - overflows, 1)
+
+        await queue.run()
+        self.assertEqual(len(self.sent), 1)
+        ret = json.loads(self.sent[0])
+        self.assertEqual(ret[0]["type"], "resync")
+        self.assertEqual(ret[0]["content"]["dropped"], 4)
+        self.assertTrue(RECONNECT_JITTER[0] <= ret[0]["content"]["reconnect_after"] <= RECONNECT_JITTER[1])
+        self.assertListEqual(self.closed, [1000])
+
+    @async_to_sync
+    async def test_overflow_close(self):
+        queue = self.get_queue("close")
+        dropped = outbound_stats["dropped"]
+        for i in range(4):
+            queue.put(str(i))
+        await queue.run()
+        # the backlog is dropped, only the reconnect hint goes out
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(json.loads(self.sent[0])[0]["type"], "reconnect")
+        self.assertListEqual(self.closed, [1013])
+        self.assertEqual(outbound_stats["dropped"] - dropped, 4)
+
+    @async_to_sync
+    async def test_byte_limit(self):
+        queue = self.get_queue("close", max_frames=100, max_bytes=10)
+        self.assertTrue(queue.put("x" * 6))
+        self.assertEqual(queue.bytes, 6)
+        self.assertFalse(queue.put("x" * 6))
+        self.assertEqual(queue.closing, 1013)
+
+    @async_to_sync
+    async def test_large_frame_into_empty_queue(self):
+        queue = self.get_queue("resync", max_frames=100, max_bytes=10)
+        writer = asyncio.create_task(queue.run())
+        self.assertTrue(queue.put("x" * 20))
+        await asyncio.sleep(0)
+        self.assertListEqual(self.sent, ["x" * 20])
+        # a backlog is limited as usual
+        self.assertTrue(queue.put("x" * 20))
+        self.assertFalse(queue.put("x" * 20))
+        await asyncio.sleep(0)
+        self.assertEqual(json.loads(self.sent[1])[0]["type"], "resync")
+        writer.cancel()
+
+    @async_to_sync
+    async def test_coalesce_window(self):
+        queue = self.get_queue("close", max_frames=100, window=0.01)
+        writer = asyncio.create_task(queue.run())
+        queue.put('[{"n": 0}]')
+        await asyncio.sleep(0)
+        queue.put("[]")
+        queue.put('[{"n": 1}, {"n": 2}]')
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.sent), 1)
+        self.assertListEqual(json.loads(self.sent[0]), [{"n": 0}, {"n": 1}, {"n": 2}])
+        self.assertEqual(queue.bytes, 0)
+        writer.cancel()
+
+    @async_to_sync
+    async def test_coalesce_frame_cap(self):
+        queue = self.get_queue("close", max_frames=100, window=0.01, max_frame_bytes=30)
+        writer = asyncio.create_task(queue.run())
+        for i in range(5):
+            queue.put(json.dumps([{"n": i}]))
+        await asyncio.sleep(0.05)
+        self.assertListEqual([len(json.loads(text)) for text in self.sent], [3, 2])
+        self.assertListEqual([item["n"] for text in self.sent for item in json.loads(text)], list(range(5)))
+        writer.cancel()
+
+    def test_weighted_lanes(self):
+        queue = self.get_queue("close", max_frames=100)
+        for i in range(3):
+            queue.put(json.dumps([{"sysmsg": i}]), "sysmsg")
+        for i in range(8):
+            queue.put(json.dumps([{"chat": i}]))
+        self.assertDictEqual(outbound_depth()["lanes"], {"chat": 8, "sysmsg": 3})
+        sent = [json.loads(queue.take()) for _ in range(4)]
+        # one frame of system messages for 4 chat frames, its backlog merged into that frame
+        self.assertListEqual([list(items[0]) for items in sent], [["chat"], ["chat"], ["sysmsg"], ["chat"]])
+        self.assertListEqual(sent[2], [{"sysmsg": 0}, {"sysmsg": 1}, {"sysmsg": 2}])
+        self.assertListEqual([item["chat"] for items in sent if "chat" in items[0] for item in items], [0, 1, 2])
+        self.assertEqual(len(queue), 5)
+
+    @async_to_sync
+    async def test_shutdown_hints_reconnect(self):
+        queue = self.get_queue("close")
+        queue.put("[0]")
+        queue.shutdown(1012)
+        self.assertFalse(queue.put("[1]"))
+        await queue.run()
+        self.assertEqual(self.sent[0], "[0]")
+        self.assertEqual(json.loads(self.sent[1])[0]["type"], "reconnect")
+        self.assertListEqual(self.closed, [1012])
+        # every socket gets its own delay
+        delays = {reconnect_after() for _ in range(10)}
+        self.assertGreater(len(delays), 1)
+        self.assertTrue(all(RECONNECT_JITTER[0] <= delay <= RECONNECT_JITTER[1] for delay in delays))
@@ -0,0 +1,137 @@
+import json
+from django.test import TestCase
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember, Message
+from websocket.views import push_group_message, fetch_message_windows
+
+from utils.utils_websocket import user_group
+from utils.utils_frame import frame_cache_stats
+from utils.utils_cursor import flush_cursors
+from utils.utils_ring import drop_ring
+
+# Create your tests here.
+class PushTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.layer = get_channel_layer()
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        self.channels = {}
+
+    # destructor
+    def tearDown(self):
+        for user_name, channel in self.channels.items():
+            async_to_sync(self.layer.group_discard)(user_group(user_name), channel)
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def add_members(self, count, start):
+        for i in range(start, start + count):
+            user = User.objects.create(user_name=f"user{i}", password="123456", user_email=f"user{i}@163.com")
+            Groupmember.objects.create(group=self.group, member_user=user, member_role="member")
+            self.set_online(user.user_name)
+
+    def set_online(self, user_name):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(user_group(user_name), channel)
+        self.channels[user_name] = channel
+
+    def receive(self, user_name):
+        return json.loads(async_to_sync(self.layer.receive)(self.channels[user_name])["text"])
+
+    def push(self, body):
+        msg = Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body=body)
+        return msg, push_group_message(Groupmember.objects.filter(group=self.group).select_related("member_user"), msg)
+
+    # ! Test section
+    def test_query_count_independent_of_group_size(self):
+        self.set_online("alice")
+        for count, start in [(5, 0), (50, 5)]:
+            self.add_members(count, start)
+            msg = Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body=str(count))
+            members = list(Groupmember.objects.filter(group=self.group).select_related("member_user"))
+            # at most one query for the window (none when the ring of the group has it), nothing per member
+            drop_ring(self.group)
+            with self.assertNumQueries(1):
+                update_list = push_group_message(members, msg)
+            self.assertEqual(len(update_list), len(members))
+            Groupmember.objects.bulk_update(update_list, fields=["sent_msg_id"])
+            for user_name in self.channels:
+                self.receive(user_name)
+
+    def test_each_member_gets_own_window(self):
+        self.add_members(2, 0)
+        self.set_online("alice")
+        first = Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body="first")
+        Groupmember.objects.filter(member_user__user_name="user1").update(sent_msg_id=first.msg_id)
+
+        msg, update_list = self.push("second")
+        self.assertEqual(len(update_list), 3)
+        self.assertListEqual([m["content"]["msg_id"] for m in self.receive("user0")], [first.msg_id, msg.msg_id])
+        self.assertListEqual([m["content"]["msg_id"] for m in self.receive("user1")], [msg.msg_id])
+        self.assertTrue(all(gm.sent_msg_id == msg.msg_id for gm in update_list))
+
+    def test_offline_members_skipped(self):
+        self.add_members(1, 0)
+        async_to_sync(self.layer.group_discard)(user_group("user0"), self.channels.pop("user0"))
+        msg = Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body="hello")
+        members = list(Groupmember.objects.filter(group=self.group).select_related("member_user"))
+        with self.assertNumQueries(0):
+            update_list = push_group_message(members, msg)
+        self.assertListEqual(update_list, [])
+
+    def test_frame_encoded_once(self):
+        self.add_members(3, 0)
+        misses = frame_cache_stats["miss"]
+        first = Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body="first")
+        Groupmember.objects.filter(member_user__user_name="user0").update(sent_msg_id=first.msg_id)
+        Groupmember.objects.filter(member_user__user_name="user1").update(sent_msg_id=first.msg_id)
+        msg = Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body="second")
+        members = list(Groupmember.objects.filter(group=self.group).select_related("member_user"))
+        frames = dict((gm.member_user.user_name, frame) for gm, frame, _ in fetch_message_windows(members, msg))
+        # members with the same window share one str, every message is encoded once
+        self.assertIs(frames["user0"], frames["user1"])
+        self.assertIsNot(frames["user0"], frames["user2"])
+        self.assertEqual(frame_cache_stats["miss"] - misses, 2)
+
+        fetch_message_windows(members, msg)
+        self.assertEqual(frame_cache_stats["miss"] - misses, 2)
+
+    def test_recalled_message_reencoded(self):
+        self.add_members(1, 0)
+        msg, _ = self.push("hello")
+        self.assertEqual(self.receive("user0")[0]["content"]["msg_body"], "hello")
+        msg.msg_type = "recall"
+        msg.msg_body = "alice recalled a message from alice"
+        msg.save(update_fields=["msg_type", "msg_body"])
+        flush_cursors()
+        Groupmember.objects.filter(member_user__user_name="user0").update(sent_msg_id=-1)
+        self.push("again")
+        ret = self.receive("user0")
+        self.assertEqual(ret[0]["content"]["msg_type"], "recall")
+        self.assertEqual(ret[1]["content"]["msg_body"], "again")
+
+    def test_recall_of_message_already_sent(self):
+        self.add_members(2, 0)
+        msg, _ = self.push("hello")
+        later, _ = self.push("later")
+        flush_cursors()
+        for user_name in ["user0", "user1"]:
+            self.receive(user_name)
+            self.receive(user_name)
+        Groupmember.objects.filter(member_user__user_name="user1").update(sent_msg_id=msg.msg_id - 1)
+        msg.msg_type = "recall"
+        msg.msg_body = "alice recalled a message from alice"
+        msg.save(update_fields=["msg_type", "msg_body"])
+        members = list(Groupmember.objects.filter(group=self.group, member_user__user_name__in=["user0", "user1"]).select_related("member_user"))
+        push_group_message(members, msg)
+        # past both messages: the recall alone; behind them: from the recall on
+        ret = self.receive("user0")
+        self.assertListEqual([(m["content"]["msg_id"], m["content"]["msg_type"]) for m in ret], [(msg.msg_id, "recall")])
+        ret = self.receive("user1")
+        self.assertListEqual([m["content"]["msg_id"] for m in ret], [msg.msg_id, later.msg_id])
+        self.assertEqual(ret[0]["content"]["msg_type"], "recall")
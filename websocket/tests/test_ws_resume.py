@@ -0,0 +1,141 @@
+import asyncio
+from unittest.mock import patch
+from django.test import TestCase
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import User, Group, Groupmember
+from websocket.consumers import ChatConsumer
+
+from websocket import resume
+from websocket.resume import sessions, resume_stats
+from websocket.catchup import login_sync_stats, pending_logins
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_websocket import asend_frame, online, logout_user
+from utils.utils_cursor import pending_cursors
+
+# Create your tests here.
+class ResumeTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.window = resume.RESUME_WINDOW
+        self.buffer = resume.RESUME_BUFFER
+        for stats in [resume_stats, login_sync_stats]:
+            for key in stats:
+                stats[key] = 0
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.token = generate_jwt_token("bob")
+
+    # destructor
+    def tearDown(self):
+        resume.RESUME_WINDOW = self.window
+        resume.RESUME_BUFFER = self.buffer
+        sessions.clear()
+        pending_logins.clear()
+        pending_cursors.clear()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def get_ws(self, flags: str, user_name="bob", token=None):
+        return WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user_name}?{token or self.token}{flags}")
+
+    async def connect(self, flags: str):
+        """Connect bob, returns (communicator, session event content)."""
+        ws = self.get_ws(flags)
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        ret = await ws.receive_json_from()
+        self.assertEqual(ret[0]["type"], "session")
+        return ws, ret[0]["content"]
+
+    async def drop_sessions(self):
+        for session in list(sessions.values()):
+            if session.parking is not None:
+                session.parking.cancel()
+        await asyncio.sleep(0.01)
+
+    # ! Test section
+    async def test_resume_replays_gap(self):
+        ws, session = await self.connect("&sync&resume")
+        self.assertFalse(session["resumed"])
+        await ws.disconnect()
+        self.assertTrue(online("bob"))
+        await asend_frame("bob", '[{"type": "message", "content": 1}]')
+        await asend_frame("bob", '[{"type": "message", "content": 2}]')
+
+        with patch("websocket.consumers.auth_jwt_token") as auth:
+            ws, again = await self.connect(f"&resume={session['resume_token']}")
+            auth.assert_not_called()
+        self.assertTrue(again["resumed"])
+        self.assertNotEqual(again["resume_token"], session["resume_token"])
+        for content in [1, 2]:
+            self.assertListEqual(await ws.receive_json_from(), [{"type": "message", "content": content}])
+        self.assertTrue(await ws.receive_nothing())
+        # no login catch-up either
+        self.assertEqual(login_sync_stats["queued"], 0)
+        self.assertEqual(resume_stats["resumed"], 1)
+
+        await asend_frame("bob", '[{"type": "message", "content": 3}]')
+        self.assertListEqual(await ws.receive_json_from(), [{"type": "message", "content": 3}])
+        await ws.disconnect()
+        await self.drop_sessions()
+
+    async def test_token_single_use(self):
+        ws, session = await self.connect("&sync&resume")
+        await ws.disconnect()
+        ws, again = await self.connect(f"&sync&resume={session['resume_token']}")
+        await ws.disconnect()
+        ws, third = await self.connect(f"&sync&resume={session['resume_token']}")
+        self.assertFalse(third["resumed"])
+        self.assertEqual(resume_stats["missed"], 1)
+        await ws.disconnect()
+        await self.drop_sessions()
+
+    async def test_other_user_cannot_resume(self):
+        ws, session = await self.connect("&sync&resume")
+        await ws.disconnect()
+        ws = self.get_ws(f"&sync&resume={session['resume_token']}", "alice", generate_jwt_token("alice"))
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        ret = await ws.receive_json_from()
+        self.assertFalse(ret[0]["content"]["resumed"])
+        await ws.disconnect()
+        await self.drop_sessions()
+
+    async def test_expired(self):
+        resume.RESUME_WINDOW = 0.01
+        ws, session = await self.connect("&sync&resume")
+        await ws.disconnect()
+        await asyncio.sleep(0.05)
+        self.assertFalse(online("bob"))
+        self.assertEqual(resume_stats["expired"], 1)
+        # falls back to a new connection with the login catch-up
+        ws, again = await self.connect(f"&resume={session['resume_token']}")
+        self.assertFalse(again["resumed"])
+        self.assertEqual(login_sync_stats["queued"], 1)
+        await ws.receive_json_from()
+        await ws.disconnect()
+        await self.drop_sessions()
+
+    async def test_overflow_not_resumable(self):
+        resume.RESUME_BUFFER = 2
+        ws, session = await self.connect("&sync&resume")
+        await ws.disconnect()
+        for i in range(3):
+            await asend_frame("bob", f'[{{"type": "message", "content": {i}}}]')
+        await asyncio.sleep(0.01)
+        self.assertEqual(resume_stats["overflowed"], 1)
+        self.assertFalse(online("bob"))
+        ws, again = await self.connect(f"&sync&resume={session['resume_token']}")
+        self.assertFalse(again["resumed"])
+        await ws.disconnect()
+        await self.drop_sessions()
+
+    async def test_logout_not_parked(self):
+        ws, session = await self.connect("&sync&resume")
+        await asyncio.get_running_loop().run_in_executor(None, logout_user, "bob", self.token)
+        self.assertEqual((await ws.receive_output())["type"], "websocket.close")
+        await ws.wait()
+        self.assertEqual(resume_stats["parked"], 0)
+        self.assertNotIn(session["resume_token"], sessions)
+        self.assertFalse(online("bob"))
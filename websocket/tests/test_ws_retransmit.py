@@ -0,0 +1,128 @@
+import json
+from django.test import TestCase
+from channels.testing.websocket import WebsocketCommunicator
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember, Message
+from websocket.consumers import ChatConsumer
+from websocket.views import fetch_login_msgs, on_delivered
+
+from websocket import retransmit
+from websocket.retransmit import UnackedWindow, retransmit_stats
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_cursor import pending_cursors
+from utils.utils_device import device_cursors, open_device, frame_events
+from websocket.outbound import OutboundQueue
+from websocket.catchup import pending_logins
+
+# Create your tests here.
+class RetransmitTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.timeout = retransmit.RETRANSMIT_TIMEOUT
+        for key in retransmit_stats:
+            retransmit_stats[key] = 0
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group", group_owner=self.alice)
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="admin")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+
+    # destructor
+    def tearDown(self):
+        retransmit.RETRANSMIT_TIMEOUT = self.timeout
+        pending_cursors.clear()
+        pending_logins.clear()
+        device_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def frame(self, *msg_ids):
+        return json.dumps([{"type": "message", "content": {"msg_id": msg_id}} for msg_id in msg_ids])
+
+    def send(self, count):
+        return [Message.objects.create(sender=self.alice, group=self.group, msg_type="text", msg_body=str(i)).msg_id
+                for i in range(count)]
+
+    # ! Test section
+    def test_window(self):
+        window = UnackedWindow(timeout=1, tries=2, size=3)
+        window.track(self.frame(1, 2), [[7, 1], [7, 2]])
+        window.track(self.frame(3), [[7, 3]])
+        window.track(self.frame(), [None])
+        self.assertEqual(len(window), 2)
+        window.ack({7: 1})
+        self.assertEqual(len(window), 2)
+        self.assertListEqual(window.due(now=0), [])
+        # only the events not delivered are sent again
+        self.assertListEqual(window.due(now=1e12), [self.frame(2), self.frame(3)])
+        window.ack({7: 2})
+        self.assertEqual(len(window), 1)
+        self.assertListEqual(window.due(now=2e12), [self.frame(3)])
+        # given up after its tries
+        self.assertListEqual(window.due(now=3e12), [])
+        self.assertEqual(len(window), 0)
+        self.assertEqual(retransmit_stats["given_up"], 1)
+
+    def test_window_size(self):
+        window = UnackedWindow(size=2)
+        for msg_id in range(3):
+            window.track(self.frame(msg_id), [[7, msg_id]])
+        self.assertListEqual(window.drain(), [self.frame(1), self.frame(2)])
+        self.assertEqual(retransmit_stats["given_up"], 1)
+
+    def test_resent_frame_decoded_once(self):
+        frame_events.cache_clear()
+        window = UnackedWindow(timeout=1, tries=3)
+        window.track(self.frame(1, 2), [[7, 1], [7, 2]])
+        self.assertListEqual(window.due(now=1e12), [self.frame(1, 2)])
+        self.assertEqual(frame_events.cache_info().misses, 0)
+        window.ack({7: 1})
+        for now in [2e12, 3e12]:
+            self.assertListEqual(window.due(now=now), [self.frame(2)])
+        self.assertEqual(frame_events.cache_info().misses, 1)
+
+    def test_tracks_what_was_sent(self):
+        consumer = ChatConsumer()
+        consumer.user_id, consumer.channel_name = 1, "a"
+        consumer.outbound = OutboundQueue(None, None)
+        consumer.window = UnackedWindow(timeout=1)
+        open_device(1, "a")
+        async_to_sync(consumer.chat_frame)({"text": self.frame(1, 2), "ids": [[7, 1], [7, 2]], "catchup": True})
+        async_to_sync(consumer.chat_frame)({"text": self.frame(2, 3), "ids": [[7, 2], [7, 3]]})
+        # message 2 went with the first frame only, it is sent again with that one only
+        self.assertListEqual(consumer.window.drain(), [self.frame(1, 2), self.frame(3)])
+
+    def test_delivered_checked(self):
+        ids = self.send(5)
+        other = Group.objects.create(group_name="other", group_owner=self.alice)
+        Message.objects.create(sender=self.alice, group=other, msg_type="text", msg_body="x")
+        # a group bob is not in is left out, a msg_id past the latest message brought back to it
+        cursors = on_delivered(self.bob.user_id, {str(self.group.group_id): ids[-1] + 100, str(other.group_id): 1})
+        self.assertDictEqual(cursors, {self.group.group_id: ids[-1]})
+        for content in [{"x": 1}, {str(self.group.group_id): 1 << 63}, {str(self.group.group_id): -2},
+                        {str(1 << 63): 1}, {str(self.group.group_id): True}]:
+            with self.assertRaises(AssertionError):
+                on_delivered(self.bob.user_id, content)
+
+    def test_catchup_of_other_device(self):
+        ids = self.send(5)
+        on_delivered(self.bob.user_id, {str(self.group.group_id): ids[2]})
+        # what one device got says nothing of another: its catch-up starts from ack_msg_id
+        ret = json.loads(fetch_login_msgs(self.bob))
+        self.assertListEqual([item["content"]["msg_id"] for item in ret], ids)
+
+    async def test_resent_until_delivered(self):
+        retransmit.RETRANSMIT_TIMEOUT = 0.05
+        msg = await Message.objects.acreate(sender=self.alice, group=self.group, msg_type="text", msg_body="hello")
+        ws = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/bob?{generate_jwt_token('bob')}&delivered")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        for _ in range(2):
+            ret = await ws.receive_json_from()
+            self.assertListEqual([item["content"]["msg_id"] for item in ret], [msg.msg_id])
+        await ws.send_json_to({"type": "delivered", "content": {str(self.group.group_id): msg.msg_id}})
+        self.assertTrue(await ws.receive_nothing(0.2))
+        self.assertEqual(retransmit_stats["delivered"], 1)
+        await ws.disconnect()
@@ -0,0 +1,128 @@
+import json
+from django.test import TestCase
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import User, Group, Groupmember, Message, Userdelmsg
+from websocket.consumers import ChatConsumer
+from websocket.rpc import call, rpc_stats
+
+from utils import utils_admission
+from utils.utils_admission import admission_state
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_cursor import pending_cursors
+from utils.utils_device import device_cursors
+from websocket.catchup import pending_logins
+
+# Create your tests here.
+class RpcTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.deadline = dict(utils_admission.ADMISSION_DEADLINE)
+        utils_admission.ADMISSION_DEADLINE.update({"chat": 0.05, "bulk": 0.01})
+        for key in rpc_stats:
+            rpc_stats[key] = 0
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.groups = []
+        for name in ["first", "second"]:
+            group = Group.objects.create(group_name=name, group_owner=self.alice)
+            Groupmember.objects.create(group=group, member_user=self.alice, member_role="admin")
+            Groupmember.objects.create(group=group, member_user=self.bob, member_role="member")
+            self.groups.append(group)
+
+    # destructor
+    def tearDown(self):
+        utils_admission.ADMISSION_DEADLINE.update(self.deadline)
+        admission_state.update({"active": 0, "chat": 0, "bulk": 0})
+        pending_cursors.clear()
+        pending_logins.clear()
+        device_cursors.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def call(self, user, method, params=None, request_id=1):
+        ret = json.loads(call(user, {"id": request_id, "method": method, "params": params or {}}))
+        self.assertEqual(len(ret), 1)
+        self.assertEqual(ret[0]["type"], "rpc")
+        self.assertEqual(ret[0]["content"]["id"], request_id)
+        return ret[0]["content"]
+
+    def send(self, group, body="hello"):
+        return Message.objects.create(sender=self.alice, group=group, msg_type="text", msg_body=body)
+
+    # ! Test section
+    def test_same_as_http(self):
+        msg = self.send(self.groups[0])
+        headers = {"HTTP_AUTHORIZATION": generate_jwt_token("bob")}
+        for method, params in [("group/info", {"group_id": self.groups[0].group_id}),
+                               ("msg/fetch", {"group_id": self.groups[0].group_id, "after_msg_id": -1}),
+                               ("msg/fetch", {"group_id": "x"}),
+                               ("group/info", {})]:
+            res = self.client.get(f"/api/{method}", data=params, **headers)
+            ret = self.call(self.bob, method, params)
+            self.assertEqual(ret["status"], res.status_code)
+            self.assertDictEqual(ret["response"], res.json())
+        self.assertEqual(rpc_stats, {"calls": 4, "failed": 2})
+        self.assertEqual(self.call(self.bob, "msg/fetch", {"group_id": self.groups[0].group_id, "after_msg_id": -1})
+                         ["response"]["msgs"][0]["msg_id"], msg.msg_id)
+
+    def test_writes(self):
+        msgs = [self.send(group) for group in self.groups]
+        ret = self.call(self.bob, "msg/ack", {"groups": {str(group.group_id): msg.msg_id for group, msg in zip(self.groups, msgs)}})
+        self.assertEqual(ret["status"], 200)
+        for group, msg in zip(self.groups, msgs):
+            self.assertEqual(Groupmember.objects.get(group=group, member_user=self.bob).ack_msg_id, msg.msg_id)
+        self.assertEqual(self.call(self.bob, "msg/delete", {"msg_id": msgs[0].msg_id})["status"], 200)
+        self.assertTrue(Userdelmsg.objects.filter(user=self.bob, msg=msgs[0]).exists())
+        self.assertEqual(self.call(self.bob, "msg/recall", {"msg_id": msgs[1].msg_id})["status"], 403)
+        self.assertEqual(self.call(self.alice, "msg/recall", {"msg_id": msgs[1].msg_id})["status"], 200)
+        self.assertEqual(Message.objects.get(msg_id=msgs[1].msg_id).msg_type, "recall")
+
+    def test_bad_requests(self):
+        ret = self.call(self.bob, "user/cancel", request_id="a")
+        self.assertEqual(ret["status"], 405)
+        self.assertEqual(ret["response"]["code"], -3)
+        for content in [{"method": "msg/ack"}, {"id": 1, "method": "msg/ack", "params": []}, {"id": [], "method": "msg/ack"}, "x"]:
+            with self.assertRaises(AssertionError):
+                call(self.bob, content)
+
+    def test_shed(self):
+        admission_state["active"] = utils_admission.ADMISSION_LIMIT
+        ret = self.call(self.bob, "msg/fetch", {"group_id": self.groups[0].group_id, "after_msg_id": -1}, request_id=5)
+        self.assertEqual(ret["status"], 503)
+        self.assertEqual(ret["retry_after"], utils_admission.ADMISSION_RETRY_AFTER)
+        self.assertEqual(ret["response"]["code"], 3)
+        self.assertEqual(admission_state["bulk"], 0)
+
+    async def test_shed_consumer(self):
+        ws = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/bob?{generate_jwt_token('bob')}&sync")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        admission_state["active"] = utils_admission.ADMISSION_LIMIT
+        await ws.send_json_to({"type": "rpc", "content": {"id": "a", "method": "msg/fetch", "params": {"group_id": self.groups[0].group_id}}})
+        ret = await ws.receive_json_from()
+        self.assertEqual(ret[0]["type"], "rpc")
+        self.assertEqual(ret[0]["content"]["id"], "a")
+        self.assertEqual(ret[0]["content"]["status"], 503)
+        admission_state["active"] = 0
+        await ws.disconnect()
+
+    async def test_consumer(self):
+        msg = await Message.objects.acreate(sender=self.alice, group=self.groups[0], msg_type="text", msg_body="hello")
+        ws = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/bob?{generate_jwt_token('bob')}&sync")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        await ws.send_json_to({"type": "rpc", "content": {"id": 7, "method": "msg/ack", "params": {"group_id": self.groups[0].group_id, "msg_id": msg.msg_id}}})
+        await ws.send_json_to({"type": "rpc", "content": {"id": 8, "method": "group/info", "params": {"group_id": self.groups[0].group_id}}})
+        answers = {}
+        while len(answers) < 2:
+            for item in await ws.receive_json_from():
+                if item["type"] == "rpc":
+                    answers[item["content"]["id"]] = item["content"]
+        self.assertEqual(answers[7]["status"], 200)
+        self.assertEqual(answers[8]["response"]["group_name"], "first")
+        self.assertEqual((await Groupmember.objects.aget(group=self.groups[0], member_user=self.bob)).ack_msg_id, msg.msg_id)
+        await ws.send_json_to({"type": "rpc", "content": {"method": "msg/ack"}})
+        self.assertEqual((await ws.receive_json_from())[0]["type"], "error")
+        await ws.disconnect()
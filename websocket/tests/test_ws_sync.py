@@ -0,0 +1,128 @@
+import json
+from django.test import TestCase
+from channels.testing.websocket import WebsocketCommunicator
+
+from im.models import User, Group, Groupmember, Message, Systemop, Systemmsg, Userdelmsg
+from websocket.consumers import ChatConsumer
+from websocket.views import fetch_sync, parse_sync
+
+from websocket.catchup import login_sync_stats
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_cursor import pending_cursors
+from utils.utils_ring import rings, fill_ring
+
+# Create your tests here.
+class SyncTests(TestCase):
+    # Initializer
+    def setUp(self):
+        for key in login_sync_stats:
+            login_sync_stats[key] = 0
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="123456", user_email="bob@163.com")
+        self.groups = []
+        for i in range(3):
+            group = Group.objects.create(group_name=f"group{i}", group_owner=self.alice)
+            Groupmember.objects.create(group=group, member_user=self.alice, member_role="admin")
+            Groupmember.objects.create(group=group, member_user=self.bob, member_role="member")
+            self.groups.append(group)
+
+    # destructor
+    def tearDown(self):
+        pending_cursors.clear()
+        rings.clear()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def send(self, group, count):
+        return [Message.objects.create(sender=self.alice, group=group, msg_type="text", msg_body=f"hello {i}").msg_id
+                for i in range(count)]
+
+    def sync(self, cursors, sysmsg_id=None, limit=None):
+        frame = json.loads(fetch_sync(self.bob, cursors, sysmsg_id, limit))
+        self.assertEqual(frame[-1]["type"], "sync")
+        return frame[:-1], frame[-1]["content"]
+
+    def get_ws(self, user_name: str, flags: str = ""):
+        token = generate_jwt_token(user_name)
+        return WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{user_name}?{token}{flags}")
+
+    # ! Test section
+    def test_deltas_only(self):
+        ids = [self.send(group, 5) for group in self.groups]
+        events, sync = self.sync({group.group_id: ids[i][2] for i, group in enumerate(self.groups)})
+        self.assertListEqual([item["content"]["msg_id"] for item in events], ids[0][3:] + ids[1][3:] + ids[2][3:])
+        for i, group in enumerate(self.groups):
+            self.assertDictEqual(sync["groups"][str(group.group_id)], {"last_msg_id": ids[i][-1], "has_more": False})
+
+    def test_up_to_date_is_empty(self):
+        ids = self.send(self.groups[0], 3)
+        events, sync = self.sync({self.groups[0].group_id: ids[-1]})
+        # groups left out start from ack_msg_id
+        self.assertEqual(len(events), 0)
+        self.assertDictEqual(sync["groups"][str(self.groups[0].group_id)], {"last_msg_id": ids[-1], "has_more": False})
+        self.assertEqual(sync["groups"][str(self.groups[1].group_id)]["last_msg_id"], -1)
+
+    def test_paging(self):
+        ids = self.send(self.groups[0], 7)
+        cursor = -1
+        pages = []
+        while True:
+            events, sync = self.sync({self.groups[0].group_id: cursor}, limit=3)
+            pages.append([item["content"]["msg_id"] for item in events])
+            cursor = sync["groups"][str(self.groups[0].group_id)]["last_msg_id"]
+            if not sync["groups"][str(self.groups[0].group_id)]["has_more"]:
+                break
+        self.assertListEqual(pages, [ids[:3], ids[3:6], ids[6:]])
+
+    def test_paging_from_ring(self):
+        ids = self.send(self.groups[0], 4)
+        fill_ring(self.groups[0], -1, list(Message.objects.filter(group=self.groups[0]).order_by("msg_id")))
+        events, sync = self.sync({self.groups[0].group_id: ids[0]}, limit=2)
+        self.assertListEqual([item["content"]["msg_id"] for item in events], ids[1:3])
+        self.assertTrue(sync["groups"][str(self.groups[0].group_id)]["has_more"])
+
+    def test_deleted_skipped(self):
+        ids = self.send(self.groups[0], 3)
+        Userdelmsg.objects.create(user=self.bob, msg_id=ids[1])
+        events, _ = self.sync({self.groups[0].group_id: -1})
+        self.assertListEqual([item["content"]["msg_id"] for item in events], [ids[0], ids[2]])
+
+    def test_sysmsg_cursor(self):
+        read = User.objects.get(user_id=self.bob.user_id).read_sysmsg_id
+        sysop = Systemop.objects.create(user=self.alice, sysop_type="", message="", need_operation=False, result="")
+        sysmsgs = [Systemmsg.objects.create(sysop=sysop, target_user=self.bob, sysmsg_type="", message="", result="").sysmsg_id
+                   for _ in range(3)]
+        events, sync = self.sync({}, sysmsg_id=sysmsgs[0], limit=1)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(sync["sysmsg_id"], sysmsgs[1])
+        self.assertTrue(sync["sysmsg_has_more"])
+        self.assertEqual(User.objects.get(user_id=self.bob.user_id).read_sysmsg_id, max(read, sysmsgs[1]))
+        # an older cursor does not move read_sysmsg_id back
+        self.sync({}, sysmsg_id=-1, limit=1)
+        self.assertEqual(User.objects.get(user_id=self.bob.user_id).read_sysmsg_id, max(read, sysmsgs[1]))
+
+    def test_parse_sync(self):
+        cursors, sysmsg_id, limit = parse_sync({"groups": {"3": 10}, "sysmsg_id": 2, "limit": 5})
+        self.assertDictEqual(cursors, {3: 10})
+        self.assertEqual((sysmsg_id, limit), (2, 5))
+        for content in [[], {"groups": []}, {"groups": {"a": 1}}, {"groups": {"1": "1"}}, {"limit": 0}, {"sysmsg_id": "1"}]:
+            with self.assertRaises(AssertionError):
+                parse_sync(content)
+
+    async def test_sync_frame(self):
+        msg = await Message.objects.acreate(sender=self.alice, group=self.groups[0], msg_type="text", msg_body="hello")
+        ws = self.get_ws("bob", "&sync")
+        connected, _ = await ws.connect()
+        self.assertTrue(connected)
+        # no catch-up for a connection asking for sync
+        self.assertTrue(await ws.receive_nothing())
+        self.assertEqual(login_sync_stats["queued"], 0)
+        await ws.send_json_to({"type": "sync", "content": {"groups": {str(self.groups[0].group_id): -1}}})
+        ret = await ws.receive_json_from()
+        self.assertListEqual([item["content"]["msg_id"] for item in ret[:-1]], [msg.msg_id])
+        self.assertEqual(ret[-1]["content"]["groups"][str(self.groups[0].group_id)]["last_msg_id"], msg.msg_id)
+        await ws.send_json_to({"type": "sync", "content": {"groups": {"x": 1}}})
+        ret = await ws.receive_json_from()
+        self.assertEqual(ret[0]["type"], "error")
+        await ws.disconnect()
@@ -0,0 +1,79 @@
+from django.test import TestCase
+from channels.testing.websocket import WebsocketCommunicator
+from asgiref.sync import async_to_sync
+
+from im.models import User, Group, Groupmember
+from websocket.consumers import ChatConsumer, SyncChatConsumer
+
+from utils.utils_jwt import generate_jwt_token
+from utils.utils_assert import assertSingleMessage
+
+# Create your tests here.
+class SyncConsumerTests(TestCase):
+    # Initializer
+    def setUp(self):
+        self.alice = User.objects.create(user_name="alice", password="123456", user_email="alice@163.com")
+        self.bob = User.objects.create(user_name="bob", password="114514", user_email="bob@163.com")
+        self.group = Group.objects.create(group_name="group")
+        Groupmember.objects.create(group=self.group, member_user=self.alice, member_role="member")
+        Groupmember.objects.create(group=self.group, member_user=self.bob, member_role="member")
+
+    # destructor
+    def tearDown(self):
+        Group.objects.all().delete()
+        User.objects.all().delete()
+
+    # ! Utility functions
+    def get_ws(self, user_name: str, consumer=ChatConsumer):
+        token = generate_jwt_token(user_name)
+        return WebsocketCommunicator(consumer.as_asgi(), f"/ws/chat/{user_name}?{token}")
+
+    # ! Test section
+    @async_to_sync
+    async def test_sync_consumer_wrong_jwt(self):
+        ws = WebsocketCommunicator(SyncChatConsumer.as_asgi(), f"/ws/chat/alice?{generate_jwt_token('bob')}")
+        connected, _ = await ws.connect()
+        self.assertFalse(connected)
+
+    @async_to_sync
+    async def test_sync_to_async_consumer(self):
+        ws_a = self.get_ws('alice', SyncChatConsumer)
+        connected, _ = await ws_a.connect()
+        self.assertTrue(connected)
+        ret = await ws_a.receive_json_from()
+        self.assertListEqual(ret, [])
+
+        ws_b = self.get_ws('bob', ChatConsumer)
+        connected, _ = await ws_b.connect()
+        self.assertTrue(connected)
+        ret = await ws_b.receive_json_from()
+        self.assertListEqual(ret, [])
+
+        await ws_a.send_json_to({
+            "type": "message",
+            "content": {
+                "group_id": self.group.group_id,
+                "msg_type": "text",
+                "msg_body": "hello",
+            }
+        })
+        ret = await ws_a.receive_json_from()
+        assertSingleMessage(self, ret, self.alice.user_id, self.group.group_id, "text", "hello")
+        ret = await ws_b.receive_json_from()
+        assertSingleMessage(self, ret, self.alice.user_id, self.group.group_id, "text", "hello")
+
+        await ws_b.send_json_to({
+            "type": "message",
+            "content": {
+                "group_id": self.group.group_id,
+                "msg_type": "text",
+                "msg_body": "hello too",
+            }
+        })
+        ret = await ws_b.receive_json_from()
+        assertSingleMessage(self, ret, self.bob.user_id, self.group.group_id, "text", "hello too")
+        ret = await ws_a.receive_json_from()
+        assertSingleMessage(self, ret, self.bob.user_id, self.group.group_id, "text", "hello too")
+
+        await ws_a.disconnect()
+        await ws_b.disconnect()
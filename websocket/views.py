@@ -1,25 +1,61 @@
-from django.db.models import Q
+from bisect import bisect_right
+
+from django.db import connection, transaction
+from django.db.models import Q, Max
+from channels.db import database_sync_to_async
 
 from im.models import User, Group, Groupmember, Message, Systemmsg, Userdelmsg
 
-from utils.utils_websocket import send_msg, online
+from utils.utils_websocket import send_frame, asend_frame, online
 from utils.utils_sysmsg import extract_sysmsg
+from utils.utils_group import get_members, is_member, fanout_on_read
+from utils.utils_frame import encode, message_text, event_text, message_event_text, hint_text, sent_text, join_frame, merge_frames
+from utils.utils_ring import recent_messages, fill_ring, ring_saved
+from utils.utils_inbox import record_offline, pending_groups
+from utils.utils_admission import admit, aadmit
+from utils.utils_dedupe import send_key, claim, settle, release
+from utils.utils_cursor import set_cursors, apply_cursors, cursors_due, flush_cursors, flush_cursors_if_due
 
+from .fanout import deliver, adeliver
 
-def login_fetch(user: User):
+SYNC_LIMIT = 50
+SYNC_MAX_LIMIT = 500
+MAX_BATCH_SIZE = 100
+# ids are 64-bit in database
+MAX_ID = (1 << 63) - 1
+
+
+def fetch_login_msgs(user: User, ids=None) -> str:
+    """
+    Collect every message not acked and every system message not read (or still operable) by user,
+    marking them as sent.
+
+    :param ids: list filled with the ids of the events of the frame, for utils.utils_device
+    :returns: the encoded frame
+    """
+    ids = [] if ids is None else ids
     ret = []
     update_list = []
-    for gm in Groupmember.objects.filter(member_user=user):
-        delids = Userdelmsg.objects.filter(user=user, msg__group=gm.group).values("msg__msg_id")
-        qset = Message.objects.filter(group=gm.group, msg_id__gt=gm.ack_msg_id).exclude(msg_id__in=delids)
+    deleted = None
+    for gm in pending_groups(user):
         max_read = -1
-        for msg in qset:
-            data = msg.serialize()
-            ret.append({
-                "type": "message",
-                "content": data,
-            })
-            max_read = max(max_read, data["msg_id"])
+        start = gm.ack_msg_id
+        recent = recent_messages(gm.group, start)
+        if recent is not None:
+            if deleted is None:
+                deleted = set(Userdelmsg.objects.filter(user=user).values_list("msg_id", flat=True))
+            for msg_id, text in recent:
+                if msg_id not in deleted:
+                    ret.append(event_text("message", text))
+                    ids.append([gm.group_id, msg_id])
+                    max_read = max(max_read, msg_id)
+        else:
+            delids = Userdelmsg.objects.filter(user=user, msg__group=gm.group).values("msg__msg_id")
+            qset = Message.objects.filter(group=gm.group, msg_id__gt=start).exclude(msg_id__in=delids).select_related("sender", "group")
+            for msg in qset:
+                ret.append(message_event_text(msg))
+                ids.append([gm.group_id, msg.msg_id])
+                max_read = max(max_read, msg.msg_id)
         
         if max_read != -1:
             gm.sent_msg_id = max_read
@@ -29,14 +65,113 @@ def login_fetch(user: User):
     
     max_read = -1
     for msg in Systemmsg.objects.filter(Q(target_user=user) & (Q(sysmsg_id__gt=user.read_sysmsg_id) | Q(can_operate=True))):
-        ret.append(extract_sysmsg(msg))
+        ret.append(encode(extract_sysmsg(msg)))
+        ids.append(None)
         max_read = max(max_read, msg.sysmsg_id)
     
     if max_read != -1:
         user.read_sysmsg_id = max_read
         user.save(update_fields=["read_sysmsg_id"])
     
-    send_msg(user.user_name, ret)
+    return join_frame(ret)
+
+
+def fetch_sync(user: User, cursors: dict, sysmsg_id=None, limit=None) -> str:
+    """
+    Answer a sync request: for each group of user, the messages after its cursor, at most limit of
+    them, oldest first; then the system messages after sysmsg_id, at most limit as well. The frame
+    ends with a "sync" event telling, for each group and for system messages, the last id sent and
+    whether more are left (has_more), to be asked for by another sync request from there.
+
+    :param cursors: group_id -> last msg_id the client has, groups left out start from ack_msg_id
+    :param sysmsg_id: last sysmsg_id the client has, read_sysmsg_id if None
+    :returns: the encoded frame
+    """
+    limit = min(limit or SYNC_LIMIT, SYNC_MAX_LIMIT)
+    ret = []
+    groups = {}
+    deleted = None
+    for gm in Groupmember.objects.filter(member_user=user).select_related("group"):
+        cursor = cursors.get(gm.group_id, gm.ack_msg_id)
+        recent = recent_messages(gm.group, cursor)
+        if recent is not None:
+            if deleted is None:
+                deleted = set(Userdelmsg.objects.filter(user=user).values_list("msg_id", flat=True))
+            window = [(msg_id, text) for msg_id, text in recent if msg_id not in deleted][:limit + 1]
+        else:
+            delids = Userdelmsg.objects.filter(user=user, msg__group=gm.group).values("msg__msg_id")
+            qset = Message.objects.filter(group=gm.group, msg_id__gt=cursor).exclude(msg_id__in=delids) \
+                .order_by("msg_id").select_related("sender", "group")[:limit + 1]
+            window = [(msg.msg_id, message_text(msg)) for msg in qset]
+        ret += [event_text("message", text) for _, text in window[:limit]]
+        last_msg_id = window[:limit][-1][0] if window else cursor
+        groups[gm.group_id] = {"last_msg_id": last_msg_id, "has_more": len(window) > limit}
+        if last_msg_id > gm.sent_msg_id:
+            set_cursors(gm.group_id, [user.user_id], last_msg_id)
+
+    sysmsg_id = user.read_sysmsg_id if sysmsg_id is None else sysmsg_id
+    sysmsgs = list(Systemmsg.objects.filter(target_user=user, sysmsg_id__gt=sysmsg_id).order_by("sysmsg_id")[:limit + 1])
+    ret += [encode(extract_sysmsg(msg)) for msg in sysmsgs[:limit]]
+    if len(sysmsgs) > 0:
+        sysmsg_id = sysmsgs[:limit][-1].sysmsg_id
+        User.objects.filter(user_id=user.user_id, read_sysmsg_id__lt=sysmsg_id).update(read_sysmsg_id=sysmsg_id)
+
+    ret.append(event_text("sync", encode({
+        "groups": groups,
+        "sysmsg_id": sysmsg_id,
+        "sysmsg_has_more": len(sysmsgs) > limit,
+    })))
+    return join_frame(ret)
+
+
+def login_fetch(user: User):
+    ids = []
+    with admit("bulk"):
+        frame = fetch_login_msgs(user, ids)
+    send_frame(user.user_name, frame, ids=ids, catchup=True)
+
+
+def fetch_message_windows(members: list, new_msg: Message) -> list:
+    """
+    Collect, for each member, messages in the group with id > its sent_msg_id, plus new_msg whatever its sent_msg_id
+    (a recall of a message already sent).
+    The whole window is read from the ring of the group (utils.utils_ring), or on a miss by one query starting from
+    the smallest sent_msg_id, every message is encoded once, and members with the same window share the same frame.
+
+    :returns: list of (member, encoded frame, ids of its events for utils.utils_device)
+    """
+    if not members:
+        return []
+    apply_cursors(members)
+    lowest = min(gm.sent_msg_id for gm in members)
+    window = recent_messages(new_msg.group, lowest)
+    if window is None:
+        messages = list(Message.objects.filter(group_id=new_msg.group_id, msg_id__gt=lowest).select_related("sender", "group").order_by("msg_id"))
+        fill_ring(new_msg.group, lowest, messages)
+        window = [(msg.msg_id, message_text(msg)) for msg in messages]
+    ids = [msg_id for msg_id, _ in window]
+    texts = [event_text("message", text) for _, text in window]
+    if new_msg.msg_id not in set(ids):
+        texts.append(message_event_text(new_msg, cached=not new_msg._state.adding))
+        ids.append(float("inf"))
+
+    # new_msg goes to every device, whether it had it before or not: it may be a recall
+    event_ids = [[new_msg.group_id, new_msg.msg_id, True] if msg_id in (new_msg.msg_id, float("inf"))
+                 else [new_msg.group_id, msg_id] for msg_id in ids]
+
+    new = len(ids) - 1 if ids[-1] == float("inf") else ids.index(new_msg.msg_id)
+
+    frames = {}
+    ret = []
+    for gm in members:
+        start = bisect_right(ids, gm.sent_msg_id)
+        if start not in frames:
+            # a member past new_msg still gets it, ahead of what follows it
+            head = [new] if start > new else []
+            frames[start] = (join_frame([texts[i] for i in head] + texts[start:]), [event_ids[i] for i in head] + event_ids[start:])
+        if frames[start][1]:
+            ret.append((gm, *frames[start]))
+    return ret
 
 
 def push_message(gm: Groupmember, new_msg: Message) -> bool:
@@ -47,24 +182,131 @@ def push_message(gm: Groupmember, new_msg: Message) -> bool:
     :param new_msg: generated message, may be not in database
     :returns: user online or not
     """
-    new_msg_id = new_msg.msg_id
-    user = gm.member_user
-    group = gm.group
-    if online(user.user_name):
-        msgs = [{
-            "type": "message",
-            "content": msg.serialize(),
-        } for msg in Message.objects.filter(group=group, msg_id__gt=gm.sent_msg_id)]
-        if new_msg_id not in set(msg["content"]["msg_id"] for msg in msgs):
-            msgs.append({
-                "type": "message",
-                "content": new_msg.serialize(),
-            })
-        send_msg(user.user_name, msgs)
-        gm.sent_msg_id = max(new_msg_id, gm.sent_msg_id)
-        return True
+    return len(push_group_message([gm], new_msg)) > 0
+
+
+def sender_first(windows: list, new_msg: Message):
+    """
+    Split the (member, frame, ids) of fetch_message_windows into the (user_name, frame, ids) of the other
+    members and that of the sender of new_msg, None if it is not among them.
+    """
+    frames = []
+    first = None
+    for gm, frame, ids in windows:
+        if gm.member_user_id == new_msg.sender_id:
+            first = (gm.member_user.user_name, frame, ids)
+        else:
+            frames.append((gm.member_user.user_name, frame, ids))
+    return frames, first
+
+
+def push_group_message(members: list, new_msg: Message) -> list:
+    """
+    push_message for every member of a group, with a single query whatever the number of online members.
+    Load members with select_related("member_user") to keep it that way.
+
+    Frames are sent by websocket.fanout, the sender's echo first.
+    Their new sent_msg_id is recorded in utils.utils_cursor, to be written later.
+
+    :returns: members online
+    """
+    members = [gm for gm in members if online(gm.member_user.user_name)]
+    deliver(*sender_first(fetch_message_windows(members, new_msg), new_msg))
+    for gm in members:
+        gm.sent_msg_id = max(new_msg.msg_id, gm.sent_msg_id)
+    set_cursors(new_msg.group_id, [gm.member_user_id for gm in members], new_msg.msg_id)
+    return members
+
+
+def push_hint(user_names: list, new_msg: Message) -> list:
+    """
+    Tell user_names that the group of new_msg has a new (or recalled) message, to be pulled with msg/fetch.
+    Every user gets the same frame, and delivery cursors are left alone: no query at all.
+
+    :returns: user_names
+    """
+    frame = join_frame([hint_text(new_msg.group_id, new_msg.msg_id, new_msg.msg_type)])
+    deliver([(user_name, frame) for user_name in user_names])
+    return user_names
+
+
+def push_group(new_msg: Message) -> int:
+    """
+    Deliver new_msg to the online members of its group: the messages themselves for ordinary groups
+    (push_group_message), a hint for groups above FANOUT_READ_THRESHOLD members (push_hint).
+
+    :returns: number of online members
+    """
+    record_offline(new_msg)
+    if fanout_on_read(new_msg.group_id):
+        return len(push_hint(hint_receivers(new_msg.group_id), new_msg))
+    return len(push_group_message(online_members(new_msg.group_id), new_msg))
+
+
+def batch_frames(msgs: list):
+    """
+    The frames of a batch of messages from one sender (create_messages), one per recipient whatever the
+    number of messages and groups: the window of each group (fetch_message_windows on its last message)
+    or its hint, merged.
+
+    :returns: (user_name, frame, ids) of the other recipients, that of the sender (None if not online),
+              and the (group_id, user_ids, msg_id) delivery cursors to record once sent
+    """
+    groups = {}
+    for msg in msgs:
+        record_offline(msg)
+        groups.setdefault(msg.group_id, []).append(msg)
+    parts = {}
+    cursors = []
+    for group_id, group_msgs in groups.items():
+        last = group_msgs[-1]
+        if fanout_on_read(group_id):
+            frame = join_frame([hint_text(group_id, last.msg_id, last.msg_type)])
+            for user_name in hint_receivers(group_id):
+                parts.setdefault(user_name, []).append((frame, [None]))
+            continue
+        members = online_members(group_id)
+        for gm, frame, ids in fetch_message_windows(members, last):
+            parts.setdefault(gm.member_user.user_name, []).append((frame, ids))
+        cursors.append((group_id, [gm.member_user_id for gm in members], last.msg_id))
+
+    sender = msgs[0].sender.user_name
+    frames = []
+    first = None
+    for user_name, items in parts.items():
+        item = (user_name, merge_frames([frame for frame, _ in items]), [i for _, ids in items for i in ids])
+        if user_name == sender:
+            first = item
+        else:
+            frames.append(item)
+    return frames, first, cursors
+
+
+def push_batch(msgs: list):
+    """
+    Deliver a batch of messages from one sender (create_messages) in one fan-out, see batch_frames.
+    """
+    frames, first, cursors = batch_frames(msgs)
+    deliver(frames, first)
+    for group_id, user_ids, msg_id in cursors:
+        set_cursors(group_id, user_ids, msg_id)
+
+
+def fetch_sysmsg_window(user: User, new_sysmsg_id: int) -> str:
+    """
+    Collect system messages of user with id > read_sysmsg_id, plus the new one if it is missing.
+    """
+    lost_new = True
+    ret = []
+    for msg in Systemmsg.objects.filter(target_user=user, sysmsg_id__gt=user.read_sysmsg_id):
+        ret.append(extract_sysmsg(msg))
+        if msg.sysmsg_id == new_sysmsg_id:
+            lost_new = False
     
-    return False
+    if lost_new:
+        msg = Systemmsg.objects.filter(sysmsg_id=new_sysmsg_id).first()
+        ret.append(extract_sysmsg(msg))
+    return join_frame([encode(item) for item in ret])
 
 
 def push_sysmsg(user: User, new_sysmsg_id: int) -> bool:
@@ -76,28 +318,65 @@ def push_sysmsg(user: User, new_sysmsg_id: int) -> bool:
     :returns: user online or not
     """
     if online(user.user_name):
-        lost_new = True
-        ret = []
-        for msg in Systemmsg.objects.filter(target_user=user, sysmsg_id__gt=user.read_sysmsg_id):
-            ret.append(extract_sysmsg(msg))
-            if msg.sysmsg_id == new_sysmsg_id:
-                lost_new = False
-        
-        if lost_new:
-            msg = Systemmsg.objects.filter(sysmsg_id=new_sysmsg_id).first()
-            ret.append(extract_sysmsg(msg))
-        
-        send_msg(user.user_name, ret)
+        send_frame(user.user_name, fetch_sysmsg_window(user, new_sysmsg_id), "sysmsg")
         user.read_sysmsg_id = new_sysmsg_id
         return True
 
     return False
 
 
-def on_message(user_name: str, content: dict):
-    keys = set(content.keys())
+def push_sysmsgs(targets: list) -> list:
+    """
+    push_sysmsg for each (user, new_sysmsg_id) of targets, then save read_sysmsg_id of the users online.
+
+    :returns: users online
+    """
+    update_user = []
+    for user, new_sysmsg_id in targets:
+        if push_sysmsg(user, new_sysmsg_id) and user not in update_user:
+            update_user.append(user)
+    if update_user:
+        User.objects.bulk_update(update_user, fields=["read_sysmsg_id"])
+    return update_user
+
+
+def online_members(group_id) -> list:
+    """
+    Members of the group with a websocket connection, loaded for push_group_message.
+    Membership is read from the group cache, the query only fetches delivery cursors of online members.
+    """
+    user_ids = [user_id for user_id, member in get_members(group_id).items() if online(member.user_name)]
+    if not user_ids:
+        return []
+    return list(Groupmember.objects.filter(group_id=group_id, member_user_id__in=user_ids).select_related("member_user"))
+
+
+def hint_receivers(group_id) -> list:
+    """
+    User names of the online members of the group, read from the group cache only.
+    """
+    return [member.user_name for member in get_members(group_id).values() if online(member.user_name)]
+
+
+def check_content(content: dict):
+    """
+    Check the format of a message.content.
+    """
+    assert isinstance(content, dict), "Incorrect json format for message.content"
+    keys = set(content.keys()) - {"client_msg_id"}
     assert keys == {"group_id", "msg_type", "msg_body"} \
         or keys == {"group_id", "msg_type", "msg_body", "reply_msg_id"}, "Incorrect json format for message.content"
+    reply_msg_id = content.get("reply_msg_id")
+    assert reply_msg_id is None or isinstance(reply_msg_id, int) , "invalid type of reply_msg_id"
+
+
+def create_message(user_name: str, content: dict):
+    """
+    Validate message.content sent by user_name and save the message.
+
+    :returns: the new message, and the online members of its group (their user names if it is delivered by hints)
+    """
+    check_content(content)
 
     user = User.objects.filter(user_name=user_name).first()
     assert user is not None, f"user {user_name} does not exist"
@@ -106,11 +385,9 @@ def on_message(user_name: str, content: dict):
     group = Group.objects.filter(group_id=group_id).first()
     assert group is not None, f"group with id {group_id} does not exist"
 
-    gm_1 = Groupmember.objects.filter(group=group, member_user=user).first()
-    assert gm_1 is not None, f"user {user_name} is not in group {group.group_id}"
+    assert is_member(group.group_id, user.user_id), f"user {user_name} is not in group {group.group_id}"
 
     reply_msg_id = content.get("reply_msg_id")
-    assert reply_msg_id is None or isinstance(reply_msg_id, int) , "invalid type of reply_msg_id"
     if reply_msg_id is not None:
         reply_msg = Message.objects.filter(msg_id=reply_msg_id).first()
         assert reply_msg is not None, "reply message does not exist"
@@ -124,10 +401,325 @@ def on_message(user_name: str, content: dict):
         msg_body=content["msg_body"],
         reply_msg_id=reply_msg_id,
     )
+    record_offline(msg)
+    if fanout_on_read(group.group_id):
+        return msg, hint_receivers(group.group_id)
+    return msg, online_members(group.group_id)
 
-    update_list = []
-    for member in Groupmember.objects.filter(group=group):
-        if push_message(member, msg):
-            update_list.append(member)
-    
-    Groupmember.objects.bulk_update(update_list, fields=["sent_msg_id"])
+
+def create_messages(user_name: str, contents: list) -> list:
+    """
+    Validate a batch of message.content sent by user_name together, with one query for the groups and one
+    for the replies whatever the size of the batch, and save them by one bulk_create in one transaction:
+    every message of the batch is stored, or none.
+
+    :returns: the new messages, in the order of contents
+    """
+    assert isinstance(contents, list) and 0 < len(contents) <= MAX_BATCH_SIZE, \
+        f"a message batch holds 1 to {MAX_BATCH_SIZE} messages"
+    for content in contents:
+        check_content(content)
+
+    user = User.objects.filter(user_name=user_name).first()
+    assert user is not None, f"user {user_name} does not exist"
+
+    groups = {str(group.group_id): group for group in
+              Group.objects.filter(group_id__in={content["group_id"] for content in contents})}
+    reply_ids = {content["reply_msg_id"] for content in contents if content.get("reply_msg_id") is not None}
+    replies = Message.objects.in_bulk(reply_ids) if reply_ids else {}
+
+    msgs = []
+    for content in contents:
+        group_id = content["group_id"]
+        group = groups.get(str(group_id))
+        assert group is not None, f"group with id {group_id} does not exist"
+        assert is_member(group.group_id, user.user_id), f"user {user_name} is not in group {group.group_id}"
+        reply_msg_id = content.get("reply_msg_id")
+        if reply_msg_id is not None:
+            reply_msg = replies.get(reply_msg_id)
+            assert reply_msg is not None, "reply message does not exist"
+            assert reply_msg.group_id == group.group_id, "reply message is not in the group"
+            assert reply_msg.msg_type != "recall", "reply message is recalled"
+        msgs.append(Message(
+            sender=user,
+            group=group,
+            msg_type=content["msg_type"],
+            msg_body=content["msg_body"],
+            reply_msg_id=reply_msg_id,
+        ))
+
+    bulk = connection.features.can_return_rows_from_bulk_insert
+    with transaction.atomic():
+        if bulk:
+            Message.objects.bulk_create(msgs)
+        else:
+            # no ids back from bulk_create on this database
+            for msg in msgs:
+                msg.save()
+    if bulk:
+        # bulk_create sends no post_save, the rings are fed here as by im/signals.py
+        for msg in msgs:
+            ring_saved(msg, True)
+    return msgs
+
+
+def parse_cursors(groups) -> dict:
+    """
+    Check {group_id: msg_id} sent by a client.
+
+    :returns: the same with int keys
+    """
+    assert isinstance(groups, dict), "invalid type of groups"
+    cursors = {}
+    for group_id, msg_id in groups.items():
+        assert str(group_id).isdigit() and int(group_id) <= MAX_ID, "invalid group cursor"
+        assert isinstance(msg_id, int) and not isinstance(msg_id, bool) and -1 <= msg_id <= MAX_ID, "invalid group cursor"
+        cursors[int(group_id)] = msg_id
+    return cursors
+
+
+def parse_sync(content: dict):
+    """
+    Check a sync request {"groups": {group_id: last_msg_id}, "sysmsg_id": int, "limit": int}, every key optional.
+
+    :returns: cursors, sysmsg_id, limit
+    """
+    assert isinstance(content, dict), "invalid sync request"
+    cursors = parse_cursors(content.get("groups", {}))
+    sysmsg_id = content.get("sysmsg_id")
+    assert sysmsg_id is None or isinstance(sysmsg_id, int), "invalid type of sysmsg_id"
+    limit = content.get("limit")
+    assert limit is None or (isinstance(limit, int) and limit > 0), "invalid limit"
+    return cursors, sysmsg_id, limit
+
+
+def sync_user(user_name: str, cursors: dict, sysmsg_id=None, limit=None) -> str:
+    user = User.objects.filter(user_name=user_name).first()
+    assert user is not None, "user does not exist"
+    return fetch_sync(user, cursors, sysmsg_id, limit)
+
+
+def on_sync(user_name: str, content: dict) -> str:
+    cursors, sysmsg_id, limit = parse_sync(content)
+    with admit("bulk"):
+        return sync_user(user_name, cursors, sysmsg_id, limit)
+
+
+def on_delivered(user_id, content: dict) -> dict:
+    """
+    Check a "delivered" frame {group_id: msg_id}: the client has every message of these groups up to
+    msg_id. Groups user_id is not a member of are left out, a msg_id past the latest message of its
+    group is brought back to it; one query.
+
+    :returns: the cursors, for the retransmit window of the connection (websocket/retransmit.py)
+    """
+    cursors = parse_cursors(content)
+    if not cursors:
+        return {}
+    latest = Message.objects.filter(group_id__in=cursors.keys(),
+                                    group__groupmember__member_user_id=user_id).values("group_id").annotate(latest=Max("msg_id"))
+    return {item["group_id"]: min(cursors[item["group_id"]], item["latest"]) for item in latest}
+
+
+def sent_frame(key, msg_id):
+    """Answer to a send with a client_msg_id, for the connection it came from."""
+    return join_frame([sent_text(key[1], msg_id)])
+
+
+def on_message(user_name: str, content: dict):
+    """
+    Store and push a message sent by user_name. A retry of a send with a client_msg_id is not stored
+    again, see utils.utils_dedupe.
+
+    :returns: the "sent" frame for a send with a client_msg_id, None otherwise or for a retry still in flight
+    """
+    key = send_key(user_name, content)
+    if key is not None:
+        first, msg_id = claim(key)
+        if not first:
+            return sent_frame(key, msg_id) if msg_id is not None else None
+    try:
+        with admit("chat"):
+            msg, members = create_message(user_name, content)
+
+            if members and isinstance(members[0], str):
+                push_hint(members, msg)
+            else:
+                push_group_message(members, msg)
+            flush_cursors_if_due()
+    except BaseException:
+        if key is not None:
+            release(key)
+        raise
+    if key is not None:
+        settle(key, msg.msg_id)
+        return sent_frame(key, msg.msg_id)
+
+
+def claim_batch(user_name: str, contents: list):
+    """
+    Claim the client_msg_id of each send of a batch (utils.utils_dedupe).
+
+    :returns: the (key, content) to store, key None without client_msg_id, and the "sent" events of the retries
+    """
+    assert isinstance(contents, list) and 0 < len(contents) <= MAX_BATCH_SIZE, \
+        f"a message batch holds 1 to {MAX_BATCH_SIZE} messages"
+    keys = [send_key(user_name, content) for content in contents]
+    batch = []
+    sent = []
+    for key, content in zip(keys, contents):
+        first, msg_id = claim(key) if key is not None else (True, None)
+        if first:
+            batch.append((key, content))
+        elif msg_id is not None:
+            sent.append(sent_text(key[1], msg_id))
+    return batch, sent
+
+
+def settle_batch(batch: list, msgs: list, sent: list):
+    """
+    Record the msg_id of each send of a batch stored as msgs, see claim_batch.
+
+    :returns: the "sent" frame, None if no send has a client_msg_id
+    """
+    for (key, _), msg in zip(batch, msgs):
+        if key is not None:
+            settle(key, msg.msg_id)
+            sent.append(sent_text(key[1], msg.msg_id))
+    return join_frame(sent) if sent else None
+
+
+def release_batch(batch: list):
+    for key, _ in batch:
+        if key is not None:
+            release(key)
+
+
+def on_messages(user_name: str, contents: list):
+    """
+    Store a batch of messages sent by user_name in one frame, in one transaction (create_messages), and push
+    them in one fan-out (push_batch). Retries are dropped as in on_message.
+
+    :returns: the "sent" frame for the sends with a client_msg_id, None if there is none
+    """
+    batch, sent = claim_batch(user_name, contents)
+    msgs = []
+    try:
+        if batch:
+            with admit("chat"):
+                msgs = create_messages(user_name, [content for _, content in batch])
+                push_batch(msgs)
+                flush_cursors_if_due()
+    except BaseException:
+        release_batch(batch)
+        raise
+    return settle_batch(batch, msgs, sent)
+
+
+# ! Async versions for the async ChatConsumer: database work is handed to the
+# ! database thread in one piece, sending stays on the event loop
+
+async def alogin_fetch(user: User):
+    ids = []
+    async with aadmit("bulk"):
+        frame = await database_sync_to_async(fetch_login_msgs)(user, ids)
+    await asend_frame(user.user_name, frame, ids=ids, catchup=True)
+
+
+async def aon_sync(user_name: str, content: dict) -> str:
+    cursors, sysmsg_id, limit = parse_sync(content)
+    async with aadmit("bulk"):
+        return await database_sync_to_async(sync_user)(user_name, cursors, sysmsg_id, limit)
+
+
+async def apush_message(gm: Groupmember, new_msg: Message) -> bool:
+    """
+    Async version of push_message.
+    """
+    return len(await apush_group_message([gm], new_msg)) > 0
+
+
+async def apush_group_message(members: list, new_msg: Message) -> list:
+    """
+    Async version of push_group_message.
+    """
+    members = [gm for gm in members if online(gm.member_user.user_name)]
+    windows = await database_sync_to_async(fetch_message_windows)(members, new_msg)
+    await adeliver(*sender_first(windows, new_msg))
+    for gm in members:
+        gm.sent_msg_id = max(new_msg.msg_id, gm.sent_msg_id)
+    set_cursors(new_msg.group_id, [gm.member_user_id for gm in members], new_msg.msg_id)
+    return members
+
+
+async def apush_hint(user_names: list, new_msg: Message) -> list:
+    """
+    Async version of push_hint.
+    """
+    frame = join_frame([hint_text(new_msg.group_id, new_msg.msg_id, new_msg.msg_type)])
+    await adeliver([(user_name, frame) for user_name in user_names])
+    return user_names
+
+
+async def apush_sysmsg(user: User, new_sysmsg_id: int) -> bool:
+    """
+    Async version of push_sysmsg.
+    """
+    if online(user.user_name):
+        frame = await database_sync_to_async(fetch_sysmsg_window)(user, new_sysmsg_id)
+        await asend_frame(user.user_name, frame, "sysmsg")
+        user.read_sysmsg_id = new_sysmsg_id
+        return True
+
+    return False
+
+
+async def aon_message(user_name: str, content: dict):
+    key = send_key(user_name, content)
+    if key is not None:
+        first, msg_id = claim(key)
+        if not first:
+            return sent_frame(key, msg_id) if msg_id is not None else None
+    try:
+        async with aadmit("chat"):
+            msg, members = await database_sync_to_async(create_message)(user_name, content)
+
+            if members and isinstance(members[0], str):
+                await apush_hint(members, msg)
+            else:
+                await apush_group_message(members, msg)
+            if cursors_due():
+                await database_sync_to_async(flush_cursors)()
+    except BaseException:
+        if key is not None:
+            release(key)
+        raise
+    if key is not None:
+        settle(key, msg.msg_id)
+        return sent_frame(key, msg.msg_id)
+
+
+async def apush_batch(msgs: list):
+    """
+    Async version of push_batch.
+    """
+    frames, first, cursors = await database_sync_to_async(batch_frames)(msgs)
+    await adeliver(frames, first)
+    for group_id, user_ids, msg_id in cursors:
+        set_cursors(group_id, user_ids, msg_id)
+
+
+async def aon_messages(user_name: str, contents: list):
+    batch, sent = claim_batch(user_name, contents)
+    msgs = []
+    try:
+        if batch:
+            async with aadmit("chat"):
+                msgs = await database_sync_to_async(create_messages)(user_name, [content for _, content in batch])
+                await apush_batch(msgs)
+                if cursors_due():
+                    await database_sync_to_async(flush_cursors)()
+    except BaseException:
+        release_batch(batch)
+        raise
+    return settle_batch(batch, msgs, sent)